@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Embedding export.
+
+The row and column embeddings are written as .npy files (row_embedding.npy, col_embedding.npy),
+that can be opened with np.load(mmap_mode='r') without reading or copying them, together with a
+metadata.tsv file with the title of each row, one per line, in the format of the TensorBoard
+projector. vectors.tsv, the projector vectors file, is optional.
+
+Export the weights of a training run with:
+  python -m wiki_entity_vec.embedding.export --weights=<dir>/weights.npz \\
+      --page_dictionary=pages.txt --output_dir=<dir> [--dtype=float16] [--tsv]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+
+ROW_EMBEDDING = 'row_embedding'
+COL_EMBEDDING = 'col_embedding'
+METADATA = 'metadata.tsv'
+VECTORS = 'vectors.tsv'
+
+DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+}
+
+# format_tsv() writes 2 digit exponents: the magnitudes must be 0 or within [TSV_MIN, TSV_MAX).
+TSV_MIN = 1e-99
+TSV_MAX = 1e99
+# Powers of 10 indexed by exponent + _POW10_OFFSET.
+_POW10_OFFSET = 110
+_POW10 = 10.0 ** np.arange(-_POW10_OFFSET, _POW10_OFFSET)
+
+
+def read_weights(filename):
+    """ Returns the row and column embeddings saved by train.save_weights(). """
+    with np.load(filename) as npz:
+        return npz[npz.files[0]], npz[npz.files[1]]
+
+
+def split_weights(x, shape, embedding_size):
+    """ Returns the row and column embeddings from the flat weights vector of the optimizer. """
+    n_row_weights = shape[0] * embedding_size
+    rows = x[:n_row_weights].reshape(shape[0], embedding_size)
+    cols = x[n_row_weights:n_row_weights + shape[1] * embedding_size].reshape(shape[1], embedding_size)
+    return rows, cols
+
+
+def save_embedding(filename, x, dtype=np.float32, chunk_rows=64*1024):
+    """ Writes a 2-D array as a .npy file, converted to dtype one chunk of rows at a time.
+    The file is written to a temporary name and renamed when complete.
+    """
+    tmp_filename = filename + '.tmp'
+    output = np.lib.format.open_memmap(tmp_filename, mode='w+', dtype=dtype, shape=x.shape)
+    for start in range(0, x.shape[0], chunk_rows):
+        output[start:start + chunk_rows] = x[start:start + chunk_rows]
+    output.flush()
+    del output
+    os.rename(tmp_filename, filename)
+
+
+def write_metadata(filename, dictionary, count=None, chunk_rows=64*1024):
+    """ Writes the names of the dictionary ids [0, count), one per line. """
+    count = dictionary.size() if count is None else count
+    with open(filename, 'w', encoding='utf-8') as file:
+        for start in range(0, count, chunk_rows):
+            names = dictionary.names(np.arange(start, min(start + chunk_rows, count)))
+            file.write('\n'.join(names))
+            file.write('\n')
+
+
+def format_tsv(x, digits=9):
+    """ Formats a 2-D array as tab separated lines of numbers in scientific notation, with up to
+    digits (at most 9) significant digits, e.g. -1.2345e-02. 9 digits keep all the digits of a
+    float32. The magnitudes must be 0 or in [TSV_MIN, TSV_MAX), which includes all the finite
+    float32 values.
+
+    Every number is first written into a fixed width layout of ASCII bytes with integer
+    operations over the whole array. The positions that are not used (plus sign, trailing zeros
+    of the mantissa) are zero bytes, removed by a single mask. Returns bytes.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n_cols = x.shape[1]
+    values = x.ravel()
+    magnitude = np.abs(values)
+    nonzero = magnitude > 0
+    exponent = np.zeros(values.shape, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero]))
+    scale = 10 ** (digits - 1)
+    mantissa = np.rint(magnitude / _POW10[exponent + _POW10_OFFSET] * scale).astype(np.int64)
+    # log10 may be off by one at powers of 10, and rounding may carry into a new digit.
+    low = nonzero & (mantissa < scale)
+    exponent[low] -= 1
+    high = mantissa >= 10 * scale
+    exponent[high] += 1
+    fix = low | high
+    mantissa[fix] = np.rint(magnitude[fix] / _POW10[exponent[fix] + _POW10_OFFSET] * scale).astype(np.int64)
+
+    # sign, digit, '.', digits - 1 decimals, 'e', exponent sign, 2 exponent digits, separator.
+    # The layout is filled one position (row of out) at a time and transposed at the end.
+    out = np.zeros((digits + 7, len(values)), dtype=np.uint8)
+    out[0] = np.where(np.signbit(values), ord('-'), 0)
+    mantissa = mantissa.astype(np.uint32)
+    trailing = np.ones(values.shape, dtype=bool)
+    for position in range(digits + 1, 2, -1):
+        digit = (mantissa % 10).astype(np.uint8)
+        mantissa //= 10
+        trailing &= digit == 0
+        out[position] = np.where(trailing, 0, digit + ord('0'))
+    out[1] = mantissa + ord('0')
+    out[2] = np.where(trailing, 0, ord('.'))
+    out[digits + 2] = ord('e')
+    out[digits + 3] = np.where(exponent < 0, ord('-'), ord('+'))
+    abs_exponent = np.abs(exponent).astype(np.uint8)
+    out[digits + 4] = abs_exponent // 10 + ord('0')
+    out[digits + 5] = abs_exponent % 10 + ord('0')
+    out[digits + 6] = ord('\t')
+    out[digits + 6, n_cols - 1::n_cols] = ord('\n')
+    out = out.T.ravel()
+    return out[out != 0].tobytes()
+
+
+def write_tsv(filename, x, digits=9, chunk_rows=16*1024):
+    """ Writes a 2-D array as tab separated text, one row per line, chunk_rows at a time.
+    The chunks with values out of the range of format_tsv(), such as NaN, are formatted with '%g'.
+    """
+    line = '\t'.join(['%.{0}g'.format(digits)] * x.shape[1]) + '\n'
+    with open(filename, 'wb') as file:
+        for start in range(0, x.shape[0], chunk_rows):
+            chunk = np.asarray(x[start:start + chunk_rows], dtype=np.float64)
+            if chunk.size == 0:
+                continue
+            magnitude = np.abs(chunk)
+            if np.all((magnitude < TSV_MAX) & ((magnitude >= TSV_MIN) | (magnitude == 0))):
+                file.write(format_tsv(chunk, digits=digits))
+            else:
+                file.write(((line * len(chunk)) % tuple(chunk.ravel().tolist())).encode('ascii'))
+
+
+def export(output_dir, row_embedding, col_embedding=None, page_dict=None, dtype=np.float32, tsv=False):
+    """ Writes the embedding files to output_dir. """
+    os.makedirs(output_dir, exist_ok=True)
+    save_embedding(os.path.join(output_dir, ROW_EMBEDDING + '.npy'), row_embedding, dtype=dtype)
+    if col_embedding is not None:
+        save_embedding(os.path.join(output_dir, COL_EMBEDDING + '.npy'), col_embedding, dtype=dtype)
+    if page_dict is not None:
+        write_metadata(os.path.join(output_dir, METADATA), page_dict, count=row_embedding.shape[0])
+    if tsv:
+        write_tsv(os.path.join(output_dir, VECTORS), row_embedding)
+
+
+def load_embedding(directory, name=ROW_EMBEDDING, mmap_mode='r'):
+    """ Opens an exported embedding. With mmap_mode, the array is a view of the file. """
+    return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+
+
+def load_metadata(directory):
+    """ Returns the list of row titles of an export. """
+    with open(os.path.join(directory, METADATA), 'r', encoding='utf-8') as file:
+        return file.read().split('\n')[:-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export trained embeddings')
+    parser.add_argument('--weights', required=True, help='weights.npz file written by train.py')
+    parser.add_argument('--page_dictionary', help='Writes the metadata.tsv row titles')
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--dtype', choices=sorted(DTYPES.keys()), default='float32')
+    parser.add_argument('--tsv', action='store_true', help='Also write the vectors.tsv text file')
+    args = parser.parse_args()
+
+    page_dict = None
+    if args.page_dictionary:
+        from ..util.dictionary import load_dictionary
+        page_dict = load_dictionary(args.page_dictionary, cache=True)
+
+    rows, cols = read_weights(args.weights)
+    export(args.output_dir, rows, cols, page_dict=page_dict, dtype=DTYPES[args.dtype], tsv=args.tsv)
+    print('Exported {0} rows, {1} columns'.format(rows.shape[0], cols.shape[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the vectors.tsv writer of train.save_result() with the export module.
+
+Writes a random embedding with the per value str() join, write_tsv() and save_embedding(), and
+opens the results: the text file is parsed, the .npy file is memory mapped.
+
+Usage: python -m wiki_entity_vec.embedding.export_benchmark [--rows=N] [--embedding_size=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .export import save_embedding, write_tsv
+
+
+def write_legacy(filename, x):
+    with open(filename, 'w') as file:
+        for row in x:
+            file.write('\t'.join([str(v) for v in row]))
+            file.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedding export benchmark')
+    parser.add_argument('--rows', type=int, default=200*1000)
+    parser.add_argument('--embedding_size', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(20190325)
+    x = rng.normal(scale=0.1, size=(args.rows, args.embedding_size)).astype(np.float32)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, fn, filename in [
+                ('str() join', write_legacy, 'legacy.tsv'),
+                ('write_tsv', write_tsv, 'vectors.tsv'),
+                ('npy float32', lambda f, v: save_embedding(f, v), 'float32.npy'),
+                ('npy float16', lambda f, v: save_embedding(f, v, dtype=np.float16), 'float16.npy')]:
+            filename = os.path.join(tmpdir, filename)
+            start = time.time()
+            fn(filename, x)
+            write_time = time.time() - start
+
+            start = time.time()
+            if filename.endswith('.npy'):
+                y = np.load(filename, mmap_mode='r')
+            else:
+                with open(filename, 'r') as file:
+                    y = np.array(file.read().split(), dtype=np.float32).reshape(x.shape)
+            load_time = time.time() - start
+            assert y.shape == x.shape
+            print('{0:>12}: write {1:>7.2f}s {2:>8.1f} MB, load {3:>9.4f}s'.format(
+                name, write_time, os.path.getsize(filename) / 1e6, load_time))
+            del y
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+from wiki_entity_vec.util.dictionary import CompactDictionary
+from wiki_entity_vec.embedding.export import (COL_EMBEDDING, METADATA, VECTORS, export, format_tsv, load_embedding,
+                                              load_metadata, read_weights, split_weights, write_tsv)
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        rng = np.random.RandomState(20190325)
+        self._rows = rng.normal(size=(1000, 8)).astype(np.float32)
+        self._cols = rng.normal(size=(2500, 8)).astype(np.float32)
+
+    def _legacy_tsv(self, x):
+        # vectors.tsv as written by the previous train.save_result().
+        lines = []
+        for row in x:
+            lines.append('\t'.join([str(v) for v in row]) + '\n')
+        return ''.join(lines)
+
+    def test_export(self):
+        names = ['Page_{0}'.format(n) for n in range(999)] + [u'Zürich']
+        page_dict = CompactDictionary.build(names)
+        output_dir = os.path.join(self._tmpdir, 'export')
+        export(output_dir, self._rows, self._cols, page_dict=page_dict, tsv=True)
+
+        rows = load_embedding(output_dir)
+        self.assertIsInstance(rows, np.memmap)
+        self.assertEqual(rows.dtype, np.float32)
+        np.testing.assert_array_equal(rows, self._rows)
+        np.testing.assert_array_equal(load_embedding(output_dir, COL_EMBEDDING), self._cols)
+        self.assertEqual(load_metadata(output_dir), names)
+        self.assertFalse([name for name in os.listdir(output_dir) if name.endswith('.tmp')])
+
+        with open(os.path.join(output_dir, VECTORS), 'r') as file:
+            vectors = np.loadtxt(file, delimiter='\t', dtype=np.float32)
+        np.testing.assert_array_equal(vectors, self._rows)
+
+    def test_float16(self):
+        output_dir = os.path.join(self._tmpdir, 'export')
+        export(output_dir, self._rows, dtype=np.float16)
+        rows = load_embedding(output_dir)
+        self.assertEqual(rows.dtype, np.float16)
+        np.testing.assert_allclose(rows, self._rows, rtol=1e-3, atol=1e-3)
+        self.assertFalse(os.path.exists(os.path.join(output_dir, METADATA)))
+
+    def test_tsv(self):
+        filename = os.path.join(self._tmpdir, 'vectors.tsv')
+        write_tsv(filename, self._rows, chunk_rows=300)
+        with open(filename, 'r') as file:
+            text = file.read()
+        legacy = self._legacy_tsv(self._rows)
+        self.assertEqual(text.count('\n'), legacy.count('\n'))
+        self.assertEqual(text.count('\t'), legacy.count('\t'))
+        for values in [text, legacy]:
+            parsed = np.array(values.split(), dtype=np.float32).reshape(self._rows.shape)
+            np.testing.assert_array_equal(parsed, self._rows)
+
+    def test_format(self):
+        x = np.array([[0.0, -1.0, 0.15625, 1e-45, 3.4e38], [123456789.5, -9.9999999999, 1e-5, 0.1, 2.5]])
+        self.assertEqual(format_tsv(x),
+                         b'0e+00\t-1e+00\t1.5625e-01\t1e-45\t3.4e+38\n'
+                         b'1.2345679e+08\t-1e+01\t1e-05\t1e-01\t2.5e+00\n')
+        self.assertEqual(format_tsv(x[:, 2:3], digits=2), b'1.6e-01\n1e-05\n')
+
+        # Values of all the float32 exponents are written without loss.
+        rng = np.random.RandomState(20190326)
+        y = (rng.uniform(-10, 10, size=(100, 50)) * 10.0 ** rng.randint(-44, 38, size=(100, 50))).astype(np.float32)
+        parsed = np.array(format_tsv(y).split(), dtype=np.float32).reshape(y.shape)
+        np.testing.assert_array_equal(parsed, y)
+
+        filename = os.path.join(self._tmpdir, 'vectors.tsv')
+        write_tsv(filename, np.array([[np.nan, 1.0], [1e300, 0.5]]))
+        with open(filename, 'r') as file:
+            self.assertEqual(file.read(), 'nan\t1\n1e+300\t0.5\n')
+
+    def test_weights(self):
+        x = np.concatenate([self._rows.ravel(), self._cols.ravel()])
+        rows, cols = split_weights(x, (1000, 2500), 8)
+        np.testing.assert_array_equal(rows, self._rows)
+        np.testing.assert_array_equal(cols, self._cols)
+
+        filename = os.path.join(self._tmpdir, 'weights.npz')
+        np.savez(filename, self._rows, self._cols)
+        rows, cols = read_weights(filename)
+        np.testing.assert_array_equal(cols, self._cols)
+
+
+if __name__ == '__main__':
+    unittest.main()
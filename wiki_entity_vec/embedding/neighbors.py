@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+Top-k nearest neighbours of the row embedding, by cosine similarity.
+
+The embedding is L2 normalized once. Batches of queries are scored against blocks of rows with a
+matrix multiplication, and the top k of each block are selected with argpartition and merged into
+the running top k, so that memory is bounded by query_batch x block_size scores.
+
+IVFIndex is an optional coarse index: the rows are clustered with spherical k-means and a query
+only scores the rows of the n_probe clusters with the closest centroids.
+
+Usage:
+  python -m wiki_entity_vec.embedding.neighbors --weights=<dir>/weights.npz \\
+      --page_dictionary=pages.txt [--k=10] [--ivf] Title_1 Title_2 ...
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import numpy as np
+
+from . import export
+
+
+def normalize(x, chunk_rows=64*1024):
+    """ Returns a float32 copy of x with unit L2 norm rows. Rows of zeros are left as zeros. """
+    output = np.empty(x.shape, dtype=np.float32)
+    for start in range(0, x.shape[0], chunk_rows):
+        chunk = np.asarray(x[start:start + chunk_rows], dtype=np.float32)
+        norms = np.linalg.norm(chunk, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        output[start:start + chunk_rows] = chunk / norms
+    return output
+
+
+def _top_k(scores, ids, k):
+    """ Top k scores of each row of a (q, n) scores array, sorted in descending order.
+    ids: (q, n) or (n,) ids of the scores.
+    """
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1) if ids.ndim == 2 else ids[part]
+    elif ids.ndim == 1:
+        ids = np.broadcast_to(ids, scores.shape)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class TopK(object):
+    """ Running top k of a batch of queries. """
+
+    def __init__(self, n_queries, k):
+        self.k = k
+        self.scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        self.ids = np.full((n_queries, k), -1, dtype=np.int64)
+
+    def update(self, queries, scores, ids):
+        """ Merges the (len(queries), n) scores of the (n,) ids into the top k of queries. """
+        self.scores[queries], self.ids[queries] = _top_k(
+            np.concatenate([self.scores[queries], scores], axis=1),
+            np.concatenate([self.ids[queries], np.broadcast_to(ids, scores.shape)], axis=1),
+            self.k)
+
+    def result(self):
+        """ Returns the (ids, scores) arrays; the ids of the empty or excluded entries are -1. """
+        self.ids[self.scores == -np.inf] = -1
+        return self.ids, self.scores
+
+
+def _exclude(scores, ids, exclude):
+    # Drops the score of the row of each query that is listed in exclude.
+    if exclude is not None:
+        scores[ids[np.newaxis, :] == exclude[:, np.newaxis]] = -np.inf
+
+
+class NearestNeighbors(object):
+    """ Exact top-k search over an embedding. """
+
+    def __init__(self, embedding, block_size=16*1024, query_batch=1024, normalized=False):
+        self._x = np.asarray(embedding, dtype=np.float32) if normalized else normalize(embedding)
+        self._block_size = block_size
+        self._query_batch = query_batch
+
+    @property
+    def embedding(self):
+        """ The normalized embedding. """
+        return self._x
+
+    def __len__(self):
+        return self._x.shape[0]
+
+    def query(self, vectors, k=10, exclude=None):
+        """ Returns the (ids, scores) of the k rows closest to each query vector, as (q, k) arrays
+        in descending score order. exclude: optional row id to skip for each query, e.g. itself.
+        Missing results, when k exceeds the number of rows, have id -1.
+        """
+        queries = normalize(np.atleast_2d(vectors))
+        exclude = None if exclude is None else np.asarray(exclude, dtype=np.int64)
+        top = TopK(len(queries), k)
+        for q_start in range(0, len(queries), self._query_batch):
+            batch = np.arange(q_start, min(q_start + self._query_batch, len(queries)))
+            batch_exclude = None if exclude is None else exclude[batch]
+            for start in range(0, len(self), self._block_size):
+                ids = np.arange(start, min(start + self._block_size, len(self)))
+                scores = queries[batch] @ self._x[start:start + self._block_size].T
+                _exclude(scores, ids, batch_exclude)
+                block_scores, block_ids = _top_k(scores, ids, k)
+                top.update(batch, block_scores, block_ids)
+        return top.result()
+
+    def query_ids(self, ids, k=10):
+        """ Neighbours of rows of the embedding, excluding the row itself. """
+        ids = np.asarray(ids, dtype=np.int64)
+        return self.query(self._x[ids], k=k, exclude=ids)
+
+
+class IVFIndex(object):
+    """ Inverted file index: the rows are grouped by their closest k-means centroid.
+    The rows of a cluster are stored contiguously, in a copy of the normalized embedding.
+    """
+
+    def __init__(self, centroids, order, offsets, x):
+        self._centroids = centroids
+        self._order = order
+        self._offsets = offsets
+        self._x = x
+
+    @classmethod
+    def build(cls, nn, n_clusters=None, n_iter=10, sample_size=None, seed=20190327, block_size=16*1024):
+        """ Clusters the normalized embedding of a NearestNeighbors instance.
+        n_clusters defaults to sqrt(rows); the centroids are trained on a sample of sample_size
+        rows (256 per cluster by default) and then all the rows are assigned.
+        """
+        x = nn.embedding
+        n_clusters = n_clusters or max(1, int(np.sqrt(len(x))))
+        rng = np.random.RandomState(seed)
+        sample_size = min(len(x), sample_size or 256 * n_clusters)
+        sample = x[np.sort(rng.choice(len(x), sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, n_clusters, replace=False)]
+        for _ in range(n_iter):
+            assignment = cls._assign(sample, centroids, block_size)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=n_clusters)
+            empty = counts == 0
+            starts = (np.cumsum(counts) - counts)[~empty]
+            sums = np.zeros(centroids.shape, dtype=np.float64)
+            sums[~empty] = np.add.reduceat(sample[order].astype(np.float64), starts, axis=0)
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize(sums)
+
+        assignment = cls._assign(x, centroids, block_size)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros((n_clusters + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_clusters), out=offsets[1:])
+        return cls(centroids, order, offsets, x[order])
+
+    @staticmethod
+    def _assign(x, centroids, block_size):
+        assignment = np.empty((len(x),), dtype=np.int64)
+        for start in range(0, len(x), block_size):
+            assignment[start:start + block_size] = np.argmax(x[start:start + block_size] @ centroids.T, axis=1)
+        return assignment
+
+    @property
+    def n_clusters(self):
+        return len(self._centroids)
+
+    def query(self, vectors, k=10, n_probe=8, exclude=None):
+        """ Approximate NearestNeighbors.query(): only the rows of the n_probe clusters closest to
+        each query are scored. The queries are grouped by cluster, so that each cluster is scored
+        against all the queries that probe it with one matrix multiplication.
+        """
+        queries = normalize(np.atleast_2d(vectors))
+        exclude = None if exclude is None else np.asarray(exclude, dtype=np.int64)
+        n_probe = min(n_probe, self.n_clusters)
+        probes = _top_k(queries @ self._centroids.T, np.arange(self.n_clusters), n_probe)[1]
+        top = TopK(len(queries), k)
+        query_ids = np.repeat(np.arange(len(queries)), n_probe)
+        clusters = probes.ravel()
+        order = np.argsort(clusters, kind='stable')
+        bounds = np.searchsorted(clusters[order], np.arange(self.n_clusters + 1))
+        for cluster in np.flatnonzero(np.diff(bounds)):
+            start, end = self._offsets[cluster], self._offsets[cluster + 1]
+            if start == end:
+                continue
+            batch = query_ids[order[bounds[cluster]:bounds[cluster + 1]]]
+            ids = self._order[start:end]
+            scores = queries[batch] @ self._x[start:end].T
+            _exclude(scores, ids, None if exclude is None else exclude[batch])
+            block_scores, block_ids = _top_k(scores, ids, k)
+            top.update(batch, block_scores, block_ids)
+        return top.result()
+
+    def query_ids(self, nn, ids, k=10, n_probe=8):
+        ids = np.asarray(ids, dtype=np.int64)
+        return self.query(nn.embedding[ids], k=k, n_probe=n_probe, exclude=ids)
+
+
+def recall(ids, expected_ids):
+    """ Fraction of the expected neighbours that are found, over all the queries. """
+    found = 0
+    for row, expected in zip(ids, expected_ids):
+        found += len(np.intersect1d(row[row != -1], expected[expected != -1]))
+    return found / float(max(np.count_nonzero(expected_ids != -1), 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nearest neighbours of pages in the row embedding')
+    parser.add_argument('--weights', help='weights.npz file written by train.py')
+    parser.add_argument('--embedding_dir', help='Directory written by wiki_entity_vec.embedding.export')
+    parser.add_argument('--page_dictionary', required=True)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--ivf', action='store_true', help='Query an IVF index instead of all the rows')
+    parser.add_argument('--n_clusters', type=int)
+    parser.add_argument('--n_probe', type=int, default=8)
+    parser.add_argument('--queries', help='File of query titles, one per line')
+    parser.add_argument('titles', nargs='*')
+    args = parser.parse_args()
+
+    from ..util.dictionary import load_dictionary
+
+    if args.embedding_dir:
+        embedding = export.load_embedding(args.embedding_dir)
+    elif args.weights:
+        embedding = export.read_weights(args.weights)[0]
+    else:
+        parser.error('--weights or --embedding_dir is required')
+    page_dict = load_dictionary(args.page_dictionary, cache=True)
+
+    titles = list(args.titles)
+    if args.queries:
+        with open(args.queries, 'r') as file:
+            titles += [line.strip() for line in file]
+    query_ids = page_dict.ids(titles)
+    for title in np.array(titles, dtype=object)[query_ids == -1]:
+        print('{0}: not in the dictionary'.format(title), file=sys.stderr)
+    titles = [title for title, index in zip(titles, query_ids) if index != -1]
+    query_ids = query_ids[query_ids != -1]
+
+    nn = NearestNeighbors(embedding)
+    if args.ivf:
+        index = IVFIndex.build(nn, n_clusters=args.n_clusters)
+        ids, scores = index.query_ids(nn, query_ids, k=args.k, n_probe=args.n_probe)
+    else:
+        ids, scores = nn.query_ids(query_ids, k=args.k)
+    for title, row_ids, row_scores in zip(titles, ids, scores):
+        found = row_ids != -1
+        for name, score in zip(page_dict.names(row_ids[found]), row_scores[found]):
+            print('{0}\t{1}\t{2:.4f}'.format(title, name, score))
+
+
+if __name__ == '__main__':
+    main()
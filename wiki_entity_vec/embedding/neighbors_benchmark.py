@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the query throughput of NearestNeighbors and IVFIndex, and the recall of IVFIndex
+against the exact results, on a random embedding with clustered rows.
+
+Usage: python -m wiki_entity_vec.embedding.neighbors_benchmark [--rows=N] [--queries=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from .neighbors import IVFIndex, NearestNeighbors, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nearest neighbours benchmark')
+    parser.add_argument('--rows', type=int, default=500*1000)
+    parser.add_argument('--embedding_size', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n_clusters', type=int)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(20190327)
+    centers = rng.normal(size=(1000, args.embedding_size))
+    x = centers[rng.randint(0, len(centers), size=args.rows)]
+    x += rng.normal(scale=1.2, size=x.shape)
+    queries = rng.randint(0, args.rows, size=args.queries)
+
+    start = time.time()
+    nn = NearestNeighbors(x)
+    print('normalize: {0:.2f}s'.format(time.time() - start))
+    start = time.time()
+    expected, _ = nn.query_ids(queries, k=args.k)
+    elapsed = time.time() - start
+    print('{0:>14}: {1:>10.0f} queries/s recall {2:.3f}'.format('brute force', len(queries) / elapsed, 1.0))
+
+    start = time.time()
+    index = IVFIndex.build(nn, n_clusters=args.n_clusters)
+    print('IVF build: {0} clusters {1:.2f}s'.format(index.n_clusters, time.time() - start))
+    for n_probe in [1, 4, 8, 16, 32]:
+        start = time.time()
+        ids, _ = index.query_ids(nn, queries, k=args.k, n_probe=n_probe)
+        elapsed = time.time() - start
+        print('{0:>14}: {1:>10.0f} queries/s recall {2:.3f}'.format(
+            'n_probe={0}'.format(n_probe), len(queries) / elapsed, recall(ids, expected)))
+
+
+if __name__ == '__main__':
+    main()
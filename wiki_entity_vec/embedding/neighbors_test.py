@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from wiki_entity_vec.embedding.neighbors import IVFIndex, NearestNeighbors, normalize, recall
+
+
+class NeighborsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(20190327)
+        centers = rng.normal(size=(20, 16))
+        self._x = (centers[rng.randint(0, 20, size=3000)] + rng.normal(scale=0.5, size=(3000, 16))).astype(np.float32)
+        self._x[7] = 0.0
+        self._queries = rng.randint(0, 3000, size=200)
+
+    def _expected(self, k):
+        x = normalize(self._x)
+        scores = x[self._queries] @ x.T
+        scores[np.arange(len(self._queries)), self._queries] = -np.inf
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return order, np.take_along_axis(scores, order, axis=1)
+
+    def test_normalize(self):
+        x = normalize(self._x, chunk_rows=100)
+        norms = np.linalg.norm(x, axis=1)
+        self.assertEqual(norms[7], 0.0)
+        np.testing.assert_allclose(np.delete(norms, 7), 1.0, rtol=1e-5)
+
+    def test_query(self):
+        expected_ids, expected_scores = self._expected(10)
+        nn = NearestNeighbors(self._x, block_size=256, query_batch=64)
+        ids, scores = nn.query_ids(self._queries, k=10)
+        self.assertEqual(ids.shape, (200, 10))
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+        self.assertGreater(recall(ids, expected_ids), 0.99)
+        self.assertFalse(np.any(ids == self._queries[:, np.newaxis]))
+
+        ids, scores = nn.query(self._x[:3], k=1)
+        np.testing.assert_array_equal(ids[:, 0], [0, 1, 2])
+
+    def test_k(self):
+        nn = NearestNeighbors(self._x[:50], block_size=16)
+        ids, scores = nn.query_ids([3, 4], k=60)
+        self.assertEqual(ids.shape, (2, 60))
+        self.assertEqual(list(np.count_nonzero(ids != -1, axis=1)), [49, 49])
+        self.assertTrue(np.all(np.isneginf(scores[ids == -1])))
+        self.assertEqual(sorted(ids[0][ids[0] != -1]), [n for n in range(50) if n != 3])
+
+    def test_ivf(self):
+        expected_ids, _ = self._expected(10)
+        nn = NearestNeighbors(self._x)
+        index = IVFIndex.build(nn, n_clusters=20)
+        self.assertEqual(index.n_clusters, 20)
+
+        ids, _ = index.query_ids(nn, self._queries, k=10, n_probe=20)
+        self.assertGreater(recall(ids, expected_ids), 0.99)
+        ids, _ = index.query_ids(nn, self._queries, k=10, n_probe=3)
+        self.assertGreater(recall(ids, expected_ids), 0.9)
+        self.assertFalse(np.any(ids == self._queries[:, np.newaxis]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Quantized storage of the row and column embeddings.
+
+Int8Table keeps each row as int8 codes and a float32 scale, x ~= codes * scale (4x smaller than
+float32). PQTable keeps the row norm as the scale and product quantizes the unit direction: the
+row is split in n_subspaces subvectors, each stored as the uint8 index of one of 256 centroids of
+its subspace (e.g. 25 + 4 bytes instead of 400 for 100 dimensions).
+
+PairScorer computes the dot products of (row, col) pairs, the output of make_model(), directly on
+the quantized tables: int8 dot products accumulated in int32 for Int8Table and, for PQTable, a sum
+of lookups in per-subspace tables of the inner products between the row and column centroids.
+
+Usage:
+  python -m wiki_entity_vec.embedding.quantize --weights=<dir>/weights.npz --output_dir=<dir> \\
+      [--method=int8|pq] [--n_subspaces=25]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+
+from . import export
+from .neighbors import normalize
+
+
+class Int8Table(object):
+    """ Rows stored as int8 codes with a float32 scale per row. """
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, x, chunk_rows=64*1024):
+        codes = np.empty(x.shape, dtype=np.int8)
+        scales = np.empty((x.shape[0],), dtype=np.float32)
+        for start in range(0, x.shape[0], chunk_rows):
+            chunk = np.asarray(x[start:start + chunk_rows], dtype=np.float32)
+            scale = np.abs(chunk).max(axis=1) / 127.0
+            scales[start:start + chunk_rows] = scale
+            scale[scale == 0] = 1.0
+            codes[start:start + chunk_rows] = np.rint(chunk / scale[:, np.newaxis])
+        return cls(codes, scales)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def reconstruct(self, ids=None):
+        codes, scales = (self.codes, self.scales) if ids is None else (self.codes[ids], self.scales[ids])
+        return codes.astype(np.float32) * scales[:, np.newaxis]
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, name + '.int8.npy'), self.codes)
+        np.save(os.path.join(directory, name + '.scale.npy'), self.scales)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        return cls(np.load(os.path.join(directory, name + '.int8.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, name + '.scale.npy'), mmap_mode=mmap_mode))
+
+
+def _kmeans(x, n_centroids, n_iter, rng):
+    """ Euclidean k-means; returns the centroids. Empty clusters are reseeded with random points. """
+    centroids = x[rng.choice(len(x), n_centroids, replace=len(x) < n_centroids)].astype(np.float32)
+    for _ in range(n_iter):
+        assignment = _closest(x, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_centroids)
+        found = counts > 0
+        starts = (np.cumsum(counts) - counts)[found]
+        sums = np.add.reduceat(x[order].astype(np.float64), starts, axis=0)
+        centroids[found] = sums / counts[found][:, np.newaxis]
+        centroids[~found] = x[rng.choice(len(x), int(np.count_nonzero(~found)))]
+    return centroids
+
+
+def _closest(x, centroids, block_size=64*1024):
+    """ Index of the closest centroid of each row, by Euclidean distance. """
+    norms = (centroids * centroids).sum(axis=1)
+    assignment = np.empty((len(x),), dtype=np.int64)
+    for start in range(0, len(x), block_size):
+        block = x[start:start + block_size]
+        assignment[start:start + block_size] = np.argmin(norms - 2 * block @ centroids.T, axis=1)
+    return assignment
+
+
+class PQTable(object):
+    """ Product quantized rows: the row norms and, for each subspace, the uint8 code of the closest
+    centroid to the subvector of the normalized row.
+    codebooks: (n_subspaces, n_centroids, embedding_size / n_subspaces) float32 array.
+    """
+
+    def __init__(self, codebooks, codes, scales):
+        self.codebooks = codebooks
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, x, n_subspaces=None, n_centroids=256, n_iter=10, sample_size=64*1024,
+                 seed=20190328, chunk_rows=64*1024):
+        """ Trains the codebooks on a sample of sample_size rows and encodes all the rows.
+        n_subspaces must divide the embedding size; it defaults to one per 4 dimensions.
+        """
+        embedding_size = x.shape[1]
+        n_subspaces = n_subspaces or max(1, embedding_size // 4)
+        if embedding_size % n_subspaces:
+            raise ValueError('{0} subspaces do not divide {1} dimensions'.format(n_subspaces, embedding_size))
+        if n_centroids > 256:
+            raise ValueError('codes are uint8: at most 256 centroids')
+        sub_size = embedding_size // n_subspaces
+
+        rng = np.random.RandomState(seed)
+        sample = x[np.sort(rng.choice(len(x), min(len(x), sample_size), replace=False))]
+        sample = normalize(sample).reshape(-1, n_subspaces, sub_size)
+        codebooks = np.stack([_kmeans(sample[:, m], n_centroids, n_iter, rng) for m in range(n_subspaces)])
+
+        codes = np.empty((len(x), n_subspaces), dtype=np.uint8)
+        scales = np.empty((len(x),), dtype=np.float32)
+        for start in range(0, len(x), chunk_rows):
+            chunk = np.asarray(x[start:start + chunk_rows], dtype=np.float32)
+            scales[start:start + chunk_rows] = np.linalg.norm(chunk, axis=1)
+            chunk = normalize(chunk).reshape(-1, n_subspaces, sub_size)
+            for m in range(n_subspaces):
+                codes[start:start + chunk_rows, m] = _closest(chunk[:, m], codebooks[m])
+        return cls(codebooks, codes, scales)
+
+    @property
+    def n_subspaces(self):
+        return self.codebooks.shape[0]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nbytes(self):
+        return self.codebooks.nbytes + self.codes.nbytes + self.scales.nbytes
+
+    def reconstruct(self, ids=None):
+        codes, scales = (self.codes, self.scales) if ids is None else (self.codes[ids], self.scales[ids])
+        vectors = self.codebooks[np.arange(self.n_subspaces), codes].reshape(len(codes), -1)
+        return vectors * scales[:, np.newaxis]
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, name + '.pq_codebooks.npy'), self.codebooks)
+        np.save(os.path.join(directory, name + '.pq_codes.npy'), self.codes)
+        np.save(os.path.join(directory, name + '.scale.npy'), self.scales)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        return cls(np.load(os.path.join(directory, name + '.pq_codebooks.npy')),
+                   np.load(os.path.join(directory, name + '.pq_codes.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, name + '.scale.npy'), mmap_mode=mmap_mode))
+
+
+METHODS = {
+    'int8': Int8Table,
+    'pq': PQTable,
+}
+
+
+class PairScorer(object):
+    """ Approximate dot products of row_table[rows] and col_table[cols]. """
+
+    def __init__(self, row_table, col_table, chunk_size=64*1024):
+        self._rows = row_table
+        self._cols = col_table
+        self._chunk_size = chunk_size
+        self._lut = None
+        if isinstance(row_table, PQTable) and isinstance(col_table, PQTable):
+            if row_table.codebooks.shape[::2] != col_table.codebooks.shape[::2]:
+                raise ValueError('row and column tables with different subspaces')
+            # Inner products of the row and column centroids, flattened so that the entry of
+            # subspace m and codes (i, j) is at m * 65536 + i * 256 + j; codes are at most 255.
+            n_subspaces = row_table.n_subspaces
+            lut = np.zeros((n_subspaces, 256, 256), dtype=np.float32)
+            n_row_centroids = row_table.codebooks.shape[1]
+            n_col_centroids = col_table.codebooks.shape[1]
+            lut[:, :n_row_centroids, :n_col_centroids] = np.einsum(
+                'mid,mjd->mij', row_table.codebooks, col_table.codebooks)
+            self._lut = lut.ravel()
+            self._lut_offsets = np.arange(n_subspaces, dtype=np.int32) * (256 * 256)
+
+    def score(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        result = np.empty(rows.shape, dtype=np.float32)
+        for start in range(0, len(rows), self._chunk_size):
+            end = start + self._chunk_size
+            result[start:end] = self._score(rows[start:end], cols[start:end])
+        return result
+
+    def _score(self, rows, cols):
+        scales = self._rows.scales[rows] * self._cols.scales[cols]
+        if isinstance(self._rows, Int8Table) and isinstance(self._cols, Int8Table):
+            dots = np.einsum('ij,ij->i', self._rows.codes[rows], self._cols.codes[cols],
+                             dtype=np.int32, casting='unsafe')
+            return dots * scales
+        if self._lut is not None:
+            index = self._rows.codes[rows].astype(np.int32)
+            index <<= 8
+            index |= self._cols.codes[cols]
+            index += self._lut_offsets
+            return np.take(self._lut, index).sum(axis=1) * scales
+        return np.einsum('ij,ij->i', self._rows.reconstruct(rows), self._cols.reconstruct(cols))
+
+
+def reconstruction_error(x, table, chunk_rows=64*1024):
+    """ Relative squared error of the reconstructed rows, sum |x - x'|^2 / sum |x|^2. """
+    error = 0.0
+    total = 0.0
+    for start in range(0, x.shape[0], chunk_rows):
+        chunk = np.asarray(x[start:start + chunk_rows], dtype=np.float64)
+        error += ((chunk - table.reconstruct(np.arange(start, start + len(chunk)))) ** 2).sum()
+        total += (chunk ** 2).sum()
+    return error / total if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the trained embeddings')
+    parser.add_argument('--weights', help='weights.npz file written by train.py')
+    parser.add_argument('--embedding_dir', help='Directory written by wiki_entity_vec.embedding.export')
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--method', choices=sorted(METHODS.keys()), default='int8')
+    parser.add_argument('--n_subspaces', type=int, help='PQ subspaces; one per 4 dimensions by default')
+    args = parser.parse_args()
+
+    if args.embedding_dir:
+        tables = [export.load_embedding(args.embedding_dir, name)
+                  for name in [export.ROW_EMBEDDING, export.COL_EMBEDDING]]
+    elif args.weights:
+        tables = export.read_weights(args.weights)
+    else:
+        parser.error('--weights or --embedding_dir is required')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, x in zip([export.ROW_EMBEDDING, export.COL_EMBEDDING], tables):
+        if args.method == 'pq':
+            table = PQTable.quantize(x, n_subspaces=args.n_subspaces)
+        else:
+            table = Int8Table.quantize(x)
+        table.save(args.output_dir, name)
+        print('{0}: {1:.1f} MB ({2:.1f}x smaller than float32), relative squared error {3:.5f}'.format(
+            name, table.nbytes() / 1e6, x.shape[0] * x.shape[1] * 4.0 / table.nbytes(),
+            reconstruction_error(x, table)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reports the size, reconstruction error, (row, col) scoring error and scoring throughput of the
+quantized tables against float32.
+
+Uses the row and column embeddings of a weights.npz file, or random low rank embeddings.
+The scoring error is the RMS error of the dot products of random pairs, relative to their
+standard deviation.
+
+Usage: python -m wiki_entity_vec.embedding.quantize_benchmark [--weights=weights.npz] [--pairs=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from . import export
+from .quantize import Int8Table, PairScorer, PQTable, reconstruction_error
+
+
+def score_float32(rows, cols, row_ids, col_ids, chunk_size=64*1024):
+    result = np.empty(row_ids.shape, dtype=np.float32)
+    for start in range(0, len(row_ids), chunk_size):
+        end = start + chunk_size
+        result[start:end] = np.einsum('ij,ij->i', rows[row_ids[start:end]], cols[col_ids[start:end]])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantized embedding benchmark')
+    parser.add_argument('--weights', help='weights.npz file written by train.py')
+    parser.add_argument('--rows', type=int, default=500*1000)
+    parser.add_argument('--embedding_size', type=int, default=100)
+    parser.add_argument('--pairs', type=int, default=2*1000*1000)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(20190328)
+    if args.weights:
+        rows, cols = export.read_weights(args.weights)
+    else:
+        basis = rng.normal(size=(20, args.embedding_size)) * 0.1
+        rows = (rng.normal(size=(args.rows, 20)) @ basis).astype(np.float32)
+        rows += rng.normal(scale=0.02, size=rows.shape).astype(np.float32)
+        cols = (rng.normal(size=(2 * args.rows, 20)) @ basis).astype(np.float32)
+        cols += rng.normal(scale=0.02, size=cols.shape).astype(np.float32)
+    row_ids = rng.randint(0, len(rows), size=args.pairs)
+    col_ids = rng.randint(0, len(cols), size=args.pairs)
+
+    start = time.time()
+    exact = score_float32(rows, cols, row_ids, col_ids)
+    elapsed = time.time() - start
+    float_bytes = rows.nbytes + cols.nbytes
+    print('{0:>8}: {1:>8.1f} MB {2:>24} {3:>12.0f} pairs/s'.format(
+        'float32', float_bytes / 1e6, '', len(exact) / elapsed))
+
+    for name, quantize in [('int8', Int8Table.quantize), ('pq', PQTable.quantize)]:
+        start = time.time()
+        row_table = quantize(rows)
+        col_table = quantize(cols)
+        quantize_time = time.time() - start
+        scorer = PairScorer(row_table, col_table)
+        start = time.time()
+        scores = scorer.score(row_ids, col_ids)
+        elapsed = time.time() - start
+        size = row_table.nbytes() + col_table.nbytes()
+        score_error = np.sqrt(np.mean((scores - exact) ** 2)) / exact.std()
+        print('{0:>8}: {1:>8.1f} MB ({2:.1f}x) error rows {3:.5f} cols {4:.5f} scores {5:.5f} '
+              '{6:>12.0f} pairs/s quantize {7:.1f}s'.format(
+                  name, size / 1e6, float_bytes / float(size), reconstruction_error(rows, row_table),
+                  reconstruction_error(cols, col_table), score_error, len(scores) / elapsed, quantize_time))
+
+
+if __name__ == '__main__':
+    main()
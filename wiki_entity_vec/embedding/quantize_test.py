@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import unittest
+
+import tempfile
+
+import numpy as np
+
+from wiki_entity_vec.embedding.quantize import Int8Table, PairScorer, PQTable, reconstruction_error
+
+
+class QuantizeTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        rng = np.random.RandomState(20190328)
+        basis = rng.normal(size=(4, 16))
+        self._rows = (rng.normal(size=(2000, 4)) @ basis + rng.normal(scale=0.1, size=(2000, 16))).astype(np.float32)
+        self._cols = (rng.normal(size=(3000, 4)) @ basis + rng.normal(scale=0.1, size=(3000, 16))).astype(np.float32)
+        self._rows[5] = 0.0
+        self._pairs = (rng.randint(0, 2000, size=5000), rng.randint(0, 3000, size=5000))
+
+    def _check_scorer(self, row_table, col_table, tolerance):
+        rows, cols = self._pairs
+        scores = PairScorer(row_table, col_table, chunk_size=1000).score(rows, cols)
+        expected = np.einsum('ij,ij->i', row_table.reconstruct(rows), col_table.reconstruct(cols))
+        np.testing.assert_allclose(scores, expected, rtol=1e-4, atol=1e-4)
+        exact = np.einsum('ij,ij->i', self._rows[rows], self._cols[cols])
+        self.assertLess(np.sqrt(np.mean((scores - exact) ** 2)) / exact.std(), tolerance)
+
+    def test_int8(self):
+        rows = Int8Table.quantize(self._rows, chunk_rows=300)
+        cols = Int8Table.quantize(self._cols)
+        self.assertEqual(rows.codes.dtype, np.int8)
+        self.assertEqual(rows.nbytes(), 2000 * (16 + 4))
+        self.assertLess(reconstruction_error(self._rows, rows), 1e-3)
+        np.testing.assert_array_equal(rows.reconstruct([5]), np.zeros((1, 16)))
+        self.assertEqual(np.abs(rows.codes.astype(np.int32)).max(), 127)
+        self._check_scorer(rows, cols, 0.02)
+
+        rows.save(self._tmpdir, 'row_embedding')
+        loaded = Int8Table.load(self._tmpdir, 'row_embedding')
+        self.assertIsInstance(loaded.codes, np.memmap)
+        np.testing.assert_array_equal(loaded.reconstruct(), rows.reconstruct())
+
+    def test_pq(self):
+        rows = PQTable.quantize(self._rows, n_subspaces=4, n_centroids=32, n_iter=5)
+        cols = PQTable.quantize(self._cols, n_subspaces=4, n_centroids=32, n_iter=5)
+        self.assertEqual(rows.codes.shape, (2000, 4))
+        self.assertEqual(rows.codebooks.shape, (4, 32, 4))
+        self.assertLess(reconstruction_error(self._rows, rows), 0.1)
+        np.testing.assert_array_equal(rows.reconstruct([5]), np.zeros((1, 16)))
+        self._check_scorer(rows, cols, 0.3)
+        # Mixed tables use the reconstructed vectors.
+        self._check_scorer(rows, Int8Table.quantize(self._cols), 0.3)
+
+        rows.save(self._tmpdir, 'row_embedding')
+        loaded = PQTable.load(self._tmpdir, 'row_embedding')
+        np.testing.assert_array_equal(loaded.reconstruct(), rows.reconstruct())
+
+        with self.assertRaises(ValueError):
+            PQTable.quantize(self._rows, n_subspaces=3)
+        with self.assertRaises(ValueError):
+            PairScorer(rows, PQTable.quantize(self._cols, n_subspaces=8, n_centroids=8, n_iter=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generate the matrix shards directly from the page, pagelinks and categorylinks SQL dumps, without
+importing them into MySQL.
+
+The dumps are parsed by a process pool, in byte ranges for plain files and in line batches for
+gzipped files:
+  1. the page dump is scanned for the namespace 0 pages in the page dictionary, which gives the
+     page_id -> matrix row mapping;
+  2. each pagelinks and categorylinks range is converted into matrix records, which are appended
+     to per shard spill files;
+  3. the spill files of each shard are sorted, deduplicated and written as data.bin shards, with a .count sidecar.
+
+The records are the same as the ones generated by generate_matrix.py: inlinks, outlinks (offset
+by the dictionary size) and categories (offset by twice the dictionary size). Shards are
+partitioned by row blocks, as the zero_injector.py output, rather than by page_id hash.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import glob
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+
+from compressed import RECORD_DTYPE
+from dictionary import load_dictionary
+from page_index import PageIndex
+from record_writer import RecordWriter
+import sqldump
+
+# Worker process state, set by the pool initializer.
+_STATE = {}
+
+
+def _init_worker(state):
+    _STATE.update(state)
+
+
+def _task_lines(task):
+    if task[0] == 'range':
+        return sqldump.read_range(*task[1:])
+    return task[1]
+
+
+def dump_tasks(filename, range_size):
+    """ Splits a dump in tasks of approximately range_size bytes. """
+    if sqldump.is_gzip(filename):
+        for batch in sqldump.read_batches(filename, range_size):
+            yield ('lines', batch)
+    else:
+        for start, stop in sqldump.byte_ranges(filename, range_size):
+            yield ('range', filename, start, stop)
+
+
+def run_tasks(pool, fn, tasks, max_pending):
+    """ Applies fn(task_id, task) to each task. At most max_pending tasks are queued, so that gzip
+    line batches are read as the workers consume them.
+    """
+    results = []
+    pending = collections.deque()
+    for task_id, task in enumerate(tasks):
+        if len(pending) >= max_pending:
+            results.append(pending.popleft().get())
+        pending.append(pool.apply_async(fn, (task_id, task)))
+    while pending:
+        results.append(pending.popleft().get())
+    return results
+
+
+def _page_task(task_id, task):
+    pages = ((row[0], row[2]) for row in sqldump.iter_rows(_task_lines(task), 'page') if row[1] == 0)
+    return PageIndex.build(pages, _STATE['page_dict'])
+
+
+def _make_records(rows, cols):
+    records = np.empty((len(rows),), dtype=RECORD_DTYPE)
+    records['row'] = rows
+    records['col'] = cols
+    records['value'] = 1.0
+    return records
+
+
+def _spill(name, records):
+    """ Appends records to the spill file of the shard of each row. """
+    shards = records['row'] // _STATE['block_size']
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(_STATE['num_shards'] + 1))
+    for shard_id in range(_STATE['num_shards']):
+        start, stop = bounds[shard_id], bounds[shard_id + 1]
+        if start == stop:
+            continue
+        filename = os.path.join(_STATE['spill_dir'], '{0}.{1:05d}'.format(name, shard_id))
+        records[order[start:stop]].tofile(filename)
+    return len(records)
+
+
+def _pagelinks_task(task_id, task):
+    page_dict = _STATE['page_dict']
+    sources = []
+    titles = []
+    inbound = []
+    for row in sqldump.iter_rows(_task_lines(task), 'pagelinks'):
+        if len(row) < 4:
+            continue
+        pl_from, pl_namespace, pl_title, pl_from_namespace = row[:4]
+        sources.append(pl_from)
+        titles.append(pl_title)
+        inbound.append(pl_namespace == 0 and pl_from_namespace == 0)
+
+    rows = _STATE['page_index'].lookup(sources)
+    targets = page_dict.ids(titles)
+    inbound = np.array(inbound, dtype=bool)
+    outlinks = (rows != -1) & (targets != -1)
+    inlinks = outlinks & inbound
+    records = np.concatenate([
+        _make_records(targets[inlinks], rows[inlinks]),
+        _make_records(rows[outlinks], targets[outlinks] + page_dict.size()),
+    ])
+    return _spill('pagelinks-{0:06d}'.format(task_id), records)
+
+
+def _categorylinks_task(task_id, task):
+    sources = []
+    names = []
+    for row in sqldump.iter_rows(_task_lines(task), 'categorylinks'):
+        sources.append(row[0])
+        names.append(row[1])
+
+    rows = _STATE['page_index'].lookup(sources)
+    categories = _STATE['category_dict'].ids(names)
+    found = (rows != -1) & (categories != -1)
+    cols = categories[found] + 2 * _STATE['page_dict'].size()
+    return _spill('categorylinks-{0:06d}'.format(task_id), _make_records(rows[found], cols))
+
+
+def _merge_shard(spill_dir, output_dir, shard_id, num_shards):
+    parts = [np.fromfile(filename, dtype=RECORD_DTYPE)
+             for filename in sorted(glob.glob(os.path.join(spill_dir, '*.{0:05d}'.format(shard_id))))]
+    records = np.unique(np.concatenate(parts)) if parts else np.empty((0,), dtype=RECORD_DTYPE)
+    with RecordWriter(os.path.join(output_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, num_shards))) as writer:
+        writer.write_records(records['row'], records['col'], records['value'])
+    return len(records)
+
+
+def load_page_index(page_dump, page_dict, workers=None, range_size=64*1024*1024):
+    """ Returns the PageIndex of the namespace 0 pages of a page dump. """
+    workers = workers or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=({'page_dict': page_dict},))
+    try:
+        results = run_tasks(pool, _page_task, dump_tasks(page_dump, range_size), 2 * workers)
+    finally:
+        pool.close()
+        pool.join()
+    return PageIndex.concatenate(results)
+
+
+def build_matrix(page_dump, pagelinks_dump, categorylinks_dump, page_dict, category_dict, output_dir,
+                 num_shards, workers=None, range_size=64*1024*1024, page_index=None):
+    """ Writes the data.bin shards of the matrix. Returns the record count of each shard.
+    page_index: a precomputed PageIndex, instead of scanning the page dump.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if page_index is None:
+        page_index = load_page_index(page_dump, page_dict, workers, range_size)
+    print('Pages: {0}'.format(len(page_index)))
+
+    # Spill files left by an interrupted run would be merged into the shards.
+    spill_dir = os.path.join(output_dir, 'spill')
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+    state = {
+        'page_dict': page_dict,
+        'category_dict': category_dict,
+        'page_index': page_index,
+        'num_shards': num_shards,
+        'block_size': (page_dict.size() - 1) // num_shards + 1,
+        'spill_dir': spill_dir,
+    }
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(state,))
+    try:
+        links = run_tasks(pool, _pagelinks_task, dump_tasks(pagelinks_dump, range_size), 2 * workers)
+        print('Page links: {0}'.format(sum(links)))
+        categories = run_tasks(pool, _categorylinks_task, dump_tasks(categorylinks_dump, range_size), 2 * workers)
+        print('Category links: {0}'.format(sum(categories)))
+        counts = pool.starmap(_merge_shard, [(spill_dir, output_dir, shard_id, num_shards)
+                                             for shard_id in range(num_shards)])
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the matrix from the wikipedia SQL dumps')
+    parser.add_argument('--page_dump', help='page.sql or page.sql.gz')
+    parser.add_argument('--page_index', help='PageIndex file generated by page_index.py')
+    parser.add_argument('--pagelinks_dump', required=True)
+    parser.add_argument('--categorylinks_dump', required=True)
+    parser.add_argument('--page_dictionary', required=True)
+    parser.add_argument('--category_file', required=True)
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--num_shards', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--range_size', type=int, default=64*1024*1024,
+                        help='Bytes of dump parsed by each task')
+    args = parser.parse_args()
+
+    page_dict = load_dictionary(args.page_dictionary)
+    category_dict = load_dictionary(args.category_file)
+
+    if not args.page_dump and not args.page_index:
+        parser.error('one of --page_dump or --page_index is required')
+    page_index = PageIndex.load(args.page_index) if args.page_index else None
+
+    counts = build_matrix(args.page_dump, args.pagelinks_dump, args.categorylinks_dump, page_dict,
+                          category_dict, args.output_dir, args.num_shards, args.workers, args.range_size,
+                          page_index=page_index)
+    print('Records: {0}'.format(sum(counts)))
+
+
+if __name__ == '__main__':
+    main()
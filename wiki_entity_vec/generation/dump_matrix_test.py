@@ -0,0 +1,86 @@
+from __future__ import print_function
+import unittest
+
+import gzip
+import io
+import tempfile
+import os
+
+import numpy as np
+
+from compressed import RECORD_DTYPE
+from dump_matrix import build_matrix
+from generate_matrix import generate_matrix, shard_filter
+from record_writer import RecordWriter, read_count
+import sqldump
+import sqlite_standin
+
+
+class DumpMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._cnx, titles = sqlite_standin.create_database(':memory:', 1000, 8000, 40, 2000,
+                                                           other_namespace_fraction=0.0)
+        self._page_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'pages.txt'), titles[::2] + titles[1::4])
+        self._category_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'categories.txt'), ['Category_{0}'.format(n) for n in range(1, 40, 2)])
+
+    def _write_dump(self, table, opener, suffix):
+        filename = os.path.join(self._tmpdir, table + suffix)
+        cursor = self._cnx.cursor()
+        cursor.execute('select * from {0}'.format(table))
+        with opener(filename, 'wb') as file:
+            file.write(b'/* Header */\n')
+            while True:
+                rows = cursor.fetchmany(100)
+                if not rows:
+                    break
+                file.write(sqldump.format_insert(table, rows).encode('utf-8'))
+        return filename
+
+    def _expected(self):
+        output = io.BytesIO()
+        with RecordWriter(output) as writer:
+            for shard_id in range(4):
+                pages = self._cnx.cursor()
+                pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+                    shard_filter('page_id', shard_id, 4)))
+                generate_matrix(self._cnx, pages, self._page_dict, self._category_dict, writer)
+        records = np.frombuffer(output.getvalue(), dtype=RECORD_DTYPE)
+        return np.unique(records)
+
+    def _check(self, opener, suffix, range_size, stale_spill=False):
+        dumps = [self._write_dump(table, opener, suffix) for table in ['page', 'pagelinks', 'categorylinks']]
+        output_dir = os.path.join(self._tmpdir, 'matrix' + suffix)
+        os.makedirs(output_dir)
+        if stale_spill:
+            # Left behind by an interrupted run.
+            os.makedirs(os.path.join(output_dir, 'spill'))
+            np.zeros(10, dtype=RECORD_DTYPE).tofile(os.path.join(output_dir, 'spill', 'pagelinks-000000.00000'))
+        counts = build_matrix(*dumps, page_dict=self._page_dict, category_dict=self._category_dict,
+                              output_dir=output_dir, num_shards=3, workers=2, range_size=range_size)
+        filenames = [os.path.join(output_dir, 'data.bin.{0:05d}-of-00003'.format(n)) for n in range(3)]
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         sorted([os.path.basename(f) + suffix for f in filenames for suffix in ['', '.count']]))
+        shards = [np.fromfile(filename, dtype=RECORD_DTYPE) for filename in filenames]
+        self.assertEqual([len(shard) for shard in shards], counts)
+        self.assertEqual([read_count(filename) for filename in filenames], counts)
+        block_size = (self._page_dict.size() - 1) // 3 + 1
+        for n, shard in enumerate(shards):
+            self.assertTrue(np.all(shard['row'] // block_size == n))
+        np.testing.assert_array_equal(np.concatenate(shards), self._expected())
+
+    def test_plain(self):
+        self._check(open, '.sql', 4096)
+
+    def test_gzip(self):
+        self._check(gzip.open, '.sql.gz', 4096)
+
+    def test_stale_spill(self):
+        self._check(open, '.sql', 4096, stale_spill=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,9 +18,13 @@
 from __future__ import generators, print_function
 
 import argparse
+import functools
+import multiprocessing
 import mysql.connector
 import os
 
+import numpy as np
+
 def ResultIter(cursor):
     'An iterator that uses fetchmany to keep memory usage down'
     while True:
@@ -46,32 +50,133 @@ def process_page(cnx, result, min_links, page_out, category_set):
     incount = inlinks.fetchall()[0][0]
     if incount + outcount < min_links:
         return
-    page_out.write(page_title.encode('utf-8') + '\n')
+    page_out.write(page_title + '\n')
     categories = cnx.cursor()
     categories.execute("select cl_to from categorylinks where cl_from = {0}".format(page_id))
     for category_info in categories.fetchall():
         category_set.add(category_info[0])
 
+
+# Aggregate mode: each query covers the pages with page_id in [{0}, {1}).
+RANGE_QUERIES = {
+    'pages': "select page_id, page_title from page where page_is_redirect = 0"
+             " and page_id >= {0} and page_id < {1} order by page_id",
+    'outlinks': "select pl_from, count(*) from pagelinks where pl_from >= {0} and pl_from < {1} group by pl_from",
+    'inlinks': "select p.page_id, count(*) from page p"
+               " join pagelinks pl on pl.pl_from_namespace = 0 and pl.pl_namespace = 0 and pl.pl_title = p.page_title"
+               " where p.page_id >= {0} and p.page_id < {1} group by p.page_id",
+    'categories': "select cl_from, cl_to from categorylinks where cl_from >= {0} and cl_from < {1}",
+}
+
+# Connection of each aggregate mode worker process.
+_connection = None
+
+
+def _init_worker(connect):
+    global _connection
+    _connection = connect()
+
+
+def _counts(cursor, page_ids):
+    """ Returns the counts of a (page_id, count) result aligned with the sorted page_ids. """
+    result = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    counts = np.zeros(page_ids.shape, dtype=np.int64)
+    if len(page_ids):
+        pos = np.minimum(np.searchsorted(page_ids, result[:, 0]), len(page_ids) - 1)
+        found = page_ids[pos] == result[:, 0]
+        counts[pos[found]] = result[found, 1]
+    return counts
+
+
+def count_range(start, stop, min_links):
+    """ Returns the titles of the non redirect pages in the page_id range [start, stop) with at
+    least min_links links, in page_id order, and the set of their categories.
+    """
+    cursor = _connection.cursor()
+    cursor.execute(RANGE_QUERIES['pages'].format(start, stop))
+    pages = cursor.fetchall()
+    page_ids = np.array([page[0] for page in pages], dtype=np.int64)
+
+    cursor.execute(RANGE_QUERIES['outlinks'].format(start, stop))
+    links = _counts(cursor, page_ids)
+    cursor.execute(RANGE_QUERIES['inlinks'].format(start, stop))
+    links += _counts(cursor, page_ids)
+    selected = links >= min_links
+
+    cursor.execute(RANGE_QUERIES['categories'].format(start, stop))
+    category_set = set()
+    selected_ids = page_ids[selected]
+    for rows in iter(functools.partial(cursor.fetchmany, 10000), []):
+        cl_from = np.array([row[0] for row in rows], dtype=np.int64)
+        for index in np.flatnonzero(np.isin(cl_from, selected_ids)):
+            category_set.add(rows[index][1])
+    return [page[1] for page, keep in zip(pages, selected) if keep], category_set
+
+
+def page_ranges(cnx, num_ranges):
+    """ Splits the page_id space in num_ranges [start, stop) ranges of equal width. """
+    cursor = cnx.cursor()
+    cursor.execute("select min(page_id), max(page_id) from page")
+    first, last = cursor.fetchall()[0]
+    if first is None:
+        return []
+    bounds = np.unique(np.linspace(first, last + 1, num_ranges + 1).astype(np.int64))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def aggregate_counts(connect, min_links, workers, num_ranges=None):
+    """ Computes the generate_counts output with GROUP BY queries over page_id ranges, run by a
+    pool of workers with one connection each. connect must be picklable.
+    Returns the page titles, in page_id order, and the set of categories.
+    """
+    cnx = connect()
+    ranges = page_ranges(cnx, num_ranges or 4 * workers)
+    cnx.close()
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(connect,))
+    try:
+        results = pool.starmap(count_range, [(start, stop, min_links) for start, stop in ranges])
+    finally:
+        pool.close()
+        pool.join()
+    titles = [title for range_titles, _ in results for title in range_titles]
+    category_set = set()
+    for _, range_categories in results:
+        category_set |= range_categories
+    return titles, category_set
+
+
 def main():
     parser = argparse.ArgumentParser(description='wikipedia page link counts')
     parser.add_argument('--password')
-    parser.add_argument('--min_links', default=50)
+    parser.add_argument('--min_links', type=int, default=50)
     parser.add_argument('--page_dictionary', required=True)
     parser.add_argument('--category_file', required=True)
+    parser.add_argument('--aggregate', action='store_true',
+                        help='Count the links of all the pages with GROUP BY queries over page_id ranges')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
     args = parser.parse_args()
 
-    cnx = mysql.connector.connect(user=os.environ['USER'], passwd=args.password, database='enwiki')
-    pages = cnx.cursor(buffered=True)
-    pages.execute("select * from page")
-    category_set = set()
+    connect = functools.partial(mysql.connector.connect, user=os.environ['USER'], passwd=args.password,
+                                database='enwiki')
+    if args.aggregate:
+        titles, category_set = aggregate_counts(connect, args.min_links, args.workers)
+        with open(args.page_dictionary, 'w') as page_out:
+            for title in titles:
+                page_out.write(title + '\n')
+    else:
+        cnx = connect()
+        pages = cnx.cursor(buffered=True)
+        pages.execute("select * from page order by page_id")
+        category_set = set()
 
-    with open(args.page_dictionary, 'w') as page_out:
-        for result in ResultIter(pages):
-            process_page(cnx, result, args.min_links, page_out, category_set)
+        with open(args.page_dictionary, 'w') as page_out:
+            for result in ResultIter(pages):
+                process_page(cnx, result, args.min_links, page_out, category_set)
 
     with open(args.category_file, 'w') as category_file:
-        for cat in category_set:
-            category_file.write(cat.encode('utf-8') + "\n")
+        for cat in sorted(category_set):
+            category_file.write(cat + "\n")
 
 if __name__ == '__main__':
     main()
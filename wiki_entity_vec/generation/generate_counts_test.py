@@ -0,0 +1,54 @@
+from __future__ import print_function
+import unittest
+
+import functools
+import io
+import tempfile
+import os
+
+from generate_counts import ResultIter, aggregate_counts, page_ranges, process_page
+import sqlite_standin
+
+
+class GenerateCountsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._db = os.path.join(self._tmpdir, 'enwiki.db')
+        cnx, _ = sqlite_standin.create_database(self._db, 2000, 40000, 100, 6000, redirect_fraction=0.1)
+        cnx.close()
+
+    def _legacy(self, min_links):
+        cnx = sqlite_standin.connect(self._db)
+        pages = cnx.cursor()
+        pages.execute("select * from page order by page_id")
+        page_out = io.StringIO()
+        category_set = set()
+        for result in ResultIter(pages):
+            process_page(cnx, result, min_links, page_out, category_set)
+        cnx.close()
+        return page_out.getvalue().splitlines(), category_set
+
+    def test_aggregate(self):
+        connect = functools.partial(sqlite_standin.connect, self._db)
+        expected_titles, expected_categories = self._legacy(25)
+        self.assertGreater(len(expected_titles), 100)
+        self.assertLess(len(expected_titles), 1800)
+        titles, categories = aggregate_counts(connect, 25, workers=2, num_ranges=7)
+        self.assertEqual(titles, expected_titles)
+        self.assertEqual(categories, expected_categories)
+
+    def test_page_ranges(self):
+        cnx = sqlite_standin.connect(self._db)
+        ranges = page_ranges(cnx, 3)
+        self.assertEqual(ranges[0][0], 1)
+        self.assertEqual(ranges[-1][1], 2001)
+        for (_, stop), (start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(stop, start)
+        empty = sqlite_standin.connect()
+        sqlite_standin.create_schema(empty)
+        self.assertEqual(page_ranges(empty, 3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,32 +8,13 @@ from __future__ import generators, print_function
 import argparse
 import mysql.connector
 import os
-import struct
 
-from dictionary import Dictionary
-
-FORMAT = 'IIf'
-
-class PageKeyMapper(object):
-    """ Map sql table keys (page_id) to page_title.
-    """
-    def __init__(self, connection):
-        self._connection = connection
-        self._keys = {}
-
-    def lookup(self, key):
-        """ Returns the page_title given a page_id.
-        Caches the result.
-        """
-        if key in self._keys:
-            return self._keys[key]
-        page = self._connection.cursor()
-        page.execute(
-            "select page_title from page where page_id = {0}".format(key))
-        name = page.fetchall()[0][0]
-        self._keys[key] = name
-        return name
+import numpy as np
 
+from compressed import CODECS, CompressedShardWriter, shard_filename
+from dictionary import load_dictionary
+from page_index import PageIndex
+from record_writer import RecordWriter
 
 def ResultIter(cursor):
     'An iterator that uses fetchmany to keep memory usage down'
@@ -45,8 +26,35 @@ def ResultIter(cursor):
             yield result
 
 
-def generate_matrix(cnx, pages, page_dict, category_dict, file):
-    mapper = PageKeyMapper(cnx)
+def load_page_index(cnx, page_dict):
+    """ Builds the PageIndex of the namespace 0 pages with a single query.
+    """
+    pages = cnx.cursor()
+    pages.execute("select page_id, page_title from page where page_namespace = 0")
+    return PageIndex.build(ResultIter(pages), page_dict)
+
+
+def write_row(writer, matrix_row, inlink_cols, outlink_titles, categories, page_dict, category_dict):
+    """ Writes the inlinks, outlinks and categories of a page, in this order.
+    inlink_cols: dictionary indices of the inlink pages, -1 for pages that are not in the dictionary.
+    """
+    outlink_cols = page_dict.ids(outlink_titles)
+    category_cols = category_dict.ids(categories)
+    cols = np.concatenate([
+        inlink_cols[inlink_cols != -1],
+        outlink_cols[outlink_cols != -1] + page_dict.size(),
+        category_cols[category_cols != -1] + 2 * page_dict.size(),
+    ])
+    writer.write_records(matrix_row, cols)
+
+
+def generate_matrix(cnx, pages, page_dict, category_dict, writer, page_index=None):
+    """ Writes the records of the pages returned by the pages cursor to a RecordWriter.
+    page_index maps the inlink page_ids to dictionary indices; it is loaded from the database when
+    not specified.
+    """
+    if page_index is None:
+        page_index = load_page_index(cnx, page_dict)
 
     for result in ResultIter(pages):
         page_id = result[0]
@@ -54,44 +62,108 @@ def generate_matrix(cnx, pages, page_dict, category_dict, file):
         if not page_dict.contains(page_title):
             continue
 
-        outlinks_offset = page_dict.size()
-        categorylinks_offset = 2 * page_dict.size()
-
         inlinks = cnx.cursor()
         inlinks.execute(
-            u"select pl_from from pagelinks where pl_from_namespace = 0 and pl_namespace = 0 and pl_title = '{0}'".format(page_title))
-        inlink_keys = []
-        for link in inlinks.fetchall():
-            from_id = int(link[0])
-            inlink_keys.append(from_id)
-
-        matrix_row = page_dict.id(page_title)
-        for key in inlink_keys:
-            from_title = mapper.lookup(key)
-            col = page_dict.id(from_title)
-            if col == -1:
-                continue
-            file.write(struct.pack(FORMAT, matrix_row, col, 1.0))
+            u"select pl_from from pagelinks where pl_from_namespace = 0 and pl_namespace = 0 and pl_title = '{0}' order by pl_from".format(page_title))
+        inlink_keys = [int(link[0]) for link in inlinks.fetchall()]
 
         outlinks = cnx.cursor()
         outlinks.execute(
-            "select pl_title from pagelinks where pl_from = {0}".format(page_id))
-        for link in outlinks.fetchall():
-            col = page_dict.id(link[0])
-            if col == -1:
-                continue
-            col += outlinks_offset
-            file.write(struct.pack(FORMAT, matrix_row, col, 1.0))
+            "select pl_title from pagelinks where pl_from = {0} order by pl_namespace, pl_title".format(page_id))
 
         categories = cnx.cursor()
         categories.execute(
-            "select cl_to from categorylinks where cl_from = {0}".format(page_id))
-        for link in categories.fetchall():
-            col = category_dict.id(link[0])
-            if col == -1:
-                continue
-            col += categorylinks_offset
-            file.write(struct.pack(FORMAT, matrix_row, col, 1.0))
+            "select cl_to from categorylinks where cl_from = {0} order by cl_to".format(page_id))
+
+        write_row(writer, page_dict.id(page_title), page_index.lookup(inlink_keys),
+                  [link[0] for link in outlinks.fetchall()], [link[0] for link in categories.fetchall()],
+                  page_dict, category_dict)
+
+
+def shard_filter(column, shard_id, num_shards):
+    return "MOD(CRC32({0}), {2}) = {1}".format(column, shard_id, num_shards)
+
+
+# Each relation of a shard, ordered by the page_id of the matrix row and then in the order used by
+# the per page queries of generate_matrix().
+BULK_QUERIES = {
+    'pages': "select page_id, page_title from page where {0} order by page_id",
+    'inlinks': "select p.page_id, pl.pl_from from page p"
+               " join pagelinks pl on pl.pl_from_namespace = 0 and pl.pl_namespace = 0 and pl.pl_title = p.page_title"
+               " where {0} order by p.page_id, pl.pl_from",
+    'outlinks': "select pl_from, pl_title from pagelinks where {0} order by pl_from, pl_namespace, pl_title",
+    'categories': "select cl_from, cl_to from categorylinks where {0} order by cl_from, cl_to",
+}
+BULK_FILTER_COLUMNS = {
+    'pages': 'page_id',
+    'inlinks': 'p.page_id',
+    'outlinks': 'pl_from',
+    'categories': 'cl_from',
+}
+
+
+class KeyedStream(object):
+    """ Groups the (key, value) rows of a cursor ordered by key.
+    """
+    def __init__(self, cursor):
+        self._rows = ResultIter(cursor)
+        self._next = next(self._rows, None)
+
+    def take(self, key):
+        """ Returns the values of the rows with the given key, skipping the rows with smaller keys.
+        """
+        values = []
+        while self._next is not None and self._next[0] <= key:
+            if self._next[0] == key:
+                values.append(self._next[1])
+            self._next = next(self._rows, None)
+        return values
+
+
+def generate_matrix_bulk(connect, shard_id, num_shards, page_dict, category_dict, writer, page_index=None,
+                         connections=None):
+    """ Writes the same shard as generate_matrix() with one streaming query per relation.
+
+    connect() must return a new database connection: the relations are read concurrently and a
+    connection can only stream one result set at a time. Memory usage is bounded by the links of a
+    single page.
+    connections: optional open connections, one per BULK_QUERIES relation, used instead of connect().
+    They are left open, with their result sets read to the end, so that they can be reused.
+    """
+    owned = connections is None
+    if owned:
+        connections = [connect() for _ in BULK_QUERIES]
+    if page_index is None:
+        page_index = load_page_index(connections[0], page_dict)
+
+    streams = {}
+    for (name, query), cnx in zip(BULK_QUERIES.items(), connections):
+        cursor = cnx.cursor()
+        cursor.execute(query.format(shard_filter(BULK_FILTER_COLUMNS[name], shard_id, num_shards)))
+        streams[name] = cursor
+
+    inlinks = KeyedStream(streams['inlinks'])
+    outlinks = KeyedStream(streams['outlinks'])
+    categories = KeyedStream(streams['categories'])
+
+    for page_id, page_title in ResultIter(streams['pages']):
+        page_inlinks = inlinks.take(page_id)
+        page_outlinks = outlinks.take(page_id)
+        page_categories = categories.take(page_id)
+        if not page_dict.contains(page_title):
+            continue
+        write_row(writer, page_dict.id(page_title), page_index.lookup(page_inlinks), page_outlinks,
+                  page_categories, page_dict, category_dict)
+
+    if owned:
+        for cnx in connections:
+            cnx.close()
+        return
+    # The link streams may have rows past the last page.
+    for cursor in streams.values():
+        for _ in ResultIter(cursor):
+            pass
+        cursor.close()
 
 
 def main():
@@ -102,24 +174,40 @@ def main():
     parser.add_argument('--category_file', required=True)
     parser.add_argument('--num_shards', type=int, default=32)
     parser.add_argument('--shard_id', type=int, required=True)
+    parser.add_argument('--compress', choices=sorted(CODECS.keys()),
+                        help='Write a block compressed data.z shard')
+    parser.add_argument('--page_index', help='PageIndex file generated by page_index.py')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Stream each relation once instead of querying the links of every page')
     args = parser.parse_args()
 
-    page_dict = Dictionary()
-    page_dict.load(args.page_dictionary)
-    category_dict = Dictionary()
-    category_dict.load(args.category_file)
-
-    cnx = mysql.connector.connect(
-        user=os.environ['USER'], passwd=args.password, database='enwiki')
-    pages = cnx.cursor(buffered=True)
-    pages.execute("select page_id, page_title from page where MOD(CRC32(page_id), {1}) = {0}".format(
-        args.shard_id, args.num_shards))
-
-    output_file = os.path.join(
-        args.output_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(args.shard_id, args.num_shards))
-    with open(output_file, 'w') as file:
-        generate_matrix(cnx, pages, page_dict, category_dict, file)
-
+    page_dict = load_dictionary(args.page_dictionary)
+    category_dict = load_dictionary(args.category_file)
+
+    def connect():
+        return mysql.connector.connect(
+            user=os.environ['USER'], passwd=args.password, database='enwiki')
+
+    if args.compress:
+        output = CompressedShardWriter(
+            shard_filename(args.output_dir, args.shard_id, args.num_shards), codec=args.compress)
+    else:
+        output = os.path.join(
+            args.output_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(args.shard_id, args.num_shards))
+    writer = RecordWriter(output)
+    page_index = PageIndex.load(args.page_index) if args.page_index else None
+    if args.bulk:
+        generate_matrix_bulk(connect, args.shard_id, args.num_shards, page_dict, category_dict, writer,
+                             page_index=page_index)
+    else:
+        cnx = connect()
+        pages = cnx.cursor(buffered=True)
+        pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+            shard_filter('page_id', args.shard_id, args.num_shards)))
+        generate_matrix(cnx, pages, page_dict, category_dict, writer, page_index=page_index)
+    print('Records: {0}'.format(writer.close()))
+    if args.compress:
+        output.close()
 
 if __name__ == '__main__':
     main()
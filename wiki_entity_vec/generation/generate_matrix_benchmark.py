@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the per page queries of generate_matrix() with the bulk extraction mode.
+
+Runs against a SQLite stand-in of the enwiki tables, so the figures only show the difference in
+the number of statements executed; with a MySQL server every statement is also a round trip.
+
+Usage: python generate_matrix_benchmark.py [--pages=N] [--links=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from generate_matrix import generate_matrix, generate_matrix_bulk, shard_filter
+from record_writer import RecordWriter
+import sqlite_standin
+
+
+class NullFile(object):
+    def write(self, buf):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate_matrix benchmark')
+    parser.add_argument('--pages', type=int, default=100000)
+    parser.add_argument('--links', type=int, default=2000000)
+    parser.add_argument('--categories', type=int, default=5000)
+    parser.add_argument('--categorylinks', type=int, default=300000)
+    parser.add_argument('--num_shards', type=int, default=4)
+    parser.add_argument('--compact_dictionary', action='store_true',
+                        help='Load the dictionaries as CompactDictionary, through their compiled files')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = os.path.join(tmpdir, 'enwiki.db')
+        cnx, titles = sqlite_standin.create_database(db, args.pages, args.links, args.categories,
+                                                     args.categorylinks)
+        cnx.close()
+
+        page_dict = sqlite_standin.make_dictionary(os.path.join(tmpdir, 'pages.txt'), titles,
+                                                   compact=args.compact_dictionary)
+        category_dict = sqlite_standin.make_dictionary(
+            os.path.join(tmpdir, 'categories.txt'),
+            ['Category_{0}'.format(n) for n in range(1, args.categories + 1)], compact=args.compact_dictionary)
+
+        # Only the first shard is generated.
+        start = time.time()
+        legacy = RecordWriter(NullFile())
+        cnx = sqlite_standin.connect(db)
+        pages = cnx.cursor(buffered=True)
+        pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+            shard_filter('page_id', 0, args.num_shards)))
+        generate_matrix(cnx, pages, page_dict, category_dict, legacy)
+        cnx.close()
+        legacy_count = legacy.close()
+        legacy_time = time.time() - start
+
+        start = time.time()
+        bulk = RecordWriter(NullFile())
+        generate_matrix_bulk(lambda: sqlite_standin.connect(db), 0, args.num_shards,
+                             page_dict, category_dict, bulk)
+        bulk_count = bulk.close()
+        bulk_time = time.time() - start
+
+        for name, count, elapsed in [('per page', legacy_count, legacy_time), ('bulk', bulk_count, bulk_time)]:
+            print('{0:>8}: {1:>10} records {2:>8.2f}s {3:>12.0f} records/s'.format(
+                name, count, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
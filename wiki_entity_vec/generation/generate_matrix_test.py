@@ -0,0 +1,66 @@
+from __future__ import print_function
+import unittest
+
+import io
+import tempfile
+import os
+
+from dictionary import CompactDictionary, load_dictionary
+from generate_matrix import generate_matrix, generate_matrix_bulk, shard_filter
+from record_writer import RecordWriter
+import sqlite_standin
+
+
+class GenerateMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._db = os.path.join(self._tmpdir, 'enwiki.db')
+        cnx, titles = sqlite_standin.create_database(self._db, 2000, 20000, 50, 4000)
+        cnx.close()
+
+        # Leave some pages and categories out of the dictionaries.
+        self._page_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'pages.txt'), titles[::3] + titles[1::3])
+        self._category_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'categories.txt'), ['Category_{0}'.format(n) for n in range(1, 50, 2)])
+
+    def _legacy(self, shard_id, num_shards, page_dict=None, category_dict=None):
+        cnx = sqlite_standin.connect(self._db)
+        pages = cnx.cursor(buffered=True)
+        pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+            shard_filter('page_id', shard_id, num_shards)))
+        output = io.BytesIO()
+        writer = RecordWriter(output, buffer_size=1000)
+        generate_matrix(cnx, pages, page_dict or self._page_dict, category_dict or self._category_dict, writer)
+        writer.close()
+        cnx.close()
+        return output.getvalue()
+
+    def _bulk(self, shard_id, num_shards, page_dict=None, category_dict=None):
+        output = io.BytesIO()
+        with RecordWriter(output, buffer_size=1000) as writer:
+            generate_matrix_bulk(lambda: sqlite_standin.connect(self._db), shard_id, num_shards,
+                                 page_dict or self._page_dict, category_dict or self._category_dict, writer)
+        return output.getvalue()
+
+    def test_bulk(self):
+        total = 0
+        for shard_id in range(3):
+            expected = self._legacy(shard_id, 3)
+            self.assertEqual(self._bulk(shard_id, 3), expected)
+            total += len(expected)
+        self.assertGreater(total, 0)
+
+    def test_compact_dictionary(self):
+        page_dict = load_dictionary(os.path.join(self._tmpdir, 'pages.txt'), cache=True)
+        category_dict = load_dictionary(os.path.join(self._tmpdir, 'categories.txt'), cache=True)
+        self.assertIsInstance(page_dict, CompactDictionary)
+        for shard_id in range(3):
+            expected = self._legacy(shard_id, 3)
+            self.assertEqual(self._legacy(shard_id, 3, page_dict, category_dict), expected)
+            self.assertEqual(self._bulk(shard_id, 3, page_dict, category_dict), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+page_id -> page dictionary index mapping.
+
+Only the pages in the page dictionary are kept, as two sorted arrays (page_id and dictionary
+index, 8 bytes per page), so that the mapping of the whole page table can be loaded in one
+streaming pass, shared by all the shard jobs as a .npz file and queried with a binary search.
+
+Usage:
+  python page_index.py --page_dictionary=pages.txt --output=page_index.npz --password=...
+  python page_index.py --page_dictionary=pages.txt --output=page_index.npz --page_dump=page.sql.gz
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+
+from dictionary import load_dictionary
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PageIndex(object):
+    """ Sorted page_id -> dictionary index arrays.
+    """
+    ID_DTYPE = np.uint32
+    INDEX_DTYPE = np.int32
+    # Titles looked up per Dictionary.ids() call by build().
+    BATCH_SIZE = 64 * 1024
+
+    def __init__(self, page_ids=None, indices=None):
+        page_ids = np.asarray(page_ids if page_ids is not None else [], dtype=self.ID_DTYPE)
+        indices = np.asarray(indices if indices is not None else [], dtype=self.INDEX_DTYPE)
+        order = np.argsort(page_ids, kind='stable')
+        self._page_ids = page_ids[order]
+        self._indices = indices[order]
+
+    @classmethod
+    def build(cls, pages, page_dict):
+        """ Builds the index from an iterable of (page_id, page_title) pairs.
+        Pages that are not in the dictionary are dropped.
+        """
+        parts = []
+        for batch in _batches(pages, cls.BATCH_SIZE):
+            page_ids = np.array([page_id for page_id, _ in batch], dtype=np.int64)
+            indices = page_dict.ids([title for _, title in batch])
+            found = indices != -1
+            parts.append(cls(page_ids[found], indices[found]))
+        return cls.concatenate(parts)
+
+    @classmethod
+    def concatenate(cls, parts):
+        return cls(np.concatenate([p._page_ids for p in parts] + [np.empty((0,), dtype=cls.ID_DTYPE)]),
+                   np.concatenate([p._indices for p in parts] + [np.empty((0,), dtype=cls.INDEX_DTYPE)]))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            index = cls()
+            index._page_ids = data['page_ids']
+            index._indices = data['indices']
+        return index
+
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            np.savez(file, page_ids=self._page_ids, indices=self._indices)
+
+    def __len__(self):
+        return len(self._page_ids)
+
+    def nbytes(self):
+        return self._page_ids.nbytes + self._indices.nbytes
+
+    def lookup(self, page_ids):
+        """ Dictionary indices of an array of page_ids; -1 for the pages that are not indexed. """
+        keys = np.asarray(page_ids, dtype=np.int64)
+        if len(self._page_ids) == 0:
+            return np.full(keys.shape, -1, dtype=self.INDEX_DTYPE)
+        pos = np.minimum(np.searchsorted(self._page_ids, keys), len(self._page_ids) - 1)
+        return np.where(self._page_ids[pos] == keys, self._indices[pos], -1).astype(self.INDEX_DTYPE)
+
+    def id(self, page_id):
+        """ Dictionary index of a page_id, or -1. """
+        pos = int(np.searchsorted(self._page_ids, page_id))
+        if pos < len(self._page_ids) and self._page_ids[pos] == page_id:
+            return int(self._indices[pos])
+        return -1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the page_id -> page dictionary index mapping')
+    parser.add_argument('--page_dictionary', required=True)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--password')
+    parser.add_argument('--page_dump', help='Read the page table from a SQL dump instead of MySQL')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    page_dict = load_dictionary(args.page_dictionary)
+
+    if args.page_dump:
+        from dump_matrix import load_page_index
+        index = load_page_index(args.page_dump, page_dict, args.workers)
+    else:
+        import mysql.connector
+        from generate_matrix import ResultIter
+        cnx = mysql.connector.connect(user=os.environ['USER'], passwd=args.password, database='enwiki')
+        pages = cnx.cursor()
+        pages.execute("select page_id, page_title from page where page_namespace = 0")
+        index = PageIndex.build(ResultIter(pages), page_dict)
+        cnx.close()
+
+    index.save(args.output)
+    print('Pages: {0}, {1} bytes'.format(len(index), index.nbytes()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+from generate_matrix import load_page_index
+from page_index import PageIndex
+import sqlite_standin
+
+
+class PageIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._cnx, titles = sqlite_standin.create_database(':memory:', 3000, 100, 10, 100)
+        self._page_dict = sqlite_standin.make_dictionary(os.path.join(self._tmpdir, 'pages.txt'), titles[::2])
+
+    def _pages(self):
+        cursor = self._cnx.cursor()
+        cursor.execute('select page_id, page_namespace, page_title from page')
+        return cursor.fetchall()
+
+    def test_lookup(self):
+        index = load_page_index(self._cnx, self._page_dict)
+        pages = self._pages()
+        expected = [self._page_dict.id(title) if namespace == 0 else -1 for _, namespace, title in pages]
+        self.assertEqual(len(index), sum(1 for e in expected if e != -1))
+        self.assertEqual([index.id(page_id) for page_id, _, _ in pages], expected)
+        keys = np.array([page_id for page_id, _, _ in pages] + [0, 10**6])
+        np.testing.assert_array_equal(index.lookup(keys), expected + [-1, -1])
+        self.assertEqual(index.nbytes(), 8 * len(index))
+
+    def test_save(self):
+        index = PageIndex.build([(7, 'Page_1'), (3, 'Page_3'), (5, 'missing')], self._page_dict)
+        filename = os.path.join(self._tmpdir, 'page_index.npz')
+        index.save(filename)
+        loaded = PageIndex.load(filename)
+        self.assertEqual(len(loaded), 2)
+        np.testing.assert_array_equal(loaded.lookup([3, 5, 7]), [self._page_dict.id('Page_3'), -1, 0])
+        self.assertEqual(PageIndex().lookup([1, 2]).tolist(), [-1, -1])
+        self.assertEqual(PageIndex().id(1), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generate all the matrix shards with a process pool.
+
+Each worker opens its database connections once and runs generate_matrix for one shard at a time
+with them: a single connection, or in --bulk mode one per relation, since the relations are
+streamed concurrently and a connection streams one result set at a time. A shard is written to a temporary file that is renamed
+once complete, followed by a <shard>.done JSON manifest with its record count and throughput.
+Shards with a manifest are skipped, so an interrupted run is resumed by running it again.
+
+Usage:
+  python run_shards.py --page_dictionary=pages.txt --category_file=categories.txt \\
+      --output_dir=matrix --num_shards=32 [--page_index=page_index.npz] [--bulk]
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+import mysql.connector
+
+from compressed import CODECS, CompressedShardWriter, shard_filename
+from dictionary import load_dictionary
+from generate_matrix import BULK_QUERIES, generate_matrix, generate_matrix_bulk, load_page_index, shard_filter
+from page_index import PageIndex
+from record_writer import RecordWriter, write_count
+
+DONE_SUFFIX = '.done'
+
+# Worker process state, set by the pool initializer.
+_STATE = {}
+
+
+def _init_worker(state):
+    _STATE.update(state)
+    if state['bulk']:
+        _STATE['connections'] = [state['connect']() for _ in BULK_QUERIES]
+    else:
+        _STATE['cnx'] = state['connect']()
+
+
+def shard_path(output_dir, shard_id, num_shards, compress=None):
+    if compress:
+        return shard_filename(output_dir, shard_id, num_shards)
+    return os.path.join(output_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, num_shards))
+
+
+def read_manifest(path):
+    """ Returns the completion manifest of a shard, or None if the shard is not complete. """
+    try:
+        with open(path + DONE_SUFFIX, 'r') as file:
+            manifest = json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+    return manifest if os.path.exists(path) else None
+
+
+def _write_manifest(path, manifest):
+    with open(path + DONE_SUFFIX + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.rename(path + DONE_SUFFIX + '.tmp', path + DONE_SUFFIX)
+
+
+def generate_shard(shard_id):
+    state = _STATE
+    path = shard_path(state['output_dir'], shard_id, state['num_shards'], state['compress'])
+    tmp_path = path + '.tmp'
+    start = time.time()
+
+    if state['compress']:
+        output = CompressedShardWriter(tmp_path, codec=state['compress'])
+    else:
+        output = open(tmp_path, 'wb')
+    writer = RecordWriter(output)
+    if state['bulk']:
+        generate_matrix_bulk(state['connect'], shard_id, state['num_shards'], state['page_dict'],
+                             state['category_dict'], writer, page_index=state['page_index'],
+                             connections=state['connections'])
+    else:
+        pages = state['cnx'].cursor(buffered=True)
+        pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+            shard_filter('page_id', shard_id, state['num_shards'])))
+        generate_matrix(state['cnx'], pages, state['page_dict'], state['category_dict'], writer,
+                        page_index=state['page_index'])
+    count = writer.close()
+    output.close()
+
+    os.rename(tmp_path, path)
+    if not state['compress']:
+        write_count(path, count)
+    elapsed = time.time() - start
+    manifest = {
+        'shard_id': shard_id,
+        'num_shards': state['num_shards'],
+        'records': count,
+        'bytes': os.path.getsize(path),
+        'seconds': elapsed,
+        'records_per_sec': count / elapsed if elapsed > 0 else None,
+    }
+    _write_manifest(path, manifest)
+    return manifest
+
+
+def run_shards(connect, page_dict, category_dict, output_dir, num_shards, workers=None, bulk=False,
+               compress=None, page_index=None, shard_ids=None):
+    """ Generates the shards that are not complete. connect must be picklable.
+    Returns the manifests of the shards generated by this run, in completion order.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    shard_ids = range(num_shards) if shard_ids is None else shard_ids
+    pending = [shard_id for shard_id in shard_ids
+               if read_manifest(shard_path(output_dir, shard_id, num_shards, compress)) is None]
+    print('Shards: {0} complete, {1} pending'.format(len(shard_ids) - len(pending), len(pending)))
+    if not pending:
+        return []
+
+    if page_index is None:
+        cnx = connect()
+        page_index = load_page_index(cnx, page_dict)
+        cnx.close()
+
+    state = {
+        'connect': connect,
+        'bulk': bulk,
+        'compress': compress,
+        'output_dir': output_dir,
+        'num_shards': num_shards,
+        'page_dict': page_dict,
+        'category_dict': category_dict,
+        'page_index': page_index,
+    }
+    manifests = []
+    pool = multiprocessing.Pool(min(workers, len(pending)), initializer=_init_worker, initargs=(state,))
+    try:
+        for manifest in pool.imap_unordered(generate_shard, pending):
+            print('Shard {0}: {1} records in {2:.1f}s, {3:.0f} records/s'.format(
+                manifest['shard_id'], manifest['records'], manifest['seconds'],
+                manifest['records_per_sec'] or 0))
+            manifests.append(manifest)
+    finally:
+        pool.close()
+        pool.join()
+    return manifests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate all the matrix shards')
+    parser.add_argument('--password')
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--page_dictionary', required=True)
+    parser.add_argument('--category_file', required=True)
+    parser.add_argument('--num_shards', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--compress', choices=sorted(CODECS.keys()),
+                        help='Write block compressed data.z shards')
+    parser.add_argument('--page_index', help='PageIndex file generated by page_index.py')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Stream each relation once instead of querying the links of every page')
+    args = parser.parse_args()
+
+    page_dict = load_dictionary(args.page_dictionary)
+    category_dict = load_dictionary(args.category_file)
+    page_index = PageIndex.load(args.page_index) if args.page_index else None
+
+    connect = functools.partial(mysql.connector.connect, user=os.environ['USER'], passwd=args.password,
+                                database='enwiki')
+    start = time.time()
+    manifests = run_shards(connect, page_dict, category_dict, args.output_dir, args.num_shards,
+                           workers=args.workers, bulk=args.bulk, compress=args.compress,
+                           page_index=page_index)
+    records = sum(manifest['records'] for manifest in manifests)
+    elapsed = time.time() - start
+    print('Generated {0} shards, {1} records in {2:.1f}s'.format(len(manifests), records, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from __future__ import print_function
+import unittest
+
+import functools
+import io
+import tempfile
+import os
+
+from generate_matrix import BULK_QUERIES, generate_matrix, shard_filter
+from record_writer import RecordWriter, read_count
+from run_shards import DONE_SUFFIX, read_manifest, run_shards, shard_path
+import sqlite_standin
+
+
+def _logged_connect(db, log):
+    with open(log, 'a') as file:
+        file.write('connect\n')
+    return sqlite_standin.connect(db)
+
+
+class RunShardsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._db = os.path.join(self._tmpdir, 'enwiki.db')
+        cnx, titles = sqlite_standin.create_database(self._db, 1000, 10000, 30, 2000)
+        cnx.close()
+        # The dictionaries are loaded from their compiled files, as the run_shards command does.
+        self._page_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'pages.txt'), titles[::2], compact=True)
+        self._category_dict = sqlite_standin.make_dictionary(
+            os.path.join(self._tmpdir, 'categories.txt'), ['Category_{0}'.format(n) for n in range(1, 30)],
+            compact=True)
+        self._connect = functools.partial(sqlite_standin.connect, self._db)
+        self._output_dir = os.path.join(self._tmpdir, 'matrix')
+        os.makedirs(self._output_dir)
+
+    def _expected(self, shard_id, num_shards):
+        cnx = self._connect()
+        pages = cnx.cursor()
+        pages.execute("select page_id, page_title from page where {0} order by page_id".format(
+            shard_filter('page_id', shard_id, num_shards)))
+        output = io.BytesIO()
+        with RecordWriter(output) as writer:
+            generate_matrix(cnx, pages, self._page_dict, self._category_dict, writer)
+        return output.getvalue()
+
+    def _run(self, **kwargs):
+        return run_shards(self._connect, self._page_dict, self._category_dict, self._output_dir, 4,
+                          workers=2, **kwargs)
+
+    def test_run(self):
+        manifests = self._run()
+        self.assertEqual(sorted(m['shard_id'] for m in manifests), [0, 1, 2, 3])
+        for shard_id in range(4):
+            path = shard_path(self._output_dir, shard_id, 4)
+            with open(path, 'rb') as file:
+                data = file.read()
+            self.assertEqual(data, self._expected(shard_id, 4))
+            manifest = read_manifest(path)
+            self.assertEqual(manifest['records'], len(data) // 12)
+            self.assertEqual(read_count(path), len(data) // 12)
+        self.assertFalse([name for name in os.listdir(self._output_dir) if name.endswith('.tmp')])
+
+        # Bulk mode generates the same shards, with the connections of each worker reused across shards.
+        bulk_dir = os.path.join(self._tmpdir, 'bulk')
+        os.makedirs(bulk_dir)
+        log = os.path.join(self._tmpdir, 'connect.log')
+        connect = functools.partial(_logged_connect, self._db, log)
+        run_shards(connect, self._page_dict, self._category_dict, bulk_dir, 4, workers=2, bulk=True)
+        for shard_id in range(4):
+            with open(shard_path(bulk_dir, shard_id, 4), 'rb') as file:
+                self.assertEqual(file.read(), self._expected(shard_id, 4))
+        with open(log, 'r') as file:
+            # One for the page index, then one per relation in each worker.
+            self.assertEqual(len(file.readlines()), 1 + 2 * len(BULK_QUERIES))
+
+    def test_resume(self):
+        self.assertEqual(sorted(m['shard_id'] for m in self._run(shard_ids=[0, 2, 3])), [0, 2, 3])
+        # Shard 1 crashed with a partial temporary file and shard 3 before its manifest was written.
+        with open(shard_path(self._output_dir, 1, 4) + '.tmp', 'wb') as file:
+            file.write(b'partial')
+        os.remove(shard_path(self._output_dir, 3, 4) + DONE_SUFFIX)
+        self.assertEqual(sorted(m['shard_id'] for m in self._run()), [1, 3])
+        self.assertEqual(self._run(), [])
+        for shard_id in [1, 3]:
+            with open(shard_path(self._output_dir, shard_id, 4), 'rb') as file:
+                self.assertEqual(file.read(), self._expected(shard_id, 4))
+
+    def test_compress(self):
+        manifests = self._run(compress='zlib', shard_ids=[1])
+        path = shard_path(self._output_dir, 1, 4, compress='zlib')
+        self.assertEqual(read_manifest(path)['records'], manifests[0]['records'])
+        self.assertIsNone(read_manifest(shard_path(self._output_dir, 1, 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming reader of mysqldump files, such as the wikipedia page, pagelinks and categorylinks
+dumps.
+
+Only the "INSERT INTO `table` VALUES (...),(...);" lines are parsed; every other line is
+skipped. Plain files are split in byte ranges that can be parsed independently: a line belongs to
+the range that contains its first byte. Gzipped files can't be split and are read as a sequence of
+line batches instead.
+"""
+
+from __future__ import print_function
+
+import gzip
+import os
+import re
+
+INSERT_RE = re.compile(r"INSERT INTO `([^`]+)` VALUES (.*);\s*$", re.S)
+# A parenthesized row; parenthesis and commas inside quoted strings don't terminate it.
+ROW_RE = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)", re.S)
+FIELD_RE = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)", re.S)
+ESCAPE_RE = re.compile(r"\\(.)", re.S)
+
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+QUOTED = {'\\': '\\\\', "'": "\\'", '\0': '\\0', '\n': '\\n', '\r': '\\r', '\x1a': '\\Z'}
+
+
+def unescape(value):
+    if '\\' not in value:
+        return value
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def split_values(values):
+    """ Returns the rows of the VALUES section of an INSERT statement, as tuples.
+    Strings are unescaped, NULL is None and numbers are converted to int or float.
+    """
+    rows = []
+    for row in ROW_RE.finditer(values):
+        fields = []
+        for match in FIELD_RE.finditer(row.group(1)):
+            quoted, literal = match.groups()
+            if quoted is not None:
+                fields.append(unescape(quoted))
+            elif literal == 'NULL':
+                fields.append(None)
+            else:
+                fields.append(_number(literal))
+        rows.append(tuple(fields))
+    return rows
+
+
+def parse_line(line):
+    """ Returns (table, rows) for an INSERT line and None for any other line.
+    line may be bytes, in which case it is decoded as UTF-8; binary columns that are not valid
+    UTF-8 are kept with surrogate escapes.
+    """
+    if isinstance(line, bytes):
+        if not line.startswith(b'INSERT INTO'):
+            return None
+        line = line.decode('utf-8', 'surrogateescape')
+    elif not line.startswith('INSERT INTO'):
+        return None
+    match = INSERT_RE.match(line)
+    if match is None:
+        return None
+    return match.group(1), split_values(match.group(2))
+
+
+def quote(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + ''.join(QUOTED.get(c, c) for c in value) + "'"
+    return repr(value)
+
+
+def format_insert(table, rows):
+    """ Formats rows as an INSERT line, as written by mysqldump. """
+    return 'INSERT INTO `{0}` VALUES {1};\n'.format(
+        table, ','.join('(' + ','.join(quote(v) for v in row) + ')' for row in rows))
+
+
+def is_gzip(filename):
+    with open(filename, 'rb') as file:
+        return file.read(2) == b'\x1f\x8b'
+
+
+def byte_ranges(filename, range_size):
+    """ Splits a plain dump file in [start, stop) ranges of approximately range_size bytes. """
+    size = os.path.getsize(filename)
+    return [(start, min(start + range_size, size)) for start in range(0, size, range_size)]
+
+
+def read_range(filename, start, stop):
+    """ Yields the lines that start in the byte range [start, stop) of a plain file. """
+    with open(filename, 'rb') as file:
+        if start > 0:
+            # Skip the line that started in the previous range, unless start is a line start.
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < stop:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def read_batches(filename, batch_bytes):
+    """ Yields lists of lines of a plain or gzipped file, with approximately batch_bytes each. """
+    opener = gzip.open if is_gzip(filename) else open
+    with opener(filename, 'rb') as file:
+        batch = []
+        size = 0
+        for line in file:
+            batch.append(line)
+            size += len(line)
+            if size >= batch_bytes:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+
+def iter_rows(lines, table):
+    """ Yields the rows inserted into table by a sequence of dump lines. """
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None or parsed[0] != table:
+            continue
+        for row in parsed[1]:
+            yield row
@@ -0,0 +1,67 @@
+from __future__ import print_function
+import unittest
+
+import gzip
+import tempfile
+import os
+
+import sqldump
+
+
+class SqlDumpTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+
+    def test_parse_line(self):
+        line = (b"INSERT INTO `page` VALUES (10,0,'AccessibleComputing','',1,0,0.33,'20190116190543',NULL),"
+                b"(12,0,'Anarchism_(a,b)','it\\'s\\\\',0,-1,1e-05,'x\\ny',NULL);\n")
+        table, rows = sqldump.parse_line(line)
+        self.assertEqual(table, 'page')
+        self.assertEqual(rows, [
+            (10, 0, 'AccessibleComputing', '', 1, 0, 0.33, '20190116190543', None),
+            (12, 0, 'Anarchism_(a,b)', "it's\\", 0, -1, 1e-05, 'x\ny', None),
+        ])
+        self.assertIsNone(sqldump.parse_line(b'/* Header */\n'))
+        self.assertEqual(sqldump.parse_line(u"INSERT INTO `page` VALUES (1,0,'Été');"),
+                         ('page', [(1, 0, u'Été')]))
+
+    def test_format_insert(self):
+        rows = [(1, 0, "a'b\\c", None), (2, 14, u'(é,\n)', 0.5)]
+        self.assertEqual(sqldump.parse_line(sqldump.format_insert('t', rows)), ('t', rows))
+
+    def _write_dump(self, filename, opener):
+        lines = ['/* Header */\n']
+        expected = []
+        for n in range(200):
+            rows = [(n * 10 + k, 0, 'Page_({0},{1})'.format(n, k)) for k in range(n % 7)]
+            expected.extend(rows)
+            if rows:
+                lines.append(sqldump.format_insert('page', rows))
+        lines.append('/* Footer */\n')
+        with opener(filename, 'wb') as file:
+            file.write(''.join(lines).encode('utf-8'))
+        return expected
+
+    def test_byte_ranges(self):
+        filename = os.path.join(self._tmpdir, 'page.sql')
+        expected = self._write_dump(filename, open)
+        for range_size in [1, 97, 1000, 1 << 20]:
+            rows = []
+            for start, stop in sqldump.byte_ranges(filename, range_size):
+                rows.extend(sqldump.iter_rows(sqldump.read_range(filename, start, stop), 'page'))
+            self.assertEqual(rows, expected)
+
+    def test_gzip(self):
+        filename = os.path.join(self._tmpdir, 'page.sql.gz')
+        expected = self._write_dump(filename, gzip.open)
+        self.assertTrue(sqldump.is_gzip(filename))
+        rows = []
+        for batch in sqldump.read_batches(filename, 500):
+            rows.extend(sqldump.iter_rows(batch, 'page'))
+        self.assertEqual(rows, expected)
+        self.assertEqual(list(sqldump.iter_rows(batch, 'pagelinks')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
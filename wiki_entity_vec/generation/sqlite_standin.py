@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+SQLite stand-in for the enwiki MySQL database.
+
+Provides the page, pagelinks and categorylinks tables with the columns and primary keys used by
+the generation scripts, the MySQL CRC32 and MOD functions used to split pages in shards, and a
+connection object that accepts the mysql.connector cursor arguments. Used by tests and
+benchmarks that can't depend on a MySQL server, together with make_dictionary() to build the
+page and category dictionaries of a test.
+"""
+
+from __future__ import print_function
+
+import random
+import sqlite3
+import zlib
+
+from dictionary import Dictionary, load_dictionary
+
+SCHEMA = [
+    """create table page (
+        page_id integer primary key,
+        page_namespace integer not null,
+        page_title text not null,
+        page_restrictions text not null default '',
+        page_is_redirect integer not null default 0)""",
+    "create index page_name_title on page (page_namespace, page_title)",
+    """create table pagelinks (
+        pl_from integer not null,
+        pl_namespace integer not null,
+        pl_title text not null,
+        pl_from_namespace integer not null,
+        primary key (pl_from, pl_namespace, pl_title))""",
+    "create index pl_namespace on pagelinks (pl_namespace, pl_title, pl_from)",
+    """create table categorylinks (
+        cl_from integer not null,
+        cl_to text not null,
+        primary key (cl_from, cl_to))""",
+]
+
+
+def _mysql_crc32(value):
+    # MySQL computes the checksum of the string representation of its argument.
+    return zlib.crc32(str(value).encode('utf-8'))
+
+
+class Connection(object):
+    """ sqlite3 connection with the subset of the mysql.connector API used by the scripts. """
+
+    def __init__(self, filename=':memory:'):
+        self._cnx = sqlite3.connect(filename, check_same_thread=False)
+        self._cnx.create_function('CRC32', 1, _mysql_crc32, deterministic=True)
+        self._cnx.create_function('MOD', 2, lambda a, b: a % b, deterministic=True)
+
+    def cursor(self, buffered=False):
+        return self._cnx.cursor()
+
+    def commit(self):
+        self._cnx.commit()
+
+    def close(self):
+        self._cnx.close()
+
+
+def connect(filename=':memory:'):
+    return Connection(filename)
+
+
+def create_schema(cnx):
+    cursor = cnx.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cnx.commit()
+
+
+def populate(cnx, n_pages, n_links, n_categories, n_categorylinks, redirect_fraction=0.05,
+             other_namespace_fraction=0.05, seed=20190318):
+    """ Fills the tables with a random link graph.
+    Pages are named Page_<id>, categories Category_<n>. A fraction of the pages are redirects and a
+    fraction are in a non-article namespace with a title that duplicates an article title.
+    Returns the titles of the namespace 0 pages.
+    """
+    rng = random.Random(seed)
+    cursor = cnx.cursor()
+    pages = []
+    for page_id in range(1, n_pages + 1):
+        namespace = 0
+        title = 'Page_{0}'.format(page_id)
+        if rng.random() < other_namespace_fraction:
+            namespace = 1
+            title = 'Page_{0}'.format(rng.randint(1, n_pages))
+        is_redirect = 1 if rng.random() < redirect_fraction else 0
+        pages.append((page_id, namespace, title, '', is_redirect))
+    cursor.executemany('insert into page values (?, ?, ?, ?, ?)', pages)
+
+    links = set()
+    for _ in range(n_links):
+        source = rng.randint(1, n_pages)
+        target = rng.randint(1, n_pages + n_pages // 10)
+        namespace = 0 if rng.random() < 0.95 else 14
+        links.add((source, namespace, 'Page_{0}'.format(target), pages[source - 1][1]))
+    cursor.executemany('insert into pagelinks values (?, ?, ?, ?)', sorted(links))
+
+    categorylinks = set()
+    for _ in range(n_categorylinks):
+        categorylinks.add((rng.randint(1, n_pages), 'Category_{0}'.format(rng.randint(1, n_categories))))
+    cursor.executemany('insert into categorylinks values (?, ?)', sorted(categorylinks))
+    cnx.commit()
+    return [title for _, namespace, title, _, _ in pages if namespace == 0]
+
+
+def create_database(filename, *args, **kwargs):
+    """ Creates the schema in a new database and fills it with populate(cnx, *args, **kwargs).
+    Returns the open connection and the titles of the namespace 0 pages.
+    """
+    cnx = connect(filename)
+    create_schema(cnx)
+    return cnx, populate(cnx, *args, **kwargs)
+
+
+def make_dictionary(filename, names, compact=False):
+    """ Writes a dictionary file with one name per line and loads it: as a Dictionary or, with
+    compact, as the CompactDictionary returned by load_dictionary() through its compiled cache.
+    """
+    with open(filename, 'w') as file:
+        for name in names:
+            print(name, file=file)
+    if compact:
+        return load_dictionary(filename, cache=True)
+    dictionary = Dictionary()
+    dictionary.load(filename)
+    return dictionary
@@ -1,78 +1,179 @@
 # -*- coding: utf-8 -*-
 
 """
-Read the full matrix into memory, add zeros and save it.
+Read the rows of an output shard, add zeros and save it.
+
+Zeros are drawn uniformly among the cells of the shard rows that are not set, in bulk, and the
+shard is written sorted by (row, col).
+
+Without --shard_id, all the output shards are generated: the input is read once and each record
+is appended to the spill file of its output shard; zeros are then added to the shards by a
+process pool. The shards are the same as the ones generated one --shard_id at a time.
 """
 
 import argparse
+import multiprocessing
 import os
-import random
-import struct
+import shutil
+import tempfile
 
-from data_generator import Dataset, DataGenerator
+import numpy as np
 
-from scipy.sparse import dok_matrix, save_npz
+from compressed import CODECS, CompressedShardWriter, shard_filename
+from data_generator import Dataset, DataGenerator
+from negative_sampling import decode_keys, encode_keys, sample_negatives
+from record_writer import RECORD_DTYPE, RecordWriter
 
 from tqdm import tqdm
 
+SEED = 20190308
+
+
+def row_block(n_rows, shard_id, num_shards):
+    """ Returns the [start, end) rows of a shard. """
+    block_size = (n_rows - 1) // num_shards + 1
+    block_start = min(shard_id * block_size, n_rows)
+    return block_start, min(block_start + block_size, n_rows)
+
+
+def read_block(gen, block_start, block_end):
+    """ Returns the rows, columns and values of the records of gen in the row block. """
+    rows, cols, values = [], [], []
+    for i in tqdm(range(len(gen))):
+        X, y = gen[i]
+        mask = (X[:, 0] >= block_start) & (X[:, 0] < block_end)
+        rows.append(X[mask, 0])
+        cols.append(X[mask, 1])
+        values.append(y[mask])
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+def inject_zeros(rows, cols, values, block_start, block_end, n_cols, zeros, rng):
+    """ Adds zeros to the records of a row block.
+    Returns the keys (row * n_cols + col) and values of the records, sorted by key. When a cell
+    appears more than once the last value is kept.
+    """
+    keys = encode_keys(rows, cols, n_cols)
+    positive_keys, last = np.unique(keys[::-1], return_index=True)
+    positive_values = np.asarray(values, dtype=np.float32)[::-1][last]
+
+    negative_keys = sample_negatives(rng, zeros, block_start, block_end, n_cols, positive_keys)
+    keys = np.concatenate([positive_keys, negative_keys])
+    values = np.concatenate([positive_values, np.zeros(len(negative_keys), dtype=np.float32)])
+    order = np.argsort(keys, kind='stable')
+    return keys[order], values[order]
+
+
+def write_shard(output, keys, values, n_cols):
+    rows, cols = decode_keys(keys, n_cols)
+    with RecordWriter(output) as writer:
+        writer.write_records(rows, cols, values)
+
+
+def save_shard(keys, values, n_cols, output_dir, shard_id, num_shards, compress=None):
+    if compress:
+        filename = shard_filename(output_dir, shard_id, num_shards)
+        output = CompressedShardWriter(filename, codec=compress)
+    else:
+        filename = os.path.join(output_dir, '{0}.bin.{1:05d}-of-{2:05d}'.format(
+            'data', shard_id, num_shards))
+        output = filename
+    print('Saving {0}...'.format(filename))
+    write_shard(output, keys, values, n_cols)
+    if compress:
+        output.close()
+
+
+def spill_filename(spill_dir, shard_id):
+    return os.path.join(spill_dir, 'spill.{0:05d}'.format(shard_id))
+
+
+def partition(gen, n_rows, num_shards, spill_dir, buffer_size=64*1024):
+    """ Appends each record of gen to the spill file of its output shard, in the order of gen.
+    Memory usage is bounded by the buffer of each shard. Returns the record count of each shard.
+    """
+    block_size = (n_rows - 1) // num_shards + 1
+    writers = [RecordWriter(spill_filename(spill_dir, shard_id), buffer_size=buffer_size)
+               for shard_id in range(num_shards)]
+    for i in tqdm(range(len(gen))):
+        X, y = gen[i]
+        shards = X[:, 0] // block_size
+        order = np.argsort(shards, kind='stable')
+        bounds = np.searchsorted(shards[order], np.arange(num_shards + 1))
+        for shard_id in np.flatnonzero(np.diff(bounds)):
+            index = order[bounds[shard_id]:bounds[shard_id + 1]]
+            writers[shard_id].write_records(X[index, 0], X[index, 1], y[index])
+    return [writer.close() for writer in writers]
+
+
+def inject_shard(spill_dir, shape, shard_id, num_shards, zeros, output_dir, compress=None):
+    """ Adds zeros to the spilled records of a shard and saves it. """
+    block_start, block_end = row_block(shape[0], shard_id, num_shards)
+    records = np.fromfile(spill_filename(spill_dir, shard_id), dtype=RECORD_DTYPE)
+    keys, values = inject_zeros(records['row'], records['col'], records['value'], block_start,
+                                block_end, shape[1], zeros, np.random.RandomState(SEED))
+    save_shard(keys, values, shape[1], output_dir, shard_id, num_shards, compress)
+    return len(keys)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--page_dictionary', required=True)
     parser.add_argument('--category_file', required=True)
     parser.add_argument('--input_dir', required=True)
-    parser.add_argument('--shard_id', type=int, required=True)
+    parser.add_argument('--input_shards', type=int, default=64)
+    parser.add_argument('--shard_id', type=int,
+                        help='Output shard; all the shards are generated when not specified')
     parser.add_argument('--num_shards', type=int, default=64)
     parser.add_argument('--output_dir', required=True)
     parser.add_argument('--factor', type=float, default=1.0)
+    parser.add_argument('--compress', choices=sorted(CODECS.keys()),
+                        help='Write a block compressed data.z shard')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
     args = parser.parse_args()
 
-    random.seed(20190308)
     ds = Dataset()
     ds.load_dictionaries(args.page_dictionary, args.category_file)
     shape = ds.get_shape()
-    matrix = dok_matrix(shape, dtype=float)
 
-    block_size = (shape[0] - 1) / args.num_shards + 1
-    block_start = args.shard_id * block_size
-    block_end = min(block_start + block_size, shape[0])
-    print('Shard {0}, rows: [{1}, {2})'.format(args.shard_id, block_start, block_end))
+    gen = DataGenerator(args.input_dir, args.input_shards, batch_size=1024*1024)
 
-    n_rows = block_end - block_start
+    density = float(gen.size()) / shape[0]
+    print('Row density: {0}'.format(density))
 
-    gen = DataGenerator(args.input_dir, 64, batch_size=16*1024)
+    def shard_zeros(shard_id):
+        block_start, block_end = row_block(shape[0], shard_id, args.num_shards)
+        return int(density * (block_end - block_start) * args.factor)
 
-    density = float(gen.size()) / shape[0]
-    zeros = int(density * n_rows * args.factor)
-    print('Row density: {0}, zeros: {1}'.format(density, zeros))
+    if args.shard_id is None:
+        spill_dir = tempfile.mkdtemp(dir=args.output_dir)
+        try:
+            print('Partitioning matrix data in {0} segments'.format(len(gen)))
+            counts = partition(gen, shape[0], args.num_shards, spill_dir)
+            print('Generating zeros for {0} positives'.format(sum(counts)))
+            pool = multiprocessing.Pool(args.workers)
+            sizes = pool.starmap(inject_shard, [
+                (spill_dir, shape, shard_id, args.num_shards, shard_zeros(shard_id), args.output_dir,
+                 args.compress) for shard_id in range(args.num_shards)])
+            pool.close()
+            pool.join()
+            print('Matrix size: {0}'.format(sum(sizes)))
+        finally:
+            shutil.rmtree(spill_dir)
+        return
+
+    block_start, block_end = row_block(shape[0], args.shard_id, args.num_shards)
+    print('Shard {0}, rows: [{1}, {2})'.format(args.shard_id, block_start, block_end))
+    zeros = shard_zeros(args.shard_id)
 
     print('Reading matrix data in {0} segments'.format(len(gen)))
-    for i in tqdm(xrange(len(gen))):
-        X, y = gen[i]
-        for n in range(X.shape[0]):
-            if X[n, 0] >= block_start and X[n, 0] < block_end:
-                matrix[X[n, 0], X[n, 1]] = y[n]
-
-    print('Generating {0} zeros for {1} positives'.format(zeros, matrix.size))
-    for _ in tqdm(xrange(zeros)):
-        while True:
-            row = block_start + random.randint(0, block_end - block_start - 1)
-            col = random.randint(0, shape[1] - 1)
-            if matrix.has_key((row, col)):
-                continue
-            matrix[row, col] = -1.0
-            break
-
-    matrix = matrix.tocoo()
-    print('Matrix size: {0}'.format(matrix.size))
-
-    filename = '{0}.bin.{1:05d}-of-{2:05d}'.format('data', args.shard_id, args.num_shards)
-    print('Saving {0}...'.format(filename))
-    with open(os.path.join(args.output_dir, filename), 'w') as output:
-        for i in xrange(matrix.size):
-            row = matrix.row[i]
-            col = matrix.col[i]
-            value = 0.0 if matrix.data[i] == -1.0 else matrix.data[i]
-            output.write(struct.pack('IIf', row, col, value))
-    
+    rows, cols, values = read_block(gen, block_start, block_end)
+
+    print('Generating {0} zeros for {1} positives'.format(zeros, len(rows)))
+    keys, values = inject_zeros(rows, cols, values, block_start, block_end, shape[1], zeros,
+                                np.random.RandomState(SEED))
+    print('Matrix size: {0}'.format(len(keys)))
+    save_shard(keys, values, shape[1], args.output_dir, args.shard_id, args.num_shards, args.compress)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
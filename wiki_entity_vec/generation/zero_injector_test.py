@@ -0,0 +1,94 @@
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+from data_generator import DataGenerator
+from negative_sampling import encode_keys
+from record_writer import RECORD_DTYPE
+from wiki_entity_vec.util.synthetic import generate_shards
+from zero_injector import (inject_shard, inject_zeros, partition, read_block, row_block, spill_filename,
+                           write_shard)
+
+
+class ZeroInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+
+    def test_row_block(self):
+        blocks = [row_block(10, shard_id, 4) for shard_id in range(4)]
+        self.assertEqual(blocks, [(0, 3), (3, 6), (6, 9), (9, 10)])
+        self.assertEqual(row_block(2, 3, 4), (2, 2))
+
+    def test_inject_zeros(self):
+        shape = (400, 1000)
+        input_dir = os.path.join(self._tmpdir, 'input')
+        generate_shards(input_dir, shape, 0.01, 8)
+        gen = DataGenerator(input_dir, 8, batch_size=1000)
+        start, end = row_block(shape[0], 1, 3)
+        rows, cols, values = read_block(gen, start, end)
+        self.assertTrue(np.all((rows >= start) & (rows < end)))
+
+        keys, out_values = inject_zeros(rows, cols, values, start, end, shape[1], len(rows),
+                                        np.random.RandomState(20190308))
+        self.assertEqual(len(keys), 2 * len(rows))
+        self.assertTrue(np.all(np.diff(keys.astype(np.int64)) > 0))
+        positives = np.isin(keys, encode_keys(rows, cols, shape[1]))
+        self.assertEqual(positives.sum(), len(rows))
+        np.testing.assert_array_equal(out_values[positives], 1.0)
+        np.testing.assert_array_equal(out_values[~positives], 0.0)
+        self.assertTrue(np.all((keys // shape[1] >= start) & (keys // shape[1] < end)))
+
+        again, _ = inject_zeros(rows, cols, values, start, end, shape[1], len(rows),
+                                np.random.RandomState(20190308))
+        np.testing.assert_array_equal(keys, again)
+
+        filename = os.path.join(self._tmpdir, 'data.bin.00001-of-00003')
+        write_shard(filename, keys, out_values, shape[1])
+        records = np.fromfile(filename, dtype=RECORD_DTYPE)
+        np.testing.assert_array_equal(records['row'].astype(np.uint64) * shape[1] + records['col'], keys)
+        np.testing.assert_array_equal(records['value'], out_values)
+
+    def test_partition(self):
+        shape = (300, 500)
+        input_dir = os.path.join(self._tmpdir, 'input')
+        generate_shards(input_dir, shape, 0.02, 4, values='binary')
+        spill_dir = os.path.join(self._tmpdir, 'spill')
+        os.makedirs(spill_dir)
+        gen = DataGenerator(input_dir, 4, batch_size=700, instrument=True)
+        counts = partition(gen, shape[0], 7, spill_dir, buffer_size=100)
+        self.assertEqual(sum(counts), gen.size())
+        self.assertEqual(gen.stats()['bytes_read'], gen.size() * RECORD_DTYPE.itemsize)
+
+        output_dir = os.path.join(self._tmpdir, 'output')
+        os.makedirs(output_dir)
+        for shard_id in range(7):
+            start, end = row_block(shape[0], shard_id, 7)
+            rows, cols, values = read_block(gen, start, end)
+            self.assertEqual(len(rows), counts[shard_id])
+            records = np.fromfile(spill_filename(spill_dir, shard_id), dtype=RECORD_DTYPE)
+            np.testing.assert_array_equal(records['row'], rows)
+            np.testing.assert_array_equal(records['col'], cols)
+            np.testing.assert_array_equal(records['value'], values)
+
+            keys, out_values = inject_zeros(rows, cols, values, start, end, shape[1], 50,
+                                            np.random.RandomState(20190308))
+            self.assertEqual(inject_shard(spill_dir, shape, shard_id, 7, 50, output_dir), len(keys))
+            output = np.fromfile(os.path.join(output_dir, 'data.bin.{0:05d}-of-00007'.format(shard_id)),
+                                 dtype=RECORD_DTYPE)
+            np.testing.assert_array_equal(output['row'].astype(np.uint64) * shape[1] + output['col'], keys)
+            np.testing.assert_array_equal(output['value'], out_values)
+
+    def test_duplicates(self):
+        keys, values = inject_zeros(np.array([2, 2, 3]), np.array([1, 1, 0]), np.array([1.0, 0.5, 1.0]),
+                                    2, 4, 3, 2, np.random.RandomState(0))
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(values[list(keys).index(7)], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,9 +8,11 @@ if __name__ == '__main__':
     curdir = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.dirname(curdir))
 
+from wiki_entity_vec.embedding import export
 from wiki_entity_vec.model.model import make_model
 from wiki_entity_vec.util import data_generator
 
+import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import backend as K # pylint: disable=import-error
 
@@ -43,6 +45,23 @@ class WeightsSaver(keras.callbacks.Callback):
     def on_epoch_end(self, epoch, logs=None):
         save_weights(self._output_dir, self._model)
 
+class DataGeneratorStats(keras.callbacks.Callback):
+    """ Writes the DataGenerator I/O counters of each epoch to TensorBoard.
+    """
+    def __init__(self, logs_dir, generator):
+        self._writer = tf.summary.create_file_writer(os.path.join(logs_dir, 'data_generator'))
+        self._generator = generator
+
+    def on_epoch_end(self, epoch, logs=None):
+        stats = self._generator.stats()
+        if stats is None:
+            return
+        with self._writer.as_default():
+            for name, value in stats.items():
+                tf.summary.scalar('data_generator/' + name, value, step=epoch)
+        self._writer.flush()
+        self._generator.reset_stats()
+
 def history_plot(dir, hist):
     plt.figure()
     plt.plot(hist.history['loss'])
@@ -52,14 +71,9 @@ def history_plot(dir, hist):
     plt.plot()
     plt.savefig(os.path.join(dir, 'history.svg'), format='svg')
 
-def save_result(output_dir: str, x : np.array, embedding_size: int):
-    os.makedirs(output_dir, exist_ok=True)
-    with open(os.path.join(output_dir, 'vectors.tsv'), 'w') as file:
-        for i in range(int(x.shape[0] / embedding_size)):
-            begin = i * embedding_size
-            end = begin + embedding_size
-            file.write('\t'.join([str(v) for v in x[begin:end]]))
-            file.write('\n')
+def save_result(output_dir: str, x : np.array, shape, embedding_size: int, page_dict=None):
+    rows, cols = export.split_weights(x, shape, embedding_size)
+    export.export(output_dir, rows, cols, page_dict=page_dict, tsv=True)
 
 
 def main():
@@ -75,6 +89,10 @@ def main():
         '--output_dir', help='Directory for trained weights and checkpoints')
     parser.add_argument('--load_weights', default=True)
     parser.add_argument('--logs_dir', help='TensorBoard logs directory')
+    parser.add_argument('--io_stats', action='store_true',
+                        help='Write DataGenerator I/O counters to the TensorBoard logs')
+    parser.add_argument('--negative_ratio', type=float, default=0.0,
+                        help='Zeros sampled per matrix entry, for a matrix without zero_injector zeros')
     parser.add_argument('matrix_dir', help='Data matrix directory')
     args = parser.parse_args()
 
@@ -82,7 +100,9 @@ def main():
     dataset.load_dictionaries(args.page_dictionary, args.category_file)
 
     generator = data_generator.DataGenerator(
-        args.matrix_dir, args.data_shards, batch_size=args.batch_size, chunk_size=args.batch_size)
+        args.matrix_dir, args.data_shards, batch_size=args.batch_size, chunk_size=args.batch_size,
+        coord_dtype=np.int32, value_dtype=np.float32, instrument=bool(args.logs_dir and args.io_stats),
+        negative_ratio=args.negative_ratio, num_cols=dataset.get_shape()[1])
     model = make_model(dataset.get_shape(), args.embedding_size)
     if args.output_dir and args.load_weights:
         load_weights(args.output_dir, model)
@@ -93,6 +113,8 @@ def main():
     if args.logs_dir:
         tbCallback = keras.callbacks.TensorBoard(log_dir=args.logs_dir, write_grads=True, write_graph=True)
         callbacks.append(tbCallback)
+        if args.io_stats:
+            callbacks.append(DataGeneratorStats(args.logs_dir, generator))
 
     opt = scipy_optimizer.ScipyOptimizer(model)
     result, history = opt.fit_generator(
@@ -101,7 +123,8 @@ def main():
     print('Optmizer: ', result['message'])
     history_plot(args.output_dir, history)
     save_weights(args.output_dir, model)
-    save_result(args.output_dir, result['x'][:dataset.get_shape()[0]*args.embedding_size], args.embedding_size)
+    save_result(args.output_dir, result['x'], dataset.get_shape(), args.embedding_size,
+                page_dict=dataset.get_page_dictionary())
 
 
 if __name__ == '__main__':
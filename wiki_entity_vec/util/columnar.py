@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar matrix format.
+
+A dataset directory contains a manifest.json file and, for each shard, one file per column:
+row.NNNNN-of-NNNNN, col.NNNNN-of-NNNNN and value.NNNNN-of-NNNNN. Columns are headerless little
+endian arrays. The value column is omitted when all the values of a shard are 1.0.
+
+The manifest records the matrix shape, the column dtypes and, for each shard, the record count,
+the column files and their crc32 checksums. Opening a dataset only requires reading the manifest.
+
+Convert data.bin shards with:
+  python -m wiki_entity_vec.util.columnar --input_dir=<dir> --num_shards=64 --output_dir=<dir>
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import zlib
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+FORMAT_NAME = 'columnar'
+VERSION = 1
+
+DTYPES = {
+    'row': np.dtype('<u4'),
+    'col': np.dtype('<u4'),
+    'value': np.dtype('<f4'),
+}
+FIELDS = ('row', 'col', 'value')
+
+
+class Columns(object):
+    """ Records stored as separate row, col and value arrays.
+    Supports the subset of the structured array interface used by DataGenerator: len(), field
+    access by name and slicing or fancy indexing of all the columns.
+    """
+
+    def __init__(self, row, col, value):
+        self._columns = {'row': row, 'col': col, 'value': value}
+
+    def __len__(self):
+        return len(self._columns['row'])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._columns[key]
+        return Columns(*[self._columns[name][key] for name in FIELDS])
+
+
+def has_manifest(data_dir):
+    return os.path.exists(os.path.join(data_dir, MANIFEST))
+
+
+def load_manifest(data_dir):
+    with open(os.path.join(data_dir, MANIFEST), 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('format') != FORMAT_NAME or manifest.get('version') != VERSION:
+        raise ValueError('{0}: unsupported manifest'.format(data_dir))
+    return manifest
+
+
+def write_manifest(data_dir, shape, shards):
+    """ Writes the manifest for the shard entries returned by ShardWriter.close().
+    The manifest is written last, with a rename, so that a partial dataset is never visible.
+    """
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': VERSION,
+        'shape': list(shape) if shape is not None else None,
+        'num_shards': len(shards),
+        'dtypes': {name: DTYPES[name].str for name in FIELDS},
+        'shards': shards,
+    }
+    tmpname = os.path.join(data_dir, MANIFEST + '.tmp')
+    with open(tmpname, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.rename(tmpname, os.path.join(data_dir, MANIFEST))
+    return manifest
+
+
+def shard_filename(field, shard_id, num_shards):
+    return '{0}.{1:05d}-of-{2:05d}'.format(field, shard_id, num_shards)
+
+
+def _map_column(filename, dtype, count):
+    if count == 0:
+        # mmap does not support empty files.
+        return np.empty((0,), dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(count,))
+
+
+def open_shard(data_dir, entry):
+    """ Maps the columns of a shard manifest entry. """
+    count = entry['count']
+    columns = [_map_column(os.path.join(data_dir, entry['files'][name]), DTYPES[name], count)
+               for name in ('row', 'col')]
+    if entry['files'].get('value') is None:
+        # All values are 1.0: nothing to read.
+        columns.append(np.broadcast_to(np.float32(1.0), (count,)))
+    else:
+        columns.append(_map_column(os.path.join(data_dir, entry['files']['value']), DTYPES['value'], count))
+    return Columns(*columns)
+
+
+def record_bytes(entry):
+    """ Bytes read per record of a shard manifest entry: the value column may not be stored. """
+    return sum(DTYPES[name].itemsize for name in FIELDS if entry['files'].get(name) is not None)
+
+
+def _file_crc32(filename, block_size=16*1024*1024):
+    crc = 0
+    with open(filename, 'rb') as file:
+        while True:
+            buf = file.read(block_size)
+            if not buf:
+                break
+            crc = zlib.crc32(buf, crc)
+    return crc
+
+
+def verify(data_dir):
+    """ Checks the record count and checksum of every column file against the manifest.
+    Returns the list of files that do not match.
+    """
+    manifest = load_manifest(data_dir)
+    errors = []
+    for entry in manifest['shards']:
+        for name, filename in entry['files'].items():
+            if filename is None:
+                continue
+            path = os.path.join(data_dir, filename)
+            if os.path.getsize(path) != entry['count'] * DTYPES[name].itemsize or \
+                    _file_crc32(path) != entry['crc32'][name]:
+                errors.append(filename)
+    return errors
+
+
+class ShardWriter(object):
+    """ Appends records to the column files of a shard.
+    """
+
+    def __init__(self, data_dir, shard_id, num_shards):
+        self._data_dir = data_dir
+        self._names = {name: shard_filename(name, shard_id, num_shards) for name in FIELDS}
+        self._files = {name: open(os.path.join(data_dir, self._names[name]), 'wb') for name in FIELDS}
+        self._crc = {name: 0 for name in FIELDS}
+        self._count = 0
+        self._all_ones = True
+
+    def write(self, rows, cols, values):
+        for name, column in zip(FIELDS, (rows, cols, values)):
+            buf = np.ascontiguousarray(column, dtype=DTYPES[name]).tobytes()
+            self._files[name].write(buf)
+            self._crc[name] = zlib.crc32(buf, self._crc[name])
+        self._count += len(rows)
+        if self._all_ones:
+            self._all_ones = bool(np.all(np.asarray(values) == 1.0))
+
+    def close(self):
+        """ Closes the column files and returns the manifest entry of the shard. """
+        for file in self._files.values():
+            file.close()
+        files = dict(self._names)
+        crc = dict(self._crc)
+        if self._all_ones:
+            os.remove(os.path.join(self._data_dir, files['value']))
+            files['value'] = None
+            del crc['value']
+        return {'count': self._count, 'files': files, 'crc32': crc}
+
+
+def convert(input_dir, num_shards, output_dir, shape=None, block_size=1024*1024):
+    """ Converts data.bin shards into a columnar dataset. Returns the manifest.
+    """
+    from .data_generator import DataGenerator
+
+    os.makedirs(output_dir, exist_ok=True)
+    entries = []
+    for shard_id in range(num_shards):
+        filename = os.path.join(input_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, num_shards))
+        count = os.path.getsize(filename) // DataGenerator.RECORD_DTYPE.itemsize
+        records = DataGenerator._map_shard(filename, count)
+        writer = ShardWriter(output_dir, shard_id, num_shards)
+        for start in range(0, count, block_size):
+            block = records[start:start + block_size]
+            writer.write(block['row'], block['col'], block['value'])
+        entries.append(writer.close())
+    return write_manifest(output_dir, shape, entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert data.bin shards to the columnar format')
+    parser.add_argument('--input_dir', required=True)
+    parser.add_argument('--num_shards', type=int, default=64)
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--page_dictionary')
+    parser.add_argument('--category_file')
+    parser.add_argument('--verify', action='store_true')
+    args = parser.parse_args()
+
+    shape = None
+    if args.page_dictionary and args.category_file:
+        from .data_generator import Dataset
+        ds = Dataset()
+        ds.load_dictionaries(args.page_dictionary, args.category_file)
+        shape = ds.get_shape()
+
+    manifest = convert(args.input_dir, args.num_shards, args.output_dir, shape=shape)
+    print('Converted {0} records'.format(sum(entry['count'] for entry in manifest['shards'])))
+    if args.verify:
+        errors = verify(args.output_dir)
+        if errors:
+            raise SystemExit('checksum mismatch: {0}'.format(', '.join(errors)))
+
+
+if __name__ == '__main__':
+    main()
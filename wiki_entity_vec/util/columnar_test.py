@@ -0,0 +1,84 @@
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+import columnar
+from data_generator import DataGenerator
+
+
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._input_dir = os.path.join(self._tmpdir, 'bin')
+        self._output_dir = os.path.join(self._tmpdir, 'columnar')
+        os.makedirs(self._input_dir)
+
+    def _generate_testdata(self, shape, datapoints, n_shards, values=None):
+        rng = np.random.RandomState(20190318)
+        keys = np.unique(rng.randint(0, shape[0] * shape[1], size=datapoints))
+        records = np.empty((len(keys),), dtype=DataGenerator.RECORD_DTYPE)
+        records['row'] = keys // shape[1]
+        records['col'] = keys % shape[1]
+        records['value'] = 1.0 if values is None else values(rng, len(keys))
+        block_size = int((shape[0] - 1) / n_shards) + 1
+        for shard_id in range(n_shards):
+            filename = os.path.join(
+                self._input_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, n_shards))
+            mask = records['row'] // block_size == shard_id
+            records[mask].tofile(filename)
+
+    @staticmethod
+    def _collect_data(gen):
+        batches = [gen[batch] for batch in range(len(gen))]
+        return np.vstack([X for X, _ in batches]), np.hstack([y for _, y in batches])
+
+    def test_convert(self):
+        self._generate_testdata((100, 300), 2000, 4)
+        manifest = columnar.convert(self._input_dir, 4, self._output_dir, shape=(100, 300))
+        self.assertEqual(manifest['shape'], [100, 300])
+        self.assertEqual(columnar.verify(self._output_dir), [])
+        # all values are 1.0: the value column is not stored.
+        for entry in manifest['shards']:
+            self.assertIsNone(entry['files']['value'])
+        self.assertFalse(any(name.startswith('value.') for name in os.listdir(self._output_dir)))
+
+        for options in [dict(), dict(shard_merge=True), dict(shard_merge=True, shuffle=True),
+                        dict(shuffle=True, stateless=True), dict(prefetch=2)]:
+            raw = DataGenerator(self._input_dir, 4, batch_size=64, chunk_size=100, seed=1, **options)
+            gen = DataGenerator(self._output_dir, None, batch_size=64, chunk_size=100, seed=1, **options)
+            self.assertEqual(len(raw), len(gen))
+            X, y = ColumnarTest._collect_data(raw)
+            X_c, y_c = ColumnarTest._collect_data(gen)
+            np.testing.assert_array_equal(X, X_c)
+            np.testing.assert_array_equal(y, y_c)
+            gen.close()
+            raw.close()
+
+    def test_values(self):
+        self._generate_testdata((100, 300), 2000, 4, values=lambda rng, n: rng.randint(0, 2, size=n))
+        manifest = columnar.convert(self._input_dir, 4, self._output_dir)
+        self.assertIsNone(manifest['shape'])
+        for entry in manifest['shards']:
+            self.assertIsNotNone(entry['files']['value'])
+        raw = DataGenerator(self._input_dir, 4, batch_size=64)
+        gen = DataGenerator(self._output_dir, 4, batch_size=64)
+        np.testing.assert_array_equal(ColumnarTest._collect_data(raw)[1], ColumnarTest._collect_data(gen)[1])
+        with self.assertRaises(ValueError):
+            DataGenerator(self._output_dir, 8)
+
+    def test_verify(self):
+        self._generate_testdata((100, 300), 2000, 2)
+        columnar.convert(self._input_dir, 2, self._output_dir)
+        filename = os.path.join(self._output_dir, columnar.shard_filename('col', 1, 2))
+        with open(filename, 'r+b') as file:
+            file.write(b'\xff')
+        self.assertEqual(columnar.verify(self._output_dir), [columnar.shard_filename('col', 1, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+Block compressed matrix shards.
+
+A data.z.NNNNN-of-NNNNN shard holds the same records as data.bin.NNNNN-of-NNNNN, split in blocks
+of block_size records. Each block is compressed independently so that any record range can be
+read by decompressing only the blocks that contain it.
+
+Block payload, before compression:
+  flag byte: 0 when all values are 1.0, 1 otherwise
+  varints: zigzag(row[i] - row[i-1]) for the records in the block (row[-1] = 0)
+  varints: zigzag(col[i] - col[i-1]) (col[-1] = 0)
+  float32 values, when flag is 1
+
+The blocks are followed by the block index, one (first_record, offset, length) little endian
+uint64 triplet per block, and a fixed size footer (see FOOTER).
+"""
+
+from __future__ import print_function
+
+import collections
+import lzma
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+# Same layout as the DataGenerator.FORMAT records.
+RECORD_DTYPE = np.dtype([('row', np.uint32), ('col', np.uint32), ('value', np.float32)])
+
+MAGIC = b'WEVZ'
+VERSION = 1
+# magic, version, codec, number of blocks, number of records, index offset
+FOOTER = '<4sHHQQQ'
+INDEX_DTYPE = np.dtype([('first', '<u8'), ('offset', '<u8'), ('length', '<u8')])
+
+CODECS = {
+    'zlib': (0, lambda buf, level: zlib.compress(buf, level), zlib.decompress),
+    'lzma': (1, lambda buf, level: lzma.compress(buf, preset=level), lzma.decompress),
+}
+_DECOMPRESS = {codec_id: decompress for codec_id, _, decompress in CODECS.values()}
+
+
+def shard_filename(data_dir, shard_id, num_shards):
+    return os.path.join(data_dir, 'data.z.{0:05d}-of-{1:05d}'.format(shard_id, num_shards))
+
+
+def _zigzag_encode(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _zigzag_decode(values):
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def varint_encode(values):
+    """ LEB128 encoding of an array of unsigned integers. """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(values.shape, dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty((int(lengths.sum()),), dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(values) else 0):
+        mask = lengths > k
+        septet = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = np.where(lengths[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[mask] + k] = septet | more
+    return out
+
+
+def varint_decode(buf, count):
+    """ Decodes count varints from the start of a uint8 array.
+    Returns the values and the number of bytes consumed.
+    """
+    if count == 0:
+        return np.empty((0,), dtype=np.uint64), 0
+    ends = np.flatnonzero(buf < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError('truncated varint stream')
+    consumed = int(ends[-1]) + 1
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = (buf[starts] & 0x7f).astype(np.uint64)
+    for k in range(1, int(lengths.max())):
+        longer = np.flatnonzero(lengths > k)
+        septets = (buf[starts[longer] + k] & 0x7f).astype(np.uint64)
+        values[longer] |= septets << np.uint64(7 * k)
+    return values, consumed
+
+
+def encode_block(records):
+    rows = records['row'].astype(np.int64)
+    cols = records['col'].astype(np.int64)
+    all_ones = bool(np.all(records['value'] == 1.0))
+    parts = [
+        b'\x00' if all_ones else b'\x01',
+        varint_encode(_zigzag_encode(np.diff(rows, prepend=0))).tobytes(),
+        varint_encode(_zigzag_encode(np.diff(cols, prepend=0))).tobytes(),
+    ]
+    if not all_ones:
+        parts.append(np.ascontiguousarray(records['value'], dtype='<f4').tobytes())
+    return b''.join(parts)
+
+
+def decode_block(payload, count):
+    buf = np.frombuffer(payload, dtype=np.uint8)
+    deltas, consumed = varint_decode(buf[1:], 2 * count)
+    coords = np.cumsum(_zigzag_decode(deltas).reshape(2, count), axis=1)
+    records = np.empty((count,), dtype=RECORD_DTYPE)
+    records['row'] = coords[0]
+    records['col'] = coords[1]
+    if buf[0] == 0:
+        records['value'] = 1.0
+    else:
+        records['value'] = np.frombuffer(payload, dtype='<f4', count=count, offset=1 + consumed)
+    return records
+
+
+class CompressedShardWriter(object):
+    """ Writes a block compressed shard.
+
+    write() accepts the packed 'IIf' byte stream that would otherwise be written to a data.bin
+    file, so the writer can replace the output file of the generation scripts; write_records()
+    accepts a RECORD_DTYPE array.
+    """
+
+    def __init__(self, filename, codec='zlib', level=6, block_size=64*1024):
+        self._codec_id, self._compress, _ = CODECS[codec]
+        self._level = level
+        self._block_size = block_size
+        self._file = open(filename, 'wb')
+        self._pending = bytearray()
+        self._index = []
+        self._count = 0
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, buf):
+        self._pending += buf
+        block_bytes = self._block_size * RECORD_DTYPE.itemsize
+        if len(self._pending) >= block_bytes:
+            n_blocks = len(self._pending) // block_bytes
+            records = np.frombuffer(bytes(self._pending[:n_blocks * block_bytes]), dtype=RECORD_DTYPE)
+            del self._pending[:n_blocks * block_bytes]
+            for start in range(0, len(records), self._block_size):
+                self._write_block(records[start:start + self._block_size])
+
+    def write_records(self, records):
+        self.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+
+    def _write_block(self, records):
+        payload = self._compress(encode_block(records), self._level)
+        self._file.write(payload)
+        self._index.append((self._count, self._offset, len(payload)))
+        self._count += len(records)
+        self._offset += len(payload)
+
+    def close(self):
+        if self._file is None:
+            return
+        usable = len(self._pending) - len(self._pending) % RECORD_DTYPE.itemsize
+        if usable:
+            self._write_block(np.frombuffer(bytes(self._pending[:usable]), dtype=RECORD_DTYPE))
+        self._pending = bytearray()
+        self._file.write(np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+        self._file.write(struct.pack(FOOTER, MAGIC, VERSION, self._codec_id,
+                                     len(self._index), self._count, self._offset))
+        self._file.close()
+        self._file = None
+
+
+class CompressedShard(object):
+    """ Random access reader of a block compressed shard.
+
+    Behaves as a read-only RECORD_DTYPE array for len(), slicing and integer array indexing. Reads
+    use pread on a shared descriptor and the most recently decoded blocks are cached, so that
+    sequential chunk reads decode each block once.
+    on_read: optional function called with the size of every compressed block read from the file.
+    """
+
+    CACHE_BLOCKS = 2
+
+    def __init__(self, filename, on_read=None):
+        self._on_read = on_read
+        self._fd = os.open(filename, os.O_RDONLY)
+        size = os.fstat(self._fd).st_size
+        footer_size = struct.calcsize(FOOTER)
+        magic, version, codec_id, n_blocks, count, index_offset = struct.unpack(
+            FOOTER, os.pread(self._fd, footer_size, size - footer_size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{0}: not a compressed shard'.format(filename))
+        self._decompress = _DECOMPRESS[codec_id]
+        self._count = count
+        index = np.frombuffer(os.pread(self._fd, n_blocks * INDEX_DTYPE.itemsize, index_offset),
+                              dtype=INDEX_DTYPE)
+        self._offsets = index['offset'].astype(np.int64)
+        self._lengths = index['length'].astype(np.int64)
+        self._firsts = np.append(index['first'].astype(np.int64), count)
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __del__(self):
+        fd = getattr(self, '_fd', None)
+        if fd is not None:
+            os.close(fd)
+            self._fd = None
+
+    def __len__(self):
+        return self._count
+
+    def compressed_size(self):
+        return int(self._lengths.sum())
+
+    def _block(self, block_id):
+        with self._lock:
+            records = self._cache.get(block_id)
+            if records is not None:
+                self._cache.move_to_end(block_id)
+                return records
+        payload = self._decompress(os.pread(self._fd, int(self._lengths[block_id]), int(self._offsets[block_id])))
+        if self._on_read is not None:
+            self._on_read(int(self._lengths[block_id]))
+        records = decode_block(payload, int(self._firsts[block_id + 1] - self._firsts[block_id]))
+        with self._lock:
+            self._cache[block_id] = records
+            while len(self._cache) > self.CACHE_BLOCKS:
+                self._cache.popitem(last=False)
+        return records
+
+    def _read_range(self, start, stop):
+        if start >= stop:
+            return np.empty((0,), dtype=RECORD_DTYPE)
+        first = int(np.searchsorted(self._firsts, start, side='right')) - 1
+        last = int(np.searchsorted(self._firsts, stop, side='left'))
+        pieces = [self._block(block_id) for block_id in range(first, last)]
+        data = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+        offset = int(self._firsts[first])
+        return data[start - offset:stop - offset]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._count)
+            if step != 1:
+                raise IndexError('only contiguous slices are supported')
+            return self._read_range(start, stop)
+        positions = np.asarray(key, dtype=np.int64)
+        data = np.empty(positions.shape, dtype=RECORD_DTYPE)
+        blocks = np.searchsorted(self._firsts, positions, side='right') - 1
+        for block_id in np.unique(blocks):
+            mask = blocks == block_id
+            data[mask] = self._block(block_id)[positions[mask] - self._firsts[block_id]]
+        return data
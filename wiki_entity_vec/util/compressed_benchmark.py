@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the read throughput of raw data.bin shards and block compressed shards.
+
+Throughput is reported in MB/s of decoded records (12 bytes per record), for sequential chunk
+reads of the whole shard. Files are read through the page cache; the compressed file sizes show
+how much less data a cold read has to fetch from disk.
+
+Usage: python compressed_benchmark.py [--records=N] [--chunk_size=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from compressed import CompressedShard, CompressedShardWriter, RECORD_DTYPE
+
+
+def generate_records(n_records, n_rows, n_cols, seed=20190318):
+    """ Rows sorted in ascending order with ascending columns within each row. """
+    rng = np.random.RandomState(seed)
+    records = np.empty((n_records,), dtype=RECORD_DTYPE)
+    records['row'] = np.sort(rng.randint(0, n_rows, size=n_records))
+    records['col'] = rng.randint(0, n_cols, size=n_records)
+    records.sort(order=['row', 'col'])
+    records['value'] = 1.0
+    return records
+
+
+def read_throughput(shard, chunk_size, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for offset in range(0, len(shard), chunk_size):
+            np.array(shard[offset:offset + chunk_size])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(shard) * RECORD_DTYPE.itemsize / best / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compressed shard benchmark')
+    parser.add_argument('--records', type=int, default=4*1024*1024)
+    parser.add_argument('--rows', type=int, default=200*1000)
+    parser.add_argument('--cols', type=int, default=2*1000*1000)
+    parser.add_argument('--chunk_size', type=int, default=16*1024)
+    parser.add_argument('--block_size', type=int, default=64*1024)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        records = generate_records(args.records, args.rows, args.cols)
+        raw_file = os.path.join(tmpdir, 'data.bin')
+        records.tofile(raw_file)
+        results = [('raw', os.path.getsize(raw_file), 0.0,
+                    read_throughput(np.memmap(raw_file, dtype=RECORD_DTYPE, mode='r'), args.chunk_size))]
+
+        for codec in ['zlib', 'lzma']:
+            filename = os.path.join(tmpdir, 'data.' + codec)
+            start = time.time()
+            with CompressedShardWriter(filename, codec=codec, block_size=args.block_size) as writer:
+                writer.write_records(records)
+            write_rate = records.nbytes / (time.time() - start) / 1e6
+            results.append((codec, os.path.getsize(filename), write_rate,
+                            read_throughput(CompressedShard(filename), args.chunk_size)))
+
+        print('{0:>6} {1:>12} {2:>8} {3:>12} {4:>12}'.format(
+            'format', 'bytes', 'ratio', 'write MB/s', 'read MB/s'))
+        for name, size, write_rate, read_rate in results:
+            print('{0:>6} {1:>12} {2:>8.2f} {3:>12.1f} {4:>12.1f}'.format(
+                name, size, records.nbytes / float(size), write_rate, read_rate))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+from compressed import CompressedShard, CompressedShardWriter, RECORD_DTYPE, \
+    shard_filename, varint_decode, varint_encode
+from data_generator import DataGenerator
+
+
+class CompressedTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._rng = np.random.RandomState(20190318)
+
+    def _generate_records(self, shape, datapoints, values=False):
+        keys = np.unique(self._rng.randint(0, shape[0] * shape[1], size=datapoints))
+        records = np.empty((len(keys),), dtype=RECORD_DTYPE)
+        records['row'] = keys // shape[1]
+        records['col'] = keys % shape[1]
+        records['value'] = self._rng.rand(len(keys)) if values else 1.0
+        return records
+
+    def test_varint(self):
+        values = np.concatenate([np.arange(300, dtype=np.uint64),
+                                 self._rng.randint(0, 2**32, size=1000, dtype=np.uint64),
+                                 np.array([2**32 - 1, 2**63, 2**64 - 1], dtype=np.uint64)])
+        self.assertEqual(values.dtype, np.uint64)
+        self.assertEqual(int(values[-1]), 2**64 - 1)
+        buf = varint_encode(values)
+        decoded, consumed = varint_decode(np.append(buf, [1, 2, 3]).astype(np.uint8), len(values))
+        self.assertEqual(consumed, len(buf))
+        self.assertEqual(decoded.tolist(), values.tolist())
+
+    def test_random_access(self):
+        for codec, values in [('zlib', False), ('lzma', True)]:
+            records = self._generate_records((1000, 1000), 10000, values=values)
+            filename = os.path.join(self._tmpdir, 'shard.' + codec)
+            with CompressedShardWriter(filename, codec=codec, block_size=1000) as writer:
+                # write the packed byte stream in pieces that do not align with records.
+                buf = records.tobytes()
+                for start in range(0, len(buf), 4999):
+                    writer.write(buf[start:start + 4999])
+            shard = CompressedShard(filename)
+            self.assertEqual(len(shard), len(records))
+            self.assertLess(shard.compressed_size(), records.nbytes / 2)
+            np.testing.assert_array_equal(shard[:], records)
+            np.testing.assert_array_equal(shard[2500:7321], records[2500:7321])
+            positions = self._rng.randint(0, len(records), size=500)
+            np.testing.assert_array_equal(shard[positions], records[positions])
+
+    def test_generator(self):
+        records = self._generate_records((400, 1000), 20000)
+        n_shards = 4
+        raw_dir = os.path.join(self._tmpdir, 'raw')
+        z_dir = os.path.join(self._tmpdir, 'z')
+        os.makedirs(raw_dir)
+        os.makedirs(z_dir)
+        for shard_id in range(n_shards):
+            shard = records[records['row'] % n_shards == shard_id]
+            shard.tofile(os.path.join(raw_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, n_shards)))
+            with CompressedShardWriter(shard_filename(z_dir, shard_id, n_shards), block_size=512) as writer:
+                writer.write_records(shard)
+
+        for options in [dict(), dict(shard_merge=True, shuffle=True), dict(shuffle=True, stateless=True),
+                        dict(shard_merge=True, prefetch=2)]:
+            raw = DataGenerator(raw_dir, n_shards, batch_size=100, chunk_size=300, seed=1, **options)
+            gen = DataGenerator(z_dir, n_shards, batch_size=100, chunk_size=300, seed=1, **options)
+            self.assertEqual(gen.size(), len(records))
+            for batch in range(len(raw)):
+                X, y = raw[batch]
+                X_z, y_z = gen[batch]
+                np.testing.assert_array_equal(X, X_z)
+                np.testing.assert_array_equal(y, y_z)
+            gen.close()
+            raw.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
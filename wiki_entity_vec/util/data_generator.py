@@ -5,15 +5,22 @@
 
 from __future__ import generators, print_function
 
-import copy
+import collections
 import functools
 import os
 import struct
+import threading
+import time
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 from tensorflow import keras
 
-from .dictionary import Dictionary
+from . import columnar
+from . import compressed
+from . import negative_sampling
+from .dictionary import Dictionary, load_dictionary
 
 
 class Dataset(object):
@@ -21,9 +28,13 @@ class Dataset(object):
         self._page_dictionary = Dictionary()
         self._category_dict = Dictionary()
 
-    def load_dictionaries(self, page_dict, category_dict):
-        self._page_dictionary.load(page_dict)
-        self._category_dict.load(category_dict)
+    def load_dictionaries(self, page_dict, category_dict, cache=False):
+        """ Loads the text dictionaries, through their compiled .dict files when cache is set. """
+        self._page_dictionary = load_dictionary(page_dict, cache=cache)
+        self._category_dict = load_dictionary(category_dict, cache=cache)
+
+    def get_page_dictionary(self):
+        return self._page_dictionary
 
     def get_shape(self):
         rows = self._page_dictionary.size()
@@ -31,44 +42,312 @@ class Dataset(object):
         return (rows, cols)
 
 
+class ChunkIndex(object):
+    """
+    Cumulative offset index of the chunks of a sharded matrix.
+
+    Chunks are numbered as DataGenerator serves them. Without shard_merge each shard is split into
+    chunk_size pieces, one shard after the other (an empty shard still counts as one, empty, chunk).
+    With shard_merge, chunk i is the concatenation of the i-th chunk_size slice of every shard.
+
+    Records are addressed by their position in the stream formed by the chunks in order. The index
+    is a list of pieces (shard, offset, length) sorted by stream position, so that a record range
+    maps to a read plan with a binary search.
+    """
+
+    def __init__(self, counts, chunk_size, shard_merge=False):
+        counts = np.asarray(counts, dtype=np.int64)
+        if shard_merge:
+            n_chunks = int((counts.max() - 1) // chunk_size) + 1 if counts.size and counts.max() else 0
+            offsets = np.arange(n_chunks, dtype=np.int64)[:, np.newaxis] * chunk_size
+            lengths = np.clip(counts[np.newaxis, :] - offsets, 0, chunk_size)
+            chunk_ids, shards = np.nonzero(lengths)
+            piece_offsets = offsets[chunk_ids, 0]
+            piece_lengths = lengths[chunk_ids, shards]
+        else:
+            shard_chunks = np.maximum((counts + chunk_size - 1) // chunk_size, 1)
+            n_chunks = int(shard_chunks.sum())
+            first_chunk = np.cumsum(shard_chunks) - shard_chunks
+            all_shards = np.repeat(np.arange(counts.size), shard_chunks)
+            all_offsets = (np.arange(n_chunks) - first_chunk[all_shards]) * chunk_size
+            all_lengths = np.clip(counts[all_shards] - all_offsets, 0, chunk_size)
+            chunk_ids = np.flatnonzero(all_lengths)
+            shards = all_shards[chunk_ids]
+            piece_offsets = all_offsets[chunk_ids]
+            piece_lengths = all_lengths[chunk_ids]
+
+        self._n_chunks = n_chunks
+        self._shards = shards.astype(np.int64)
+        self._offsets = piece_offsets.astype(np.int64)
+        self._lengths = piece_lengths.astype(np.int64)
+        # Stream position of each piece; the trailing element is the total number of records.
+        self._starts = np.concatenate(([0], np.cumsum(self._lengths)))
+        # First piece of each chunk.
+        self._chunk_pieces = np.searchsorted(chunk_ids, np.arange(n_chunks + 1))
+        self._chunk_starts = self._starts[self._chunk_pieces]
+
+    def num_chunks(self) -> int:
+        return self._n_chunks
+
+    def size(self) -> int:
+        return int(self._starts[-1])
+
+    def chunk_sizes(self):
+        """ Number of records of each chunk. """
+        return np.diff(self._chunk_starts)
+
+    def chunk_start(self, chunk_id: int) -> int:
+        """ Stream position of the first record of a chunk.
+        """
+        return int(self._chunk_starts[chunk_id])
+
+    def chunk_id(self, position: int) -> int:
+        """ Returns the chunk that contains the record at the given stream position.
+        """
+        # Empty chunks share their start with the next chunk; side='right' skips them.
+        return int(np.searchsorted(self._chunk_starts, position, side='right')) - 1
+
+    def chunk_plan(self, chunk_id: int):
+        """ Returns the (shards, offsets, lengths) arrays to read in order to assemble a chunk.
+        """
+        begin, end = self._chunk_pieces[chunk_id], self._chunk_pieces[chunk_id + 1]
+        return self._shards[begin:end], self._offsets[begin:end], self._lengths[begin:end]
+
+    def plan(self, start: int, stop: int):
+        """ Returns the (shards, offsets, lengths) read plan for the stream positions [start, stop).
+        """
+        begin = int(np.searchsorted(self._starts, start, side='right')) - 1
+        end = int(np.searchsorted(self._starts, stop, side='left'))
+        shards = self._shards[begin:end]
+        offsets = self._offsets[begin:end].copy()
+        lengths = self._lengths[begin:end].copy()
+        if len(lengths):
+            skip = start - self._starts[begin]
+            offsets[0] += skip
+            lengths[0] -= skip
+            lengths[-1] -= self._starts[end] - stop
+        return shards, offsets, lengths
+
+
+class GeneratorStats(object):
+    """
+    I/O counters of a DataGenerator:
+      bytes_read: bytes read from the shards: the stored columns of the records, or the compressed
+        blocks of compressed shards
+      seeks: shard reads that do not start where the previous read of that shard ended
+      chunk_loads: windows assembled from the shards
+      cache_hits: windows served from memory, including the ones read by the prefetch threads
+      decode_time: seconds spent assembling windows and gathering shuffled records
+      getitem_time: seconds spent in __getitem__
+    Counters are updated from the prefetch threads and are protected by a lock.
+    """
+
+    COUNTERS = ('bytes_read', 'seeks', 'chunk_loads', 'cache_hits', 'decode_time', 'getitem_time')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(GeneratorStats.COUNTERS, 0)
+        self._shard_offsets = {}
+
+    def add(self, name, value):
+        with self._lock:
+            self._counters[name] += value
+
+    def record_reads(self, shards, offsets, lengths, record_bytes):
+        """ Counts reads of records; record_bytes: bytes read per record of each shard. """
+        with self._lock:
+            for shard, offset, length in zip(shards, offsets, lengths):
+                if self._shard_offsets.get(shard) != offset:
+                    self._counters['seeks'] += 1
+                self._shard_offsets[shard] = offset + length
+                self._counters['bytes_read'] += int(length) * record_bytes[shard]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict.fromkeys(GeneratorStats.COUNTERS, 0)
+
+
+def _copy_records(dst, index, src):
+    """
+    dst[index] = src, where src is either a record array or a columnar.Columns view.
+    """
+    if isinstance(src, np.ndarray) and src.dtype == dst.dtype:
+        dst[index] = src
+        return
+    for name in columnar.FIELDS:
+        dst[name][index] = src[name]
+
+
 class DataGenerator(keras.utils.Sequence):
     """
     Large matrix distributed across num_shard files.
 
     Example: 64 files with 3M data points each.
 
+    data_dir contains either data.bin.NNNNN-of-NNNNN record files, data.z.NNNNN-of-NNNNN block
+    compressed files (see compressed.py) or a columnar dataset (see columnar.py). For a columnar
+    dataset, the shards and their sizes are read from the manifest and num_shards may be None.
+
     In order to support data shuffling the code reads a matrix chunk across the multiple shards
     which is expected to be larger than the batch_size. It then serves shuffled permutations of these
     chunks. e.g. 10k lines per file (x64). Then serve permuted 8k chunks for data.
 
-    Reads from shard files are done in increments of chunk_size.
+    Reads from shard files are done in increments of chunk_size. Shards are memory mapped with a
+    structured dtype equivalent to FORMAT; a chunk is a view of the mapping, copied only when data
+    from several shards is merged or shuffled.
+
+    The permutation of a chunk is a function of seed, the epoch number and the chunk id, so that
+    on_epoch_end reshuffles the records; the default seed is drawn from np.random so that
+    np.random.seed keeps controlling the order.
+
+    With epoch_shuffle=True, on_epoch_end draws a new permutation of the chunks of all the shards,
+    from seed and the epoch number. Consecutive chunks in that order are grouped in windows of
+    shuffle_window chunks, whose records are shuffled together; reads remain sequential within
+    each chunk and at most a window is held in memory. Without epoch_shuffle each window is a single
+    chunk, served in index order.
+
+    With prefetch > 0 a thread pool reads the next prefetch windows while the current one is being
+    served, as long as they fit in prefetch_memory bytes. Batches are identical to the ones produced
+    without prefetching.
+
+    With stateless=True, __getitem__ is a pure function of the batch index: no chunk is cached and
+    shuffled batches are gathered from the shard mappings. Mappings are reopened lazily in each
+    process and are not pickled, so the generator can be used with workers > 1 and
+    use_multiprocessing=True.
+
+    Batches are returned as coord_dtype coordinates and value_dtype values; the on disk types,
+    np.int32 / np.float32, halve the memory traffic of the int64 / float64 defaults. With
+    output_buffers=N, batches are written into a ring of N preallocated buffers; a batch is then
+    only valid until N more batches are requested.
+
+    With instrument=True the generator keeps GeneratorStats I/O counters, see stats(). Counters
+    of generators copied to worker processes are not reported back.
+
+    With negative_ratio > 0 every batch of n records is followed by round(n * negative_ratio)
+    random (row, col) pairs with value 0, with rows in the row range of the batch and columns in
+    [0, num_cols). Pairs that are set in the windows the batch is read from are rejected, using a
+    sorted key index of each window. Negatives are drawn from seed, the epoch and the batch index,
+    so that every epoch sees new ones. num_cols defaults to the shape of a columnar dataset.
     """
 
     FORMAT = 'IIf'
-
-    def __init__(self, data_dir, num_shards, batch_size=32, chunk_size=16*1024, shuffle=False, shard_merge=False, allow_partial=True):
+    RECORD_DTYPE = np.dtype([('row', np.uint32), ('col', np.uint32), ('value', np.float32)])
+
+    def __init__(self, data_dir, num_shards, batch_size=32, chunk_size=16*1024, shuffle=False, shard_merge=False, allow_partial=True,
+                 seed=None, prefetch=0, prefetch_memory=256*1024*1024, stateless=False,
+                 coord_dtype=int, value_dtype=float, output_buffers=0, epoch_shuffle=False, shuffle_window=4,
+                 instrument=False, negative_ratio=0.0, num_cols=None):
+        if stateless and prefetch:
+            raise ValueError('prefetch requires a stateful generator')
+        if stateless and output_buffers:
+            raise ValueError('output_buffers requires a stateful generator')
         self._data_dir = data_dir
         self._batch_size = batch_size
         self._chunk_size = chunk_size
-        self._shuffle = shuffle
+        self._shuffle = shuffle or epoch_shuffle
+        self._epoch_shuffle = epoch_shuffle
+        self._shuffle_window = shuffle_window if epoch_shuffle else 1
+        self._epoch = 0
         self._shard_merge = shard_merge
         self._allow_partial = allow_partial
-        self._filenames = self._get_filenames(data_dir, num_shards)
-        self._filedescr = [open(f, 'rb') for f in self._filenames]
-        self._file_offsets = [0] * len(self._filenames)
-        self._data_counts = self._file_size()
-        if shard_merge:
-            self._build_chunk_sizes()
-
-        # chunk state
-        self._current_chunk_id = None
-        self._X_data = None
-        self._y_labels = None
-        self._data_offset = 0
+        self._seed = seed if seed is not None else np.random.randint(2**31)
+        self._prefetch = prefetch
+        self._prefetch_memory = prefetch_memory
+        self._stateless = stateless
+        self._coord_dtype = coord_dtype
+        self._value_dtype = value_dtype
+        self._output_buffers = output_buffers
+        self._stats = GeneratorStats() if instrument else None
+        self._negative_ratio = negative_ratio
+        self._num_cols = num_cols
+        self._manifest = None
+        if columnar.has_manifest(data_dir):
+            self._manifest = columnar.load_manifest(data_dir)
+            if self._num_cols is None and self._manifest.get('shape'):
+                self._num_cols = self._manifest['shape'][1]
+            if num_shards is not None and num_shards != self._manifest['num_shards']:
+                raise ValueError('{0}: dataset has {1} shards'.format(data_dir, self._manifest['num_shards']))
+            self._compressed = False
+            self._filenames = None
+            self._data_counts = [entry['count'] for entry in self._manifest['shards']]
+            self._record_bytes = [columnar.record_bytes(entry) for entry in self._manifest['shards']]
+        else:
+            self._filenames = self._get_filenames(data_dir, num_shards)
+            self._compressed = not os.path.exists(self._filenames[0]) and \
+                os.path.exists(compressed.shard_filename(data_dir, 0, num_shards))
+            if self._compressed:
+                self._filenames = [compressed.shard_filename(data_dir, shard_id, num_shards)
+                                   for shard_id in range(num_shards)]
+            self._data_counts = self._file_size()
+            # Compressed shards report the size of the blocks they read instead.
+            self._record_bytes = [0 if self._compressed else DataGenerator.RECORD_DTYPE.itemsize] * len(self._filenames)
+        self._shards = None
+        self._mapped_pid = None
+        self._get_shards()
+        if negative_ratio > 0 and self._num_cols is None:
+            raise ValueError('negative_ratio requires num_cols')
+        self._index = ChunkIndex(self._data_counts, chunk_size, shard_merge=shard_merge)
+        self._build_windows()
+
+        # (epoch, window_id) -> sorted keys of the window records, used to reject negatives; like the
+        # inverse permutations, it is local to the process and also used in stateless mode.
+        self._window_keys_cache = collections.OrderedDict()
+        # (epoch, window_id) -> inverse permutation of a window, used by the stateless gathers.
+        self._inverse_cache = collections.OrderedDict()
+
+        # window state
+        self._current_window = None
+        self._data = None
+
+        # output buffer ring
+        self._buffers = []
+        self._next_buffer = 0
+
+        # prefetch state: window_id -> future, in scheduling order.
+        self._executor = None
+        self._pending = collections.OrderedDict()
+        if prefetch > 0:
+            self._executor = ThreadPoolExecutor(max_workers=min(prefetch, os.cpu_count() or 1))
 
     def __del__(self):
-        for file in self._filedescr:
-            file.close()
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Mappings, prefetch threads and the chunk cache belong to the process.
+        state.update(_shards=None, _mapped_pid=None, _executor=None, _pending=collections.OrderedDict(),
+                     _current_window=None, _data=None, _buffers=[], _next_buffer=0,
+                     _window_keys_cache=collections.OrderedDict(), _inverse_cache=collections.OrderedDict())
+        if self._stats is not None:
+            state['_stats'] = GeneratorStats()
+        return state
+
+    def stats(self):
+        """
+        Returns a dict with the GeneratorStats counters, or None when instrumentation is disabled.
+        """
+        return self._stats.snapshot() if self._stats is not None else None
+
+    def reset_stats(self):
+        if self._stats is not None:
+            self._stats.reset()
+
+    def close(self):
+        """
+        Stops the prefetch threads. Pending reads are cancelled.
+        """
+        executor = getattr(self, '_executor', None)
+        if executor is None:
+            return
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        executor.shutdown(wait=True)
+        self._executor = None
 
     def _get_filenames(self, data_dir, num_shards):
         filenames = [os.path.join(data_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(
@@ -79,6 +358,8 @@ class DataGenerator(keras.utils.Sequence):
         """
         Returns the number of records in each file.
         """
+        if self._compressed:
+            return [len(compressed.CompressedShard(filename)) for filename in self._filenames]
         counts = []
         for filename in self._filenames:
             file_info = os.stat(filename)
@@ -87,140 +368,213 @@ class DataGenerator(keras.utils.Sequence):
             counts.append(count)
         return counts
 
-    def _build_chunk_sizes(self):
-        """
-        Not all chunk sizes are the same: upto the min shard file all chunks provide data. Once data is exausted
-        from a shard, the chunk size decreases.
-        """
-        chunk_size_list = []
-        sizes = copy.copy(self._data_counts)
-        last_index = 0
-        while len(sizes):
-            m = min(sizes)
-            # common_idx is the next chunk at which an fd ends.
-            common_idx = int(m / self._chunk_size)
-            if common_idx > last_index:
-                current_size = self._chunk_size * len(sizes)
-                chunk_size_list.append((common_idx, current_size))
-
-            # indexes of blocks that end at common_idx
-            chunk_start = common_idx * self._chunk_size
-            chunk_end = chunk_start + self._chunk_size
-            indices = [i for i, v in enumerate(
-                sizes) if v >= chunk_start and v < chunk_end]
-
-            # sum the extra size of the shards that end at common_idx
-            def sum_pair(a, b): return a + b
-            chunk_last_sum = functools.reduce(sum_pair, map(
-                lambda x: sizes[x] - chunk_start, indices))
-            indices.reverse()
-            for i in indices:
-                del sizes[i]
-
-            if chunk_last_sum:
-                n_current_size = self._chunk_size * len(sizes)
-                chunk_size_list.append(
-                    (common_idx + 1, n_current_size + chunk_last_sum))
-                last_index = common_idx + 1
-            else:
-                last_index = common_idx
-
-        # validate: sum of the sizes should equal the total number of records.
-        accum = 0
-        prev = 0
-        for idx, size in chunk_size_list:
-            accum += size * (idx - prev)
-            prev = idx
-        assert accum == sum(self._data_counts)
-        self._chunk_size_list = chunk_size_list
-
-    def _get_chunk_id(self, block_id: int) -> int:
-        """
-        Map block start offset to the chunk that provides the data.
-        In case where we are merging data from different chunks, it requires computing the offset
-        based on different sizes per interval.
-        """
-        batch_offset = block_id * self._batch_size
-        if not self._shard_merge:
-            accum = 0
-            offset = 0
-            for size in self._data_counts:
-                if batch_offset <  size:
-                    n_id = int(batch_offset / self._chunk_size)
-                    return accum + n_id
-                batch_offset -= size
-                accum += int((size - 1) / self._chunk_size) + 1
-
-        chunk_index = 0
-        prev = 0
-        for idx, chunk_size in self._chunk_size_list:
-            offset = (idx - prev) * chunk_size
-            if offset >= batch_offset:
-                # index is calculated in terms of the current size
-                ext = int(batch_offset / chunk_size)
-                return chunk_index + ext
-            batch_offset -= offset
-            chunk_index = idx
-            prev = idx
-
-        assert False
-
-    def _read_chunk(self, chunk_id):
-        # Return immediatly if the chunk is already in memory.
-        if chunk_id == self._current_chunk_id:
-            return True
-
-        rows = []
-        cols = []
-        values = []
-        bsize = struct.calcsize(DataGenerator.FORMAT)
-        rel_chunk_id = chunk_id
-
-        for idx, file in enumerate(self._filedescr):
-            if self._shard_merge:
-                want_offset = chunk_id * self._chunk_size
-            else:
-                n_chunks = int((self._data_counts[idx] - 1) / self._chunk_size) + 1
-                if rel_chunk_id >= n_chunks:
-                    rel_chunk_id -= n_chunks
-                    continue
-                want_offset = rel_chunk_id * self._chunk_size
+    @staticmethod
+    def _map_shard(filename, count):
+        """
+        Maps the first count records of a shard file. A trailing partial record is ignored.
+        """
+        if count == 0:
+            # mmap does not support empty files.
+            return np.empty((0,), dtype=DataGenerator.RECORD_DTYPE)
+        return np.memmap(filename, dtype=DataGenerator.RECORD_DTYPE, mode='r', shape=(count,))
 
-            if want_offset > self._data_counts[idx]:
-                continue
-            if want_offset != self._file_offsets[idx]:
-                file.seek(want_offset * bsize)
-                self._file_offsets[idx] = want_offset
+    def _get_shards(self):
+        """
+        Returns the shard mappings. The files are mapped again when running in a different process.
+        """
+        pid = os.getpid()
+        if self._mapped_pid != pid:
+            if self._manifest is not None:
+                self._shards = [columnar.open_shard(self._data_dir, entry) for entry in self._manifest['shards']]
+            elif self._compressed:
+                on_read = functools.partial(self._stats.add, 'bytes_read') if self._stats is not None else None
+                self._shards = [compressed.CompressedShard(filename, on_read=on_read) for filename in self._filenames]
+            else:
+                self._shards = [self._map_shard(filename, count)
+                                for filename, count in zip(self._filenames, self._data_counts)]
+            self._mapped_pid = pid
+        return self._shards
 
-            buf = file.read(self._chunk_size * bsize)
-            if len(buf) == 0:
-                continue
-            n_records = int(len(buf) / bsize)
-            self._file_offsets[idx] += n_records
-            for i in range(n_records):
-                elements = struct.unpack_from(
-                    DataGenerator.FORMAT, buf, i * bsize)
-                rows.append(elements[0])
-                cols.append(elements[1])
-                values.append(elements[2])
-            if not self._shard_merge:
-                break
+    def _build_windows(self):
+        """
+        Computes the chunks served by each window in the current epoch.
+        """
+        n_chunks = self._index.num_chunks()
+        if self._epoch_shuffle:
+            order = np.random.RandomState([self._seed, self._epoch]).permutation(n_chunks)
+        else:
+            order = np.arange(n_chunks)
+        bounds = np.arange(0, n_chunks, self._shuffle_window)
+        self._window_chunks = np.split(order, bounds[1:])
+        sizes = self._index.chunk_sizes()[order]
+        window_sizes = np.add.reduceat(sizes, bounds) if n_chunks else sizes
+        self._window_starts = np.concatenate(([0], np.cumsum(window_sizes)))
+
+    def on_epoch_end(self):
+        # The epoch number seeds the negatives and the permutations; the window order only changes
+        # with epoch_shuffle.
+        self._epoch += 1
+        if not self._shuffle:
+            return
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._current_window = None
+        self._data = None
+        if self._epoch_shuffle:
+            self._window_keys_cache.clear()
+            self._build_windows()
+
+    def _window_id(self, position):
+        # Empty windows share their start with the next window; side='right' skips them.
+        return int(np.searchsorted(self._window_starts, position, side='right')) - 1
+
+    def _window_plan(self, window_id):
+        """
+        Returns the (shards, offsets, lengths) pieces of the chunks of a window.
+        """
+        plans = [self._index.chunk_plan(chunk_id) for chunk_id in self._window_chunks[window_id]]
+        if len(plans) == 1:
+            return plans[0]
+        return tuple(np.concatenate(column) for column in zip(*plans))
 
-        if not len(values):
-            return False
+    def _load_window(self, window_id):
+        """
+        Assembles a window from the shard mappings. This method does not modify the generator state
+        and runs in the prefetch threads.
+        """
+        if self._stats is not None:
+            start_time = time.time()
+        mappings = self._get_shards()
+        shards, offsets, lengths = self._window_plan(window_id)
+        pieces = [mappings[shard][offset:offset + length]
+                  for shard, offset, length in zip(shards, offsets, lengths)]
 
-        X = np.array([rows, cols], dtype=int).T
-        y = np.array(values, dtype=float)
         if self._shuffle:
-            perm = np.random.permutation(X.shape[0])
-            X = X[perm]
-            y = y[perm]
+            # Scatter each piece to its permuted position: a single copy out of the mapping.
+            size = int(lengths.sum())
+            perm = self._permutation(window_id, size)
+            data = np.empty((size,), dtype=DataGenerator.RECORD_DTYPE)
+            start = 0
+            for piece in pieces:
+                _copy_records(data, perm[start:start + len(piece)], piece)
+                start += len(piece)
+        elif len(pieces) == 1 and not self._prefetch:
+            data = pieces[0]
+        else:
+            data = np.empty((int(lengths.sum()),), dtype=DataGenerator.RECORD_DTYPE)
+            start = 0
+            for piece in pieces:
+                _copy_records(data, slice(start, start + len(piece)), piece)
+                start += len(piece)
+
+        if self._stats is not None:
+            self._stats.record_reads(shards, offsets, lengths, self._record_bytes)
+            self._stats.add('chunk_loads', 1)
+            self._stats.add('decode_time', time.time() - start_time)
+        return data
+
+    def _permutation(self, window_id, size):
+        """
+        Permutation applied to a window: record i of the window is served at position perm[i].
+        """
+        if self._epoch_shuffle:
+            key = [self._seed, self._epoch, window_id]
+        else:
+            key = [self._seed, self._epoch, int(self._window_chunks[window_id][0])]
+        return np.random.RandomState(key).permutation(size)
 
-        self._current_chunk_id = chunk_id
-        self._X_data = X
-        self._y_labels = y
-        self._data_offset = 0
-        return True
+    def _inverse_permutation(self, window_id, size):
+        """
+        Window record served at each position. The last two windows are cached, so that the batches
+        of a window only draw its permutation once.
+        """
+        key = (self._epoch, window_id)
+        inverse = self._inverse_cache.get(key)
+        if inverse is None:
+            inverse = np.empty((size,), dtype=np.int64)
+            inverse[self._permutation(window_id, size)] = np.arange(size)
+            self._inverse_cache[key] = inverse
+            while len(self._inverse_cache) > 2:
+                self._inverse_cache.popitem(last=False)
+        return inverse
+
+    def _gather(self, window_id, start, stop):
+        """
+        Returns the records served at positions [start, stop) of a shuffled window, read from the
+        shard mappings without assembling the window.
+        """
+        if self._stats is not None:
+            start_time = time.time()
+        mappings = self._get_shards()
+        shards, offsets, lengths = self._window_plan(window_id)
+        positions = self._inverse_permutation(window_id, int(lengths.sum()))[start:stop]
+
+        piece_starts = np.cumsum(lengths) - lengths
+        pieces = np.searchsorted(piece_starts, positions, side='right') - 1
+        order = np.argsort(pieces, kind='stable')
+        bounds = np.searchsorted(pieces[order], np.arange(len(lengths) + 1))
+        data = np.empty((stop - start,), dtype=DataGenerator.RECORD_DTYPE)
+        for i, (shard, offset) in enumerate(zip(shards, offsets)):
+            members = order[bounds[i]:bounds[i + 1]]
+            if len(members):
+                _copy_records(data, members, mappings[shard][offset + positions[members] - piece_starts[i]])
+                if self._stats is not None:
+                    # Records are gathered in permuted order: every piece is a random read.
+                    self._stats.add('seeks', 1)
+                    self._stats.add('bytes_read', len(members) * self._record_bytes[shard])
+
+        if self._stats is not None:
+            self._stats.add('decode_time', time.time() - start_time)
+        return data
+
+    def _window_bytes(self, window_id):
+        size = self._window_starts[window_id + 1] - self._window_starts[window_id]
+        return int(size) * DataGenerator.RECORD_DTYPE.itemsize
+
+    def _schedule_prefetch(self, window_id):
+        """
+        Keeps the windows that follow window_id in flight. The windows of the next epoch are only
+        known after on_epoch_end, so the readahead wraps around only without shuffle.
+        """
+        n_windows = len(self._window_chunks)
+        ahead = [window_id + i for i in range(1, min(self._prefetch, n_windows - 1) + 1)]
+        if self._shuffle:
+            ahead = [next_id for next_id in ahead if next_id < n_windows]
+        else:
+            ahead = [next_id % n_windows for next_id in ahead]
+        for pending_id in list(self._pending):
+            if pending_id not in ahead:
+                self._pending.pop(pending_id).cancel()
+
+        budget = self._prefetch_memory - self._window_bytes(window_id)
+        budget -= sum(self._window_bytes(pending_id) for pending_id in self._pending)
+        for next_id in ahead:
+            if next_id in self._pending:
+                continue
+            size = self._window_bytes(next_id)
+            if size > budget:
+                break
+            budget -= size
+            self._pending[next_id] = self._executor.submit(self._load_window, next_id)
+
+    def _read_window(self, window_id):
+        # Return immediatly if the window is already in memory.
+        if window_id == self._current_window:
+            if self._stats is not None:
+                self._stats.add('cache_hits', 1)
+            return self._data
+
+        future = self._pending.pop(window_id, None)
+        if future is not None and self._stats is not None:
+            self._stats.add('cache_hits', 1)
+        data = future.result() if future is not None else self._load_window(window_id)
+
+        self._current_window = window_id
+        self._data = data
+        if self._executor is not None:
+            self._schedule_prefetch(window_id)
+        return data
 
     def __len__(self):
         'Denotes the number of batches per epoch'
@@ -233,30 +587,110 @@ class DataGenerator(keras.utils.Sequence):
     def size(self):
         return np.sum(self._data_counts)
 
+    def _batch_pieces(self, start, stop):
+        """
+        Generates the record arrays that make up the stream positions [start, stop).
+        Without shuffling or prefetching these are read directly from the shard mappings; otherwise
+        they are slices of the windows.
+        """
+        if not self._shuffle and not self._prefetch:
+            mappings = self._get_shards()
+            plan = self._index.plan(start, stop)
+            if self._stats is not None:
+                self._stats.record_reads(*plan, record_bytes=self._record_bytes)
+            for shard, offset, length in zip(*plan):
+                yield mappings[shard][offset:offset + length]
+            return
+
+        window_id = self._window_id(start)
+        while start < stop:
+            window_start = self._window_starts[window_id]
+            end = min(stop, self._window_starts[window_id + 1])
+            if self._stateless:
+                yield self._gather(window_id, start - window_start, end - window_start)
+            else:
+                yield self._read_window(window_id)[start - window_start:end - window_start]
+            start = end
+            window_id += 1
+
+    def _window_keys(self, window_id):
+        """
+        Returns the sorted keys (row * num_cols + col) of the records of a window. The keys of the
+        last two windows are cached, so that the batches of a window only sort its keys once.
+        """
+        cache_key = (self._epoch, window_id)
+        keys = self._window_keys_cache.get(cache_key)
+        if keys is not None:
+            return keys
+        if window_id == self._current_window:
+            data = [self._data]
+        else:
+            mappings = self._get_shards()
+            data = [mappings[shard][offset:offset + length]
+                    for shard, offset, length in zip(*self._window_plan(window_id))]
+        keys = np.unique(np.concatenate([
+            negative_sampling.encode_keys(d['row'], d['col'], self._num_cols) for d in data]))
+        self._window_keys_cache[cache_key] = keys
+        while len(self._window_keys_cache) > 2:
+            self._window_keys_cache.popitem(last=False)
+        return keys
+
+    def _negatives(self, index, start, stop, rows, n):
+        """
+        Returns the keys of n negatives for the batch of the stream positions [start, stop).
+        """
+        window_ids = range(self._window_id(start), self._window_id(stop - 1) + 1)
+        keys = [self._window_keys(window_id) for window_id in window_ids]
+        positive_keys = keys[0] if len(keys) == 1 else np.unique(np.concatenate(keys))
+        # The windows may span more rows than the batch: only the positives of the sampled rows count.
+        row_start, row_end = int(rows.min()), int(rows.max()) + 1
+        bounds = np.searchsorted(positive_keys, negative_sampling.encode_keys([row_start, row_end], 0, self._num_cols))
+        positive_keys = positive_keys[bounds[0]:bounds[1]]
+        rng = np.random.RandomState([self._seed, self._epoch, index, 1])
+        return negative_sampling.sample_negatives(
+            rng, n, row_start, row_end, self._num_cols, positive_keys, unique=False)
+
+    def _output_arrays(self, size):
+        """
+        Returns the arrays a batch of size records is written to.
+        """
+        if not self._output_buffers:
+            return np.empty((size, 2), dtype=self._coord_dtype), np.empty((size,), dtype=self._value_dtype)
+        if len(self._buffers) < self._output_buffers:
+            capacity = self._batch_size + int(round(self._batch_size * self._negative_ratio))
+            self._buffers.append((np.empty((capacity, 2), dtype=self._coord_dtype),
+                                  np.empty((capacity,), dtype=self._value_dtype)))
+        X, y = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % self._output_buffers
+        return X[:size], y[:size]
+
     def __getitem__(self, index):
         'Generate one batch of data'
-        chunk_id = self._get_chunk_id(index)
-        assert self._read_chunk(chunk_id)            
+        if self._stats is not None:
+            start_time = time.time()
+        start = index * self._batch_size
+        stop = min(start + self._batch_size, self._index.size())
+        assert start < stop
 
-        X = np.empty((self._batch_size, 2), dtype=int)
-        y = np.empty((self._batch_size,))
+        n_negatives = int(round((stop - start) * self._negative_ratio))
+        X, y = self._output_arrays(stop - start + n_negatives)
 
+        batch = index
         index = 0
-        while index < self._batch_size:
-            avail = self._X_data.shape[0] - self._data_offset
-            if avail == 0:
-                chunk_id += 1
-                if not self._read_chunk(chunk_id):
-                    assert self._allow_partial
-                    X = np.resize(X, (index, 2))
-                    y = np.resize(y, (index,))
-                    break
-                avail = self._X_data.shape[0]
-            need = self._batch_size - index
-            use = min(avail, need)
-            X[index:index+use, :] = self._X_data[self._data_offset:self._data_offset+use, :]
-            y[index:index+use] = self._y_labels[self._data_offset:self._data_offset+use]
-            self._data_offset += use
+        for data in self._batch_pieces(start, stop):
+            use = len(data)
+            X[index:index+use, 0] = data['row']
+            X[index:index+use, 1] = data['col']
+            y[index:index+use] = data['value']
             index += use
 
+        if n_negatives:
+            rows, cols = negative_sampling.decode_keys(
+                self._negatives(batch, start, stop, X[:index, 0], n_negatives), self._num_cols)
+            X[index:, 0] = rows
+            X[index:, 1] = cols
+            y[index:] = 0
+
+        if self._stats is not None:
+            self._stats.add('getitem_time', time.time() - start_time)
         return X, y
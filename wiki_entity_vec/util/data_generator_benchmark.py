@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+DataGenerator throughput benchmark.
+
+Generates a synthetic matrix and iterates one epoch of DataGenerator for every combination of the
+shard_merge, shuffle, chunk_size and batch_size settings. Each configuration runs in a spawned
+child process, so that its peak RSS does not include the pages of the parent, and the shard files
+are evicted from the page cache first, so that bytes_read counts the reads from storage.
+
+Results are written as JSON, so that runs can be compared between releases:
+  python data_generator_benchmark.py --shape=200000,400000 --density=0.0005 --output=results.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+if __name__ == '__main__':
+    curdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.dirname(os.path.dirname(curdir)))
+
+from wiki_entity_vec.util.data_generator import DataGenerator
+from wiki_entity_vec.util.synthetic import FORMATS, generate_shards
+
+
+def _io_counters():
+    """ Bytes read from storage and major page faults of the current process. """
+    read_bytes = None
+    try:
+        with open('/proc/self/io', 'r') as file:
+            for line in file:
+                name, value = line.split(':')
+                if name == 'read_bytes':
+                    read_bytes = int(value)
+    except IOError:
+        pass
+    return read_bytes, resource.getrusage(resource.RUSAGE_SELF).ru_majflt
+
+
+def _peak_rss():
+    """ Peak RSS of the current process: VmHWM on Linux, which _reset_peak_rss() clears. """
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _reset_peak_rss():
+    """ Resets the peak RSS to the current RSS, so that it excludes the module imports. """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def _drop_page_cache(data_dir):
+    """ Evicts the files of data_dir from the page cache; returns False if it is not supported. """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for name in os.listdir(data_dir):
+        fd = os.open(os.path.join(data_dir, name), os.O_RDONLY)
+        try:
+            # Pages that are not yet written back can't be evicted.
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def run_config(data_dir, num_shards, config):
+    cold_cache = _drop_page_cache(data_dir)
+    _reset_peak_rss()
+    start_rss = _peak_rss()
+    gen = DataGenerator(data_dir, num_shards, **config)
+    read_bytes, faults = _io_counters()
+    start = time.time()
+    records = 0
+    for batch in range(len(gen)):
+        X, _ = gen[batch]
+        records += X.shape[0]
+    elapsed = time.time() - start
+    end_read_bytes, end_faults = _io_counters()
+    gen.close()
+    return {
+        'records': records,
+        'batches': len(gen),
+        'seconds': elapsed,
+        'records_per_sec': records / elapsed,
+        'batches_per_sec': len(gen) / elapsed,
+        'peak_rss': _peak_rss(),
+        # Peak RSS above the RSS of the child once the modules are imported; on systems without
+        # _reset_peak_rss() the import peak may hide it.
+        'peak_rss_delta': _peak_rss() - start_rss,
+        # Bytes read from storage; with a warm page cache this undercounts the bytes the generator reads.
+        'bytes_read': end_read_bytes - read_bytes if read_bytes is not None else None,
+        'cold_cache': cold_cache,
+        'major_faults': end_faults - faults,
+    }
+
+
+def _child(queue, data_dir, num_shards, config):
+    queue.put(run_config(data_dir, num_shards, config))
+
+
+def run_isolated(data_dir, num_shards, config):
+    # A forked child would report the resident pages of the parent in its ru_maxrss.
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, data_dir, num_shards, config))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DataGenerator throughput benchmark')
+    parser.add_argument('--shape', type=_int_list, default=[100000, 300000], help='rows,cols')
+    parser.add_argument('--density', type=float, default=0.0002)
+    parser.add_argument('--num_shards', type=int, default=16)
+    parser.add_argument('--format', choices=FORMATS, default='bin')
+    parser.add_argument('--chunk_size', type=_int_list, default=[16*1024, 256*1024])
+    parser.add_argument('--batch_size', type=_int_list, default=[32*1024, 1024*1024])
+    parser.add_argument('--data_dir', help='Read an existing dataset instead of generating a temporary one; '
+                        '--shape, --density and --format are then ignored')
+    parser.add_argument('--output', help='JSON results file')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    try:
+        if args.data_dir:
+            # An existing dataset is only read: the shard formats are detected by DataGenerator.
+            gen = DataGenerator(data_dir, args.num_shards)
+            records = int(gen.size())
+            gen.close()
+            print('Reusing {0} records in {1}'.format(records, data_dir))
+        else:
+            start = time.time()
+            records = sum(generate_shards(data_dir, tuple(args.shape), args.density, args.num_shards,
+                                          fmt=args.format))
+            print('Generated {0} records in {1:.1f}s'.format(records, time.time() - start))
+
+        results = []
+        for shard_merge, shuffle, chunk_size, batch_size in itertools.product(
+                [False, True], [False, True], args.chunk_size, args.batch_size):
+            config = dict(shard_merge=shard_merge, shuffle=shuffle, chunk_size=chunk_size,
+                          batch_size=batch_size, coord_dtype=np.int32, value_dtype=np.float32)
+            result = run_isolated(data_dir, args.num_shards, config)
+            result['config'] = {k: v for k, v in config.items() if k not in ('coord_dtype', 'value_dtype')}
+            results.append(result)
+            print('merge={0:d} shuffle={1:d} chunk={2:>8} batch={3:>8}: {4:>12.0f} records/s '
+                  '{5:>8.1f} batches/s rss=+{6:.0f}MB'.format(
+                      shard_merge, shuffle, chunk_size, batch_size, result['records_per_sec'],
+                      result['batches_per_sec'], result['peak_rss_delta'] / 1e6))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    if args.output:
+        if args.data_dir:
+            dataset = {'data_dir': args.data_dir, 'num_shards': args.num_shards, 'records': records}
+        else:
+            dataset = {'shape': args.shape, 'density': args.density, 'num_shards': args.num_shards,
+                       'format': args.format, 'records': records}
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'dataset': dataset,
+            'results': results,
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
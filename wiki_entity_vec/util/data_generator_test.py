@@ -3,16 +3,20 @@ import unittest
 
 import tempfile
 import os
+import copy
+import pickle
 import random
 import struct
 
-from functools import partial
+from functools import partial, reduce
 
 import numpy as np
 
 from scipy.sparse import dok_matrix
 
-from data_generator import DataGenerator
+from compressed import CompressedShard, shard_filename as compressed_filename
+from data_generator import ChunkIndex, DataGenerator
+from wiki_entity_vec.util.synthetic import generate_shards
 
 
 class DataGeneratorTest(unittest.TestCase):
@@ -133,6 +137,353 @@ class DataGeneratorTest(unittest.TestCase):
             X, _ = DataGeneratorTest._collect_data(gen)
             self._assert_matrix_equal(matrix, X)
 
+    def test_empty_shard(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 500)
+        self._generate_testdata(matrix, 4)
+        filename = os.path.join(self._tmpdir, 'data.bin.{0:05d}-of-{1:05d}'.format(1, 4))
+        open(filename, 'wb').close()
+        for shard_merge in [False, True]:
+            gen = DataGenerator(self._tmpdir, 4, batch_size=32, chunk_size=48, shard_merge=shard_merge)
+            X, _ = DataGeneratorTest._collect_data(gen)
+            self.assertEqual(X.shape[0], gen.size())
+            self.assertEqual(len(set(map(tuple, X))), X.shape[0])
+
+    def test_random_access(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 999)
+        self._generate_testdata(matrix, 4)
+        gen = DataGenerator(self._tmpdir, 4, batch_size=64, chunk_size=100, shard_merge=True)
+        X, y = DataGeneratorTest._collect_data(gen)
+        for batch in reversed(range(len(gen))):
+            X_b, y_b = gen[batch]
+            np.testing.assert_array_equal(X_b, X[batch * 64:(batch + 1) * 64])
+            np.testing.assert_array_equal(y_b, y[batch * 64:(batch + 1) * 64])
+
+    def test_prefetch(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 3333)
+        self._generate_testdata(matrix, 8)
+        for shuffle in [False, True]:
+            gen = DataGenerator(self._tmpdir, 8, batch_size=64, chunk_size=16, shard_merge=True,
+                                shuffle=shuffle, seed=1)
+            X, y = DataGeneratorTest._collect_data(gen)
+            for memory in [12 * 16 * 8, 1024 * 1024]:
+                prefetch = DataGenerator(self._tmpdir, 8, batch_size=64, chunk_size=16, shard_merge=True,
+                                         shuffle=shuffle, seed=1, prefetch=4, prefetch_memory=memory)
+                for _ in range(2):
+                    X_p, y_p = DataGeneratorTest._collect_data(prefetch)
+                    np.testing.assert_array_equal(X, X_p)
+                    np.testing.assert_array_equal(y, y_p)
+                prefetch.close()
+        self._assert_matrix_equal(matrix, X)
+
+    def test_shuffle_epochs(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 999)
+        self._generate_testdata(matrix, 4)
+        options = dict(batch_size=64, chunk_size=100, shard_merge=True, shuffle=True, seed=5)
+        gen = DataGenerator(self._tmpdir, 4, **options)
+        epochs = []
+        for _ in range(2):
+            X, _ = DataGeneratorTest._collect_data(gen)
+            self._assert_matrix_equal(matrix, X)
+            epochs.append(X)
+            gen.on_epoch_end()
+        self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+        others = [DataGenerator(self._tmpdir, 4, prefetch=2, **options),
+                  DataGenerator(self._tmpdir, 4, stateless=True, **options)]
+        for other in others:
+            for X in epochs:
+                X_o, _ = DataGeneratorTest._collect_data(other)
+                np.testing.assert_array_equal(X, X_o)
+                other.on_epoch_end()
+            other.close()
+
+    def test_stateless(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 3333)
+        self._generate_testdata(matrix, 8)
+        for shuffle, shard_merge in [(False, True), (True, False), (True, True)]:
+            gen = DataGenerator(self._tmpdir, 8, batch_size=48, chunk_size=20, shard_merge=shard_merge,
+                                shuffle=shuffle, seed=1)
+            X, y = DataGeneratorTest._collect_data(gen)
+            stateless = DataGenerator(self._tmpdir, 8, batch_size=48, chunk_size=20, shard_merge=shard_merge,
+                                      shuffle=shuffle, seed=1, stateless=True)
+            data = pickle.dumps(stateless)
+            # The shard mappings are not part of the pickled state.
+            self.assertLess(len(data), stateless.size() * DataGenerator.RECORD_DTYPE.itemsize / 2)
+            clone = pickle.loads(data)
+            for batch in reversed(range(len(gen))):
+                X_b, y_b = clone[batch]
+                np.testing.assert_array_equal(X_b, X[batch * 48:(batch + 1) * 48])
+                np.testing.assert_array_equal(y_b, y[batch * 48:(batch + 1) * 48])
+            self.assertIsNone(clone._data)
+
+            # In batch order, the permutation of a window is drawn once for all its batches.
+            permutations = []
+            permutation = stateless._permutation
+            stateless._permutation = lambda window_id, size: permutations.append(window_id) or permutation(window_id, size)
+            X_s, _ = DataGeneratorTest._collect_data(stateless)
+            np.testing.assert_array_equal(X_s, X)
+            self.assertEqual(len(permutations), len(set(permutations)))
+
+    def test_compact_dtypes(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 999)
+        self._generate_testdata(matrix, 4)
+        gen = DataGenerator(self._tmpdir, 4, batch_size=64, chunk_size=100, shard_merge=True)
+        X, y = DataGeneratorTest._collect_data(gen)
+        compact = DataGenerator(self._tmpdir, 4, batch_size=64, chunk_size=100, shard_merge=True,
+                                coord_dtype=np.int32, value_dtype=np.float32, output_buffers=2)
+        batches = []
+        for batch in range(len(compact)):
+            X_b, y_b = compact[batch]
+            self.assertEqual(X_b.dtype, np.int32)
+            self.assertEqual(y_b.dtype, np.float32)
+            np.testing.assert_array_equal(X_b, X[batch * 64:(batch + 1) * 64])
+            np.testing.assert_array_equal(y_b, y[batch * 64:(batch + 1) * 64])
+            batches.append(X_b)
+        # The buffers are reused once the ring wraps around.
+        self.assertTrue(np.shares_memory(batches[0], batches[2]))
+        self.assertFalse(np.shares_memory(batches[0], batches[1]))
+
+    def test_epoch_shuffle(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 3333)
+        self._generate_testdata(matrix, 8)
+        options = dict(batch_size=64, chunk_size=32, epoch_shuffle=True, shuffle_window=3, seed=7)
+        gen = DataGenerator(self._tmpdir, 8, **options)
+        epochs = []
+        for _ in range(3):
+            obs = partial(self._shard_count, matrix, 8)
+            X, y = DataGeneratorTest._collect_data(gen, obs)
+            self._assert_matrix_equal(matrix, X)
+            self.assertEqual(len(set(map(tuple, X))), X.shape[0])
+            # the first batch mixes chunks from different shards.
+            self.assertGreater(len(self._obs_shards), 1)
+            epochs.append(X)
+            gen.on_epoch_end()
+        self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+        others = [DataGenerator(self._tmpdir, 8, **options),
+                  DataGenerator(self._tmpdir, 8, prefetch=2, **options),
+                  DataGenerator(self._tmpdir, 8, stateless=True, **options)]
+        for other in others:
+            for X in epochs:
+                X_o, _ = DataGeneratorTest._collect_data(other)
+                np.testing.assert_array_equal(X, X_o)
+                other.on_epoch_end()
+            other.close()
+
+    def test_negatives(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 3000)
+        self._generate_testdata(matrix, 1)
+        with self.assertRaises(ValueError):
+            DataGenerator(self._tmpdir, 1, negative_ratio=0.5)
+
+        positives = DataGenerator(self._tmpdir, 1, batch_size=100, chunk_size=10000)
+        gen = DataGenerator(self._tmpdir, 1, batch_size=100, chunk_size=10000, seed=3,
+                            negative_ratio=0.5, num_cols=100)
+        self.assertEqual(len(gen), len(positives))
+        negatives = []
+        for batch in range(len(gen)):
+            X, y = gen[batch]
+            X_p, y_p = positives[batch]
+            n = X_p.shape[0]
+            self.assertEqual(X.shape[0], n + int(round(n * 0.5)))
+            np.testing.assert_array_equal(X[:n], X_p)
+            np.testing.assert_array_equal(y[:n], y_p)
+            np.testing.assert_array_equal(y[n:], 0)
+            self.assertTrue(np.all((X[n:, 0] >= X_p[:, 0].min()) & (X[n:, 0] <= X_p[:, 0].max())))
+            self.assertTrue(np.all(matrix[X[n:, 0], X[n:, 1]].toarray() == 0))
+            negatives.append(X[n:])
+
+        stateless = DataGenerator(self._tmpdir, 1, batch_size=100, chunk_size=10000, seed=3,
+                                  negative_ratio=0.5, num_cols=100, stateless=True)
+        np.testing.assert_array_equal(stateless[3][0], gen[3][0])
+        # The window keys are sorted once for all the batches of the window.
+        self.assertIs(stateless._window_keys(0), stateless._window_keys(0))
+        np.testing.assert_array_equal(gen[3][0][100:], negatives[3])
+        gen.on_epoch_end()
+        self.assertFalse(np.array_equal(gen[3][0][100:], negatives[3]))
+
+        buffered = DataGenerator(self._tmpdir, 1, batch_size=100, chunk_size=1000, shuffle=True,
+                                 negative_ratio=0.25, num_cols=100, output_buffers=2)
+        X, y = buffered[0]
+        self.assertEqual(X.shape, (125, 2))
+        self.assertEqual(np.count_nonzero(y == 0), 25)
+
+    def test_negatives_dense_rows(self):
+        # Row sorted shard with half of the cells of each row set: a window spans many more rows
+        # than a batch, and its positives outnumber the cells of the batch rows.
+        records = np.empty((100 * 50,), dtype=DataGenerator.RECORD_DTYPE)
+        records['row'] = np.repeat(np.arange(100), 50)
+        records['col'] = np.tile(np.arange(0, 100, 2), 100)
+        records['value'] = 1.0
+        records.tofile(os.path.join(self._tmpdir, 'data.bin.00000-of-00001'))
+        for stateless in [False, True]:
+            gen = DataGenerator(self._tmpdir, 1, batch_size=50, chunk_size=5000, negative_ratio=0.5,
+                                num_cols=100, stateless=stateless)
+            for batch in range(len(gen)):
+                X, y = gen[batch]
+                self.assertEqual(X.shape, (75, 2))
+                np.testing.assert_array_equal(X[50:, 0], batch)
+                np.testing.assert_array_equal(X[50:, 1] % 2, 1)
+                np.testing.assert_array_equal(y[50:], 0)
+
+    def test_instrument(self):
+        matrix = DataGeneratorTest._generate_matrix((100, 100), 999)
+        self._generate_testdata(matrix, 4)
+        gen = DataGenerator(self._tmpdir, 4, batch_size=64, chunk_size=100)
+        gen[0]
+        self.assertIsNone(gen.stats())
+
+        gen = DataGenerator(self._tmpdir, 4, batch_size=64, chunk_size=100, instrument=True)
+        DataGeneratorTest._collect_data(gen)
+        stats = gen.stats()
+        self.assertEqual(stats['bytes_read'], 999 * DataGenerator.RECORD_DTYPE.itemsize)
+        self.assertEqual(stats['seeks'], 4)
+        self.assertEqual(stats['chunk_loads'], 0)
+        self.assertGreater(stats['getitem_time'], 0)
+        gen.reset_stats()
+        self.assertEqual(gen.stats()['bytes_read'], 0)
+
+        gen = DataGenerator(self._tmpdir, 4, batch_size=25, chunk_size=50, shard_merge=True, shuffle=True,
+                            instrument=True)
+        DataGeneratorTest._collect_data(gen)
+        stats = gen.stats()
+        self.assertEqual(stats['bytes_read'], 999 * DataGenerator.RECORD_DTYPE.itemsize)
+        n_windows = gen._index.num_chunks()
+        self.assertEqual(stats['chunk_loads'], n_windows)
+        # every window is loaded once and then serves the remaining batches that overlap it.
+        self.assertGreaterEqual(stats['cache_hits'], len(gen) - n_windows)
+
+    def test_instrument_formats(self):
+        for fmt, values in [('columnar', 'ones'), ('columnar', 'uniform'), ('z', 'ones')]:
+            data_dir = os.path.join(self._tmpdir, fmt + '-' + values)
+            generate_shards(data_dir, (300, 500), 0.02, 4, values=values, fmt=fmt)
+            for options in [dict(), dict(shuffle=True, shard_merge=True, chunk_size=256)]:
+                gen = DataGenerator(data_dir, 4, batch_size=100, instrument=True, **options)
+                DataGeneratorTest._collect_data(gen)
+                if fmt == 'columnar':
+                    # The value column of all ones is not stored.
+                    record_bytes = 8 if values == 'ones' else 12
+                    self.assertEqual(gen.stats()['bytes_read'], gen.size() * record_bytes)
+                else:
+                    shards = [CompressedShard(compressed_filename(data_dir, shard_id, 4)) for shard_id in range(4)]
+                    compressed_size = sum(shard.compressed_size() for shard in shards)
+                    self.assertGreaterEqual(gen.stats()['bytes_read'], compressed_size)
+                    self.assertLess(gen.stats()['bytes_read'], gen.size() * DataGenerator.RECORD_DTYPE.itemsize)
+
+
+def _legacy_chunk_sizes(counts, chunk_size):
+    """ Interval list computed by the sequential DataGenerator for shard_merge mode.
+    """
+    chunk_size_list = []
+    sizes = copy.copy(counts)
+    last_index = 0
+    while len(sizes):
+        m = min(sizes)
+        common_idx = int(m / chunk_size)
+        if common_idx > last_index:
+            chunk_size_list.append((common_idx, chunk_size * len(sizes)))
+        chunk_start = common_idx * chunk_size
+        chunk_end = chunk_start + chunk_size
+        indices = [i for i, v in enumerate(sizes) if v >= chunk_start and v < chunk_end]
+        chunk_last_sum = reduce(lambda a, b: a + b, map(lambda x: sizes[x] - chunk_start, indices))
+        indices.reverse()
+        for i in indices:
+            del sizes[i]
+        if chunk_last_sum:
+            chunk_size_list.append((common_idx + 1, chunk_size * len(sizes) + chunk_last_sum))
+            last_index = common_idx + 1
+        else:
+            last_index = common_idx
+    return chunk_size_list
+
+
+def _legacy_chunk_id(counts, chunk_size, chunk_size_list, batch_offset, shard_merge):
+    """ Linear scan mapping a stream position to a chunk.
+    """
+    if not shard_merge:
+        accum = 0
+        for size in counts:
+            if batch_offset < size:
+                return accum + int(batch_offset / chunk_size)
+            batch_offset -= size
+            accum += int((size - 1) / chunk_size) + 1
+    chunk_index = 0
+    prev = 0
+    for idx, size in chunk_size_list:
+        offset = (idx - prev) * size
+        if offset >= batch_offset:
+            return chunk_index + int(batch_offset / size)
+        batch_offset -= offset
+        chunk_index = idx
+        prev = idx
+    assert False
+
+
+def _legacy_chunk_pieces(counts, chunk_size, chunk_id, shard_merge):
+    """ (shard, offset, length) reads issued by the sequential DataGenerator for a chunk.
+    """
+    pieces = []
+    rel_chunk_id = chunk_id
+    for idx, count in enumerate(counts):
+        if shard_merge:
+            want_offset = chunk_id * chunk_size
+        else:
+            n_chunks = int((count - 1) / chunk_size) + 1
+            if rel_chunk_id >= n_chunks:
+                rel_chunk_id -= n_chunks
+                continue
+            want_offset = rel_chunk_id * chunk_size
+        if want_offset >= count:
+            continue
+        pieces.append((idx, want_offset, min(chunk_size, count - want_offset)))
+        if not shard_merge:
+            break
+    return pieces
+
+
+class ChunkIndexTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(20190318)
+
+    def _check_index(self, counts, chunk_size, batch_size, shard_merge):
+        index = ChunkIndex(counts, chunk_size, shard_merge=shard_merge)
+        self.assertEqual(index.size(), sum(counts))
+        chunk_size_list = _legacy_chunk_sizes(counts, chunk_size) if shard_merge else None
+        for batch_offset in range(0, sum(counts), batch_size):
+            chunk_id = index.chunk_id(batch_offset)
+            self.assertEqual(chunk_id, _legacy_chunk_id(
+                counts, chunk_size, chunk_size_list, batch_offset, shard_merge))
+            self.assertLessEqual(index.chunk_start(chunk_id), batch_offset)
+
+        stream = []
+        for chunk_id in range(index.num_chunks()):
+            plan = list(zip(*index.chunk_plan(chunk_id)))
+            self.assertEqual(plan, _legacy_chunk_pieces(counts, chunk_size, chunk_id, shard_merge))
+            stream.extend((shard, offset + i) for shard, offset, length in plan for i in range(length))
+
+        for start in range(0, sum(counts), batch_size):
+            stop = min(start + batch_size, sum(counts))
+            plan = zip(*index.plan(start, stop))
+            records = [(shard, offset + i) for shard, offset, length in plan for i in range(length)]
+            self.assertEqual(records, stream[start:stop])
+
+    def test_property(self):
+        for _ in range(200):
+            counts = [random.randint(1, 200) for _ in range(random.randint(1, 12))]
+            chunk_size = random.randint(1, 64)
+            batch_size = random.randint(1, 96)
+            for shard_merge in [False, True]:
+                self._check_index(counts, chunk_size, batch_size, shard_merge)
+
+    def test_empty_shards(self):
+        index = ChunkIndex([10, 0, 10], 4)
+        self.assertEqual(index.num_chunks(), 7)
+        self.assertEqual(index.chunk_id(10), 4)
+        self.assertEqual([len(index.chunk_plan(i)[0]) for i in range(7)], [1, 1, 1, 0, 1, 1, 1])
+        index = ChunkIndex([10, 0, 10], 4, shard_merge=True)
+        self.assertEqual(index.num_chunks(), 3)
+        self.assertEqual(index.size(), 20)
+
 
 if __name__ == '__main__':
     unittest.main()
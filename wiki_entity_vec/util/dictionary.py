@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+
 class Dictionary(object):
     def __init__(self):
         self._ids = []
@@ -15,9 +22,391 @@ class Dictionary(object):
     def id(self, name):
         return self._names.get(name, -1)
 
+    def ids(self, names):
+        """ Array of the ids of a sequence of names, -1 for the names that are not present. """
+        return np.fromiter(map(self._names.get, names, itertools.repeat(-1)), dtype=np.int64, count=len(names))
+
+    def name(self, index):
+        return self._ids[index]
+
+    def names(self, ids):
+        return [self._ids[index] for index in ids]
+
     def contains(self, name):
         return name in self._names
 
+    def contains_mask(self, names):
+        return self.ids(names) != -1
+
     def size(self):
         return len(self._ids)
 
+
+# 32-bit FNV-1a: the hash only selects a slot of the table, and the Python implementation used
+# by single lookups is faster than the 64-bit variant.
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+_MASK32 = 0xffffffff
+
+
+def fnv1a(data):
+    """ FNV-1a hash of a bytes object. """
+    h = FNV_OFFSET
+    for byte in bytearray(data):
+        h = ((h ^ byte) * FNV_PRIME) & _MASK32
+    return h
+
+
+def encode_names(names):
+    """ UTF-8 blob (uint8 array) and int64 offsets array of a sequence of str. """
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = np.zeros((len(encoded) + 1,), dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def encode_queries(names):
+    """ UTF-8 blob, start and length arrays of a list of str.
+    The names are joined by newlines and encoded with a single call; the strings of a blob are
+    not contiguous, unless one of the names contains a newline.
+    """
+    blob = np.frombuffer('\n'.join(names).encode('utf-8'), dtype=np.uint8)
+    separators = np.flatnonzero(blob == ord('\n'))
+    if len(separators) != max(len(names) - 1, 0):
+        blob, offsets = encode_names(names)
+        return blob, offsets[:-1], np.diff(offsets)
+    starts = np.zeros((len(names),), dtype=np.int64)
+    starts[1:] = separators + 1
+    ends = np.empty((len(names),), dtype=np.int64)
+    ends[:-1] = separators
+    ends[-1:] = len(blob)
+    return blob, starts, ends - starts
+
+
+def _by_length(lengths):
+    # Longest first, so that the strings that are longer than a position are a prefix.
+    order = np.argsort(-lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    max_length = int(sorted_lengths[0]) if len(sorted_lengths) else 0
+    return order, sorted_lengths, max_length
+
+
+def fnv1a_array(blob, starts, lengths):
+    """ FNV-1a hashes of the strings blob[starts[i]:starts[i] + lengths[i]], as a uint32 array.
+    The strings are processed one byte position at a time, longest first, so that the strings
+    still being hashed at each position are a prefix of the order.
+    """
+    order, sorted_lengths, max_length = _by_length(lengths)
+    starts = starts[order]
+    hashes = np.full((len(order),), FNV_OFFSET, dtype=np.uint32)
+    prime = np.uint32(FNV_PRIME)
+    for position in range(max_length):
+        active = int(np.count_nonzero(sorted_lengths > position))
+        h = hashes[:active]
+        h ^= blob[starts[:active] + position]
+        h *= prime
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result
+
+
+def equal_strings(blob_a, starts_a, blob_b, starts_b, lengths):
+    """ Mask of the pairs of strings of the same length, blob_a[starts_a[i]:][:lengths[i]] and
+    blob_b[starts_b[i]:][:lengths[i]], that are equal.
+    """
+    order, sorted_lengths, max_length = _by_length(lengths)
+    starts_a = starts_a[order]
+    starts_b = starts_b[order]
+    equal = np.ones((len(order),), dtype=bool)
+    for position in range(max_length):
+        active = int(np.count_nonzero(sorted_lengths > position))
+        equal[:active] &= blob_a[starts_a[:active] + position] == blob_b[starts_b[:active] + position]
+    result = np.empty_like(equal)
+    result[order] = equal
+    return result
+
+
+class CompactDictionary(object):
+    """ Dictionary stored as a UTF-8 blob of the names, an offsets array and an open addressing
+    hash table (FNV-1a, linear probing) of the name ids: about 8 bytes per name plus the UTF-8
+    size, instead of a str object, a list slot and a dict entry per name.
+
+    A compiled dictionary is a single file that is memory mapped by load_compiled(), so that the
+    processes that load the same file share its pages. The id/contains/size methods behave as the
+    Dictionary ones: when a name is repeated, id() returns its last position. Names are hashed
+    in Python, so per-name lookups are much slower than the ones of a Dictionary: it is meant for
+    the tools where memory matters more than lookup speed.
+    """
+    MAGIC = b'WDIC'
+    VERSION = 2
+    # Below this count, the names of a batch lookup are looked up one at a time with id().
+    SCALAR_LOOKUPS = 128
+    # The source fields identify the text file that the dictionary was compiled from.
+    HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', np.uint32), ('size', np.uint64),
+                             ('table_size', np.uint64), ('blob_size', np.uint64),
+                             ('source_size', np.uint64), ('source_mtime_ns', np.int64),
+                             ('source_hash', 'S20'), ('padding', 'S4')])
+
+    def __init__(self):
+        self._filename = None
+        self._set_arrays(np.zeros((1,), dtype=np.int64), np.full((1,), -1, dtype=np.int32),
+                         np.empty((0,), dtype=np.uint8))
+
+    def _set_arrays(self, offsets, table, blob):
+        self._offsets = offsets
+        self._table = table
+        self._blob = blob
+        self._mask = len(table) - 1
+        self._blob_view = memoryview(blob)
+
+    @classmethod
+    def build(cls, names):
+        """ Builds the dictionary from a sequence of str names. """
+        blob, offsets = encode_names(names)
+        dictionary = cls()
+        dictionary._set_arrays(offsets, cls._build_table(fnv1a_array(blob, offsets[:-1], np.diff(offsets))), blob)
+        return dictionary
+
+    @staticmethod
+    def _build_table(hashes):
+        # Power of two, at most half full.
+        table_size = 1
+        while table_size < 2 * len(hashes):
+            table_size *= 2
+        table = np.full((table_size,), -1, dtype=np.int32)
+        mask = np.uint32(table_size - 1)
+        # All the ids are inserted in rounds: the ids that probe an empty slot claim it, one per
+        # slot, and the others move to the next slot. Larger ids are placed first so that a
+        # repeated name resolves to its last position.
+        ids = np.arange(len(hashes) - 1, -1, -1, dtype=np.int64)
+        slots = (hashes[::-1] & mask).astype(np.int64)
+        while len(ids):
+            empty = table[slots] == -1
+            _, first = np.unique(slots[empty], return_index=True)
+            claimed = np.flatnonzero(empty)[first]
+            table[slots[claimed]] = ids[claimed]
+            pending = np.ones((len(ids),), dtype=bool)
+            pending[claimed] = False
+            ids = ids[pending]
+            slots = (slots[pending] + 1) & (table_size - 1)
+        return table
+
+    def load(self, filename):
+        """ Loads a text file, one name per line, as Dictionary.load(). """
+        with open(filename, 'r') as file:
+            names = [line.strip() for line in file]
+        compact = self.build(names)
+        self._set_arrays(compact._offsets, compact._table, compact._blob)
+
+    def save(self, filename, source=None):
+        """ Writes the compiled dictionary.
+        source: the (size, mtime_ns, sha1 digest) stamp of the text file, see source_stamp().
+        """
+        header = np.zeros((1,), dtype=self.HEADER_DTYPE)
+        header['magic'] = self.MAGIC
+        header['version'] = self.VERSION
+        header['size'] = self.size()
+        header['table_size'] = len(self._table)
+        header['blob_size'] = len(self._blob)
+        if source is not None:
+            header['source_size'], header['source_mtime_ns'], header['source_hash'] = source
+        with open(filename, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(self._offsets.astype(np.int64).tobytes())
+            file.write(self._table.astype(np.int32).tobytes())
+            file.write(self._blob.tobytes())
+
+    @classmethod
+    def read_header(cls, filename):
+        """ Returns the header of a compiled dictionary, or None if the file is not one. """
+        try:
+            with open(filename, 'rb') as file:
+                data = file.read(cls.HEADER_DTYPE.itemsize)
+        except (IOError, OSError):
+            return None
+        if len(data) != cls.HEADER_DTYPE.itemsize:
+            return None
+        header = np.frombuffer(data, dtype=cls.HEADER_DTYPE)[0]
+        if header['magic'] != cls.MAGIC or header['version'] != cls.VERSION:
+            return None
+        return header
+
+    @classmethod
+    def load_compiled(cls, filename, mmap=True):
+        """ Opens a file written by save(). With mmap, the arrays are read only views of the file. """
+        if mmap:
+            data = np.memmap(filename, dtype=np.uint8, mode='r')
+        else:
+            data = np.fromfile(filename, dtype=np.uint8)
+        header_size = cls.HEADER_DTYPE.itemsize
+        if len(data) < header_size:
+            raise ValueError('{0}: not a compiled dictionary'.format(filename))
+        header = data[:header_size].view(cls.HEADER_DTYPE)[0]
+        if header['magic'] != cls.MAGIC or header['version'] != cls.VERSION:
+            raise ValueError('{0}: not a compiled dictionary'.format(filename))
+        offsets_end = header_size + 8 * (int(header['size']) + 1)
+        table_end = offsets_end + 4 * int(header['table_size'])
+        if len(data) != table_end + int(header['blob_size']):
+            raise ValueError('{0}: truncated compiled dictionary'.format(filename))
+        dictionary = cls()
+        dictionary._set_arrays(data[header_size:offsets_end].view(np.int64),
+                               data[offsets_end:table_end].view(np.int32),
+                               data[table_end:])
+        if mmap:
+            dictionary._filename = filename
+        return dictionary
+
+    def __getstate__(self):
+        # A memory mapped dictionary is sent to worker processes as its filename, so that the
+        # workers map the same file instead of receiving a copy of the arrays.
+        if self._filename is not None:
+            return {'filename': self._filename}
+        return {'offsets': self._offsets, 'table': self._table, 'blob': self._blob}
+
+    def __setstate__(self, state):
+        if 'filename' in state:
+            self.__dict__.update(self.load_compiled(state['filename']).__dict__)
+        else:
+            self._filename = None
+            self._set_arrays(state['offsets'], state['table'], state['blob'])
+
+    def nbytes(self):
+        return self._offsets.nbytes + self._table.nbytes + self._blob.nbytes
+
+    def name(self, index):
+        return self._blob[self._offsets[index]:self._offsets[index + 1]].tobytes().decode('utf-8')
+
+    def id(self, name):
+        data = name.encode('utf-8')
+        table = self._table
+        offsets = self._offsets
+        slot = fnv1a(data) & self._mask
+        while True:
+            index = int(table[slot])
+            if index == -1:
+                return -1
+            start = int(offsets[index])
+            end = int(offsets[index + 1])
+            if end - start == len(data) and self._blob_view[start:end] == data:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def ids(self, names):
+        """ Array of the ids of a sequence of names, -1 for the names that are not present.
+
+        The names are hashed and probed together: each round looks up the current slot of all the
+        pending names, resolves the ones that hit an empty slot or an equal name, and moves the
+        others to the next slot. The few names left after the first rounds, in long probe chains,
+        are looked up one at a time.
+        """
+        names = list(names)
+        if len(names) <= self.SCALAR_LOOKUPS:
+            return np.array([self.id(name) for name in names], dtype=np.int64)
+        blob, query_starts, lengths = encode_queries(names)
+        result = np.full((len(names),), -1, dtype=np.int64)
+        pending = np.arange(len(names))
+        slots = (fnv1a_array(blob, query_starts, lengths) & np.uint32(self._mask)).astype(np.int64)
+        while len(pending) > self.SCALAR_LOOKUPS:
+            candidates = self._table[slots].astype(np.int64)
+            occupied = candidates != -1
+            pending, slots, candidates = pending[occupied], slots[occupied], candidates[occupied]
+            starts = self._offsets[candidates]
+            same = self._offsets[candidates + 1] - starts == lengths[pending]
+            same[same] = equal_strings(self._blob, starts[same], blob, query_starts[pending[same]],
+                                       lengths[pending[same]])
+            result[pending[same]] = candidates[same]
+            pending = pending[~same]
+            slots = (slots[~same] + 1) & self._mask
+        for index in pending:
+            result[index] = self.id(names[index])
+        return result
+
+    def names(self, ids):
+        """ List of the names of a sequence of ids. The names are copied to a single, newline
+        separated, buffer that is decoded at once; they cannot contain newlines, which holds for the
+        dictionaries loaded from a text file.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return []
+        starts = self._offsets[ids]
+        lengths = self._offsets[ids + 1] - starts
+        # Position in the concatenation of the names, without separators.
+        positions = np.arange(int(lengths.sum()), dtype=np.int64)
+        name_starts = np.cumsum(lengths) - lengths
+        output = np.full((len(positions) + len(ids),), ord('\n'), dtype=np.uint8)
+        output[positions + np.repeat(np.arange(len(ids)), lengths)] = \
+            self._blob[positions + np.repeat(starts - name_starts, lengths)]
+        return output.tobytes().decode('utf-8').split('\n')[:-1]
+
+    def contains(self, name):
+        return self.id(name) != -1
+
+    def contains_mask(self, names):
+        return self.ids(names) != -1
+
+    def size(self):
+        return len(self._offsets) - 1
+
+
+COMPILED_SUFFIX = '.dict'
+
+
+def source_stamp(filename, digest=True):
+    """ (size, mtime_ns, sha1 digest) of a file; the digest is None unless requested. """
+    stat = os.stat(filename)
+    sha1 = None
+    if digest:
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha1.update(block)
+        sha1 = sha1.digest()
+    return stat.st_size, stat.st_mtime_ns, sha1
+
+
+def is_fresh(compiled, filename):
+    """ Whether compiled was built from the current contents of filename. The file is only hashed
+    when its size matches and its mtime does not, e.g. after a copy.
+    """
+    header = CompactDictionary.read_header(compiled)
+    if header is None:
+        return False
+    size, mtime_ns, _ = source_stamp(filename, digest=False)
+    if int(header['source_size']) != size:
+        return False
+    if int(header['source_mtime_ns']) == mtime_ns:
+        return True
+    return header['source_hash'] == source_stamp(filename)[2]
+
+
+def load_dictionary(filename, cache=False):
+    """ Loads a text dictionary.
+
+    Without cache, a Dictionary is returned: its per-name lookups, used by the matrix generation,
+    are faster. With cache, a CompactDictionary is returned, for the tools where memory matters:
+    it is read from the compiled <filename>.dict file when it is fresh and memory mapped.
+    Otherwise the text file is parsed and the compiled file is (re)written next to it, when the
+    directory is writable.
+    """
+    if not cache:
+        dictionary = Dictionary()
+        dictionary.load(filename)
+        return dictionary
+
+    compiled = filename + COMPILED_SUFFIX
+    if is_fresh(compiled, filename):
+        return CompactDictionary.load_compiled(compiled)
+
+    stamp = source_stamp(filename)
+    dictionary = CompactDictionary()
+    dictionary.load(filename)
+    tmp_filename = '{0}.tmp.{1}'.format(compiled, os.getpid())
+    try:
+        dictionary.save(tmp_filename, source=stamp)
+        os.rename(tmp_filename, compiled)
+    except (IOError, OSError):
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return dictionary
+    return CompactDictionary.load_compiled(compiled)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the memory use, startup time and lookup throughput of Dictionary and CompactDictionary.
+
+Memory is the Python heap allocated by loading the dictionary (tracemalloc). A memory mapped
+compiled dictionary allocates almost nothing on the heap: its pages are file backed and shared by
+all the processes that open the same file, so the file size is shown alongside.
+
+Lookups are measured one id() call per name and with ids() over batches of --batch_size names;
+the names() throughput is the reverse mapping of the ids found. Each throughput is the best of
+--repeat passes: the first pass after a load is slower, whichever method runs first.
+
+load_dictionary() is measured twice: cold, when it parses the text file and writes the compiled
+cache next to it, and warm, when it checks that the cache is fresh and maps it.
+
+Usage: python dictionary_benchmark.py [--names=N] [--lookups=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from dictionary import COMPILED_SUFFIX, CompactDictionary, Dictionary, load_dictionary
+
+
+def load_text(filename, compiled):
+    dictionary = Dictionary()
+    dictionary.load(filename)
+    return dictionary
+
+
+def load_compact(filename, compiled):
+    dictionary = CompactDictionary()
+    dictionary.load(filename)
+    return dictionary
+
+
+def load_compiled(filename, compiled):
+    return CompactDictionary.load_compiled(compiled)
+
+
+def load_cached(filename, compiled):
+    return load_dictionary(filename, cache=True)
+
+
+def best_time(fn, repeat):
+    """ Returns the result of fn() and its shortest run time over repeat calls. """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return result, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dictionary benchmark')
+    parser.add_argument('--names', type=int, default=2*1000*1000)
+    parser.add_argument('--lookups', type=int, default=200*1000)
+    parser.add_argument('--batch_size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(20190322)
+    # Titles of 4 to 40 characters, similar to the page titles.
+    alphabet = np.array(list('abcdefghijklmnopqrstuvwxyz_ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+    lengths = rng.randint(4, 41, size=args.names)
+    chars = alphabet[rng.randint(0, len(alphabet), size=int(lengths.sum()))]
+    ends = np.cumsum(lengths)
+    text = ''.join(chars)
+    names = ['{0}_{1}'.format(text[end - length:end], n) for n, (end, length) in enumerate(zip(ends, lengths))]
+    queries = [names[i] for i in rng.randint(0, len(names), size=args.lookups // 2)]
+    queries += [name + '~' for name in queries]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'names.txt')
+        with open(filename, 'w') as file:
+            file.write('\n'.join(names) + '\n')
+        compiled = os.path.join(tmpdir, 'names.dict')
+        CompactDictionary.build(names).save(compiled)
+        del names
+        print('text: {0:.1f} MB, compiled: {1:.1f} MB'.format(
+            os.path.getsize(filename) / 1e6, os.path.getsize(compiled) / 1e6))
+
+        if os.path.exists(filename + COMPILED_SUFFIX):
+            os.remove(filename + COMPILED_SUFFIX)
+        for name, fn in [('Dictionary', load_text),
+                         ('CompactDictionary', load_compact),
+                         ('compiled mmap', load_compiled),
+                         ('cache cold', load_cached),
+                         ('cache warm', load_cached)]:
+            gc.collect()
+            tracemalloc.start()
+            start = time.time()
+            dictionary = fn(filename, compiled)
+            load_time = time.time() - start
+            heap, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            found, lookup_time = best_time(
+                lambda: sum(1 for query in queries if dictionary.id(query) != -1), args.repeat)
+            assert found == len(queries) // 2
+            print('{0:>18}: load {1:>8.1f}ms heap {2:>8.1f} MB (peak {3:>8.1f} MB) {4:>10.0f} lookups/s'.format(
+                name, load_time * 1e3, heap / 1e6, peak / 1e6, len(queries) / lookup_time))
+            ids, batch_time = best_time(
+                lambda: np.concatenate([dictionary.ids(queries[i:i + args.batch_size])
+                                        for i in range(0, len(queries), args.batch_size)]), args.repeat)
+            assert np.count_nonzero(ids != -1) == found
+            ids = ids[ids != -1]
+            _, names_time = best_time(
+                lambda: [dictionary.names(ids[i:i + args.batch_size]) for i in range(0, len(ids), args.batch_size)],
+                args.repeat)
+            print('{0:>18}: {1:>10.0f} batch lookups/s {2:>10.0f} names/s'.format(
+                '', len(queries) / batch_time, len(ids) / names_time))
+            del dictionary
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
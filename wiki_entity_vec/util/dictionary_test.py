@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import unittest
+
+import pickle
+import tempfile
+import os
+
+from dictionary import COMPILED_SUFFIX, CompactDictionary, Dictionary, fnv1a, fnv1a_array, load_dictionary
+
+import numpy as np
+
+
+class DictionaryTest(unittest.TestCase):
+    NAMES = ['Anarchism', 'Autism', 'Albedo', u'Ælfric_of_Eynsham', 'A', u'Zürich', 'Autism', u'東京', 'B']
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+        self._filename = os.path.join(self._tmpdir, 'names.txt')
+        with open(self._filename, 'w') as file:
+            for name in self.NAMES:
+                print(name, file=file)
+
+    def _check(self, dictionary, expected):
+        self.assertEqual(dictionary.size(), expected.size())
+        for name in self.NAMES + ['', 'Anarchis', 'Anarchism_', u'Zurich']:
+            self.assertEqual(dictionary.id(name), expected.id(name), name)
+            self.assertEqual(dictionary.contains(name), expected.contains(name))
+
+    def test_hash(self):
+        self.assertEqual(fnv1a(b''), 0x811c9dc5)
+        self.assertEqual(fnv1a(b'a'), 0xe40c292c)
+        encoded = [name.encode('utf-8') for name in self.NAMES]
+        offsets = np.cumsum([0] + [len(data) for data in encoded])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        self.assertEqual(list(fnv1a_array(blob, offsets[:-1], np.diff(offsets))), [fnv1a(data) for data in encoded])
+
+    def test_compact(self):
+        expected = Dictionary()
+        expected.load(self._filename)
+        dictionary = CompactDictionary()
+        dictionary.load(self._filename)
+        self._check(dictionary, expected)
+        self.assertEqual(dictionary.id('Autism'), 6)
+        self.assertEqual(dictionary.name(3), u'Ælfric_of_Eynsham')
+
+    def test_batch(self):
+        expected = Dictionary()
+        expected.load(self._filename)
+        compact = CompactDictionary()
+        compact.load(self._filename)
+        queries = self.NAMES + ['', 'Anarchis', u'Zurich', u'東', 'Autism']
+        for dictionary in [expected, compact]:
+            ids = dictionary.ids(queries)
+            self.assertEqual(ids.dtype, np.int64)
+            self.assertEqual(list(ids), [expected.id(name) for name in queries])
+            self.assertEqual(list(dictionary.contains_mask(queries)), [expected.contains(name) for name in queries])
+            self.assertEqual(list(dictionary.ids([])), [])
+            order = [7, 0, 3, 6, 6, 8, 5]
+            self.assertEqual(dictionary.names(order), [self.NAMES[index] for index in order])
+            self.assertEqual(dictionary.names(np.array([], dtype=np.int64)), [])
+            self.assertEqual(dictionary.name(3), self.NAMES[3])
+
+    def test_compiled(self):
+        expected = Dictionary()
+        expected.load(self._filename)
+        compiled = os.path.join(self._tmpdir, 'names.dict')
+        CompactDictionary.build(self.NAMES).save(compiled)
+        for mmap in [True, False]:
+            self._check(CompactDictionary.load_compiled(compiled, mmap=mmap), expected)
+
+        with open(compiled, 'r+b') as file:
+            file.truncate(os.path.getsize(compiled) - 1)
+        with self.assertRaises(ValueError):
+            CompactDictionary.load_compiled(compiled)
+
+    def test_cache(self):
+        expected = Dictionary()
+        expected.load(self._filename)
+        compiled = self._filename + COMPILED_SUFFIX
+
+        dictionary = load_dictionary(self._filename, cache=True)
+        self.assertTrue(os.path.exists(compiled))
+        self._check(dictionary, expected)
+        mtime = os.path.getmtime(compiled)
+        self._check(load_dictionary(self._filename, cache=True), expected)
+        self.assertEqual(os.path.getmtime(compiled), mtime)
+
+        # Same contents with a new mtime: the cache is still used.
+        stat = os.stat(self._filename)
+        os.utime(self._filename, (stat.st_atime, stat.st_mtime + 10))
+        load_dictionary(self._filename, cache=True)
+        self.assertEqual(os.path.getmtime(compiled), mtime)
+
+        # Modified source: the cache is rebuilt.
+        with open(self._filename, 'a') as file:
+            print('Zebra', file=file)
+        expected.load(self._filename)
+        dictionary = load_dictionary(self._filename, cache=True)
+        self.assertEqual(dictionary.id('Zebra'), len(self.NAMES))
+        self.assertEqual(CompactDictionary.load_compiled(compiled).size(), len(self.NAMES) + 1)
+
+        self.assertIsInstance(load_dictionary(self._filename, cache=False), Dictionary)
+
+    def test_pickle(self):
+        compiled = os.path.join(self._tmpdir, 'names.dict')
+        built = CompactDictionary.build(self.NAMES)
+        built.save(compiled)
+        for dictionary in [built, CompactDictionary.load_compiled(compiled)]:
+            copy = pickle.loads(pickle.dumps(dictionary))
+            self.assertEqual([copy.id(name) for name in self.NAMES], [dictionary.id(name) for name in self.NAMES])
+        self.assertLess(len(pickle.dumps(CompactDictionary.load_compiled(compiled))), 200)
+
+    def test_collisions(self):
+        names = ['page_{0}'.format(n) for n in range(5000)]
+        dictionary = CompactDictionary.build(names)
+        self.assertEqual([dictionary.id(name) for name in names], list(range(5000)))
+        queries = names[::-1] + ['page_{0}'.format(n) for n in range(5000, 5100)]
+        np.testing.assert_array_equal(dictionary.ids(queries), list(range(4999, -1, -1)) + [-1] * 100)
+        self.assertEqual(dictionary.names(np.arange(5000)), names)
+        self.assertEqual(dictionary.id('page_5000'), -1)
+        self.assertEqual(CompactDictionary.build([]).id('page_0'), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
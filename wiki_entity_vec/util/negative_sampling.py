@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized sampling of matrix cells that are not set (negatives).
+
+Cells are encoded as 64-bit keys, row * n_cols + col, so that a sorted key array is an index of
+the positives of a row range and membership tests are a binary search.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def encode_keys(rows, cols, n_cols):
+    return np.asarray(rows, dtype=np.uint64) * np.uint64(n_cols) + np.asarray(cols, dtype=np.uint64)
+
+
+def decode_keys(keys, n_cols):
+    keys = np.asarray(keys, dtype=np.uint64)
+    return keys // np.uint64(n_cols), keys % np.uint64(n_cols)
+
+
+def contains_sorted(sorted_keys, keys):
+    """ Boolean mask of the keys that are in sorted_keys. """
+    keys = np.asarray(keys, dtype=np.uint64)
+    if len(sorted_keys) == 0:
+        return np.zeros(keys.shape, dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
+
+
+def _accepted(keys, positive_keys, chosen_sorted, unique):
+    """ Mask of the candidate keys that are not positives and, when unique, that are neither
+    previous draws nor repeats of an earlier candidate. The candidates are sorted first, so that
+    the binary searches run over sorted queries.
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    reject = contains_sorted(positive_keys, sorted_keys)
+    if unique:
+        reject[1:] |= sorted_keys[1:] == sorted_keys[:-1]
+        reject |= contains_sorted(chosen_sorted, sorted_keys)
+    mask = np.empty(keys.shape, dtype=bool)
+    mask[order] = ~reject
+    return mask
+
+
+def sample_negatives(rng, n, row_start, row_end, n_cols, positive_keys, unique=True):
+    """ Draws n keys of cells in the rows [row_start, row_end) that are not in positive_keys.
+
+    Candidates are drawn in bulk, uniformly, and the ones that collide with a positive (or, when
+    unique, with a previous draw) are rejected and drawn again. The result only depends on the
+    state of rng, in the order the keys are returned.
+    positive_keys: sorted uint64 keys.
+    """
+    n_rows = row_end - row_start
+    available = n_rows * n_cols - len(positive_keys)
+    if (unique and n > available) or (n > 0 and available <= 0):
+        raise ValueError('{0} negatives requested for {1} free cells'.format(n, available))
+
+    density = len(positive_keys) / float(max(n_rows * n_cols, 1))
+    chosen = []
+    chosen_sorted = np.empty((0,), dtype=np.uint64)
+    remaining = n
+    while remaining > 0:
+        draw = int(remaining / max(1.0 - density, 0.01) * 1.05) + 16
+        keys = encode_keys(rng.randint(row_start, row_end, size=draw),
+                           rng.randint(0, n_cols, size=draw), n_cols)
+        keys = keys[_accepted(keys, positive_keys, chosen_sorted, unique)][:remaining]
+        chosen.append(keys)
+        remaining -= len(keys)
+        if unique and remaining > 0:
+            chosen_sorted = np.sort(np.concatenate([chosen_sorted, keys]))
+    return np.concatenate(chosen) if chosen else np.empty((0,), dtype=np.uint64)
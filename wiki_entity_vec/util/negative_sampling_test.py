@@ -0,0 +1,48 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from negative_sampling import contains_sorted, decode_keys, encode_keys, sample_negatives
+
+
+class NegativeSamplingTest(unittest.TestCase):
+    def test_keys(self):
+        rows = np.array([0, 5, 4000000000], dtype=np.uint32)
+        cols = np.array([7, 0, 3999999999], dtype=np.uint32)
+        keys = encode_keys(rows, cols, 4000000000)
+        self.assertEqual(keys.dtype, np.uint64)
+        decoded = decode_keys(keys, 4000000000)
+        np.testing.assert_array_equal(decoded[0], rows)
+        np.testing.assert_array_equal(decoded[1], cols)
+        np.testing.assert_array_equal(contains_sorted(np.sort(keys), keys[::-1]), [True] * 3)
+        self.assertFalse(contains_sorted(np.sort(keys), [1])[0])
+        self.assertFalse(contains_sorted(np.empty((0,), dtype=np.uint64), [1])[0])
+
+    def test_sample(self):
+        rng = np.random.RandomState(20190318)
+        positives = np.unique(encode_keys(rng.randint(100, 200, size=3000), rng.randint(0, 50, size=3000), 50))
+        negatives = sample_negatives(np.random.RandomState(1), 1500, 100, 200, 50, positives)
+        self.assertEqual(len(negatives), 1500)
+        self.assertEqual(len(np.unique(negatives)), 1500)
+        self.assertFalse(np.any(contains_sorted(positives, negatives)))
+        rows, cols = decode_keys(negatives, 50)
+        self.assertTrue(np.all((rows >= 100) & (rows < 200) & (cols < 50)))
+        np.testing.assert_array_equal(
+            negatives, sample_negatives(np.random.RandomState(1), 1500, 100, 200, 50, positives))
+
+        # Every free cell.
+        free = 100 * 50 - len(positives)
+        negatives = sample_negatives(np.random.RandomState(2), free, 100, 200, 50, positives)
+        np.testing.assert_array_equal(np.union1d(negatives, positives), np.arange(5000, 10000))
+        with self.assertRaises(ValueError):
+            sample_negatives(np.random.RandomState(2), free + 1, 100, 200, 50, positives)
+
+    def test_with_replacement(self):
+        positives = encode_keys([0, 0, 1], [0, 1, 1], 2)
+        negatives = sample_negatives(np.random.RandomState(3), 100, 0, 2, 2, positives, unique=False)
+        np.testing.assert_array_equal(negatives, np.full(100, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Buffered writer of matrix records.
+
+Records are accumulated in a preallocated RECORD_DTYPE buffer and written one block at a time,
+instead of one struct.pack('IIf', ...) call per record. Blocks can optionally be sorted by
+(row, col) and deduplicated; duplicates are only detected within a block.
+
+When the output is a filename, the record count is written to a <filename>.count sidecar on
+close, so that the size of a shard is known without reading it.
+"""
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+# Same layout as the DataGenerator.FORMAT records.
+RECORD_DTYPE = np.dtype([('row', np.uint32), ('col', np.uint32), ('value', np.float32)])
+
+COUNT_SUFFIX = '.count'
+
+
+def read_count(filename):
+    """ Returns the record count from the sidecar of a shard, or None if there is no sidecar. """
+    try:
+        with open(filename + COUNT_SUFFIX, 'r') as file:
+            return int(file.read())
+    except (IOError, OSError):
+        return None
+
+
+def write_count(filename, count):
+    """ Writes the record count sidecar of a shard. The sidecar is replaced atomically. """
+    with open(filename + COUNT_SUFFIX + '.tmp', 'w') as file:
+        file.write('{0}\n'.format(count))
+    os.rename(filename + COUNT_SUFFIX + '.tmp', filename + COUNT_SUFFIX)
+
+
+class RecordWriter(object):
+    """ Writes matrix records to a file.
+
+    output: a filename, an object with a write_records() method (such as CompressedShardWriter)
+    or a binary file object. Only the outputs opened by the writer are closed by close().
+    """
+    PENDING_SIZE = 4096
+
+    def __init__(self, output, buffer_size=256*1024, sort=False, dedup=False):
+        self._filename = None
+        if isinstance(output, str):
+            self._filename = output
+            output = open(output, 'wb')
+        self._output = output
+        self._write_records = getattr(output, 'write_records', None)
+        self._buffer = np.empty((buffer_size,), dtype=RECORD_DTYPE)
+        self._size = 0
+        self._pending = []
+        self._sort = sort or dedup
+        self._dedup = dedup
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def count(self):
+        """ Number of records written, excluding the duplicates dropped so far. """
+        return self._count + self._size + len(self._pending)
+
+    def write(self, row, col, value=1.0):
+        """ Writes a single record. Records are collected in a list and copied to the buffer in
+        batches, which is cheaper than assigning buffer elements one at a time.
+        """
+        self._pending.append((row, col, value))
+        if len(self._pending) == self.PENDING_SIZE:
+            self._move_pending()
+
+    def _move_pending(self):
+        pending = np.array(self._pending, dtype=RECORD_DTYPE)
+        self._pending = []
+        self._append(pending['row'], pending['col'], pending['value'])
+
+    def write_records(self, rows, cols, values=1.0):
+        """ Writes arrays of rows, columns and values; scalars are broadcast. """
+        if self._pending:
+            self._move_pending()
+        if np.ndim(cols) == 0:
+            rows, cols, values = np.broadcast_arrays(rows, cols, values)
+        self._append(rows, cols, values)
+
+    def _append(self, rows, cols, values):
+        # rows and values are either arrays with the length of cols or scalars.
+        n_records = len(cols)
+        start = 0
+        while start < n_records:
+            if self._size == len(self._buffer):
+                self.flush()
+            n = min(n_records - start, len(self._buffer) - self._size)
+            block = self._buffer[self._size:self._size + n]
+            if n == n_records:
+                block['row'] = rows
+                block['col'] = cols
+                block['value'] = values
+            else:
+                block['row'] = rows[start:start + n] if np.ndim(rows) else rows
+                block['col'] = cols[start:start + n]
+                block['value'] = values[start:start + n] if np.ndim(values) else values
+            self._size += n
+            start += n
+
+    def flush(self):
+        if self._pending:
+            self._move_pending()
+        records = self._buffer[:self._size]
+        if self._sort and len(records):
+            records = records[np.lexsort((records['col'], records['row']))]
+            if self._dedup:
+                keep = np.ones((len(records),), dtype=bool)
+                keep[1:] = (records['row'][1:] != records['row'][:-1]) | (records['col'][1:] != records['col'][:-1])
+                records = records[keep]
+        if len(records):
+            if self._write_records is not None:
+                self._write_records(records)
+            else:
+                self._output.write(records.tobytes())
+        self._count += len(records)
+        self._size = 0
+
+    def close(self):
+        """ Flushes the buffer and returns the number of records written. """
+        if self._output is None:
+            return self._count
+        self.flush()
+        if self._filename is not None:
+            self._output.close()
+            write_count(self._filename, self._count)
+        self._output = None
+        return self._count
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the write throughput of per record struct.pack calls with RecordWriter.
+
+The records are written in groups of --row_size entries, as generate_matrix.py writes the links
+of a page, to a file in a temporary directory. RecordWriter.write() is bound by the per call
+overhead of the interpreter; the gain comes from write_records().
+
+Usage: python record_writer_benchmark.py [--records=N] [--row_size=N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from record_writer import RecordWriter
+
+
+def write_struct(filename, rows, cols):
+    with open(filename, 'wb') as file:
+        for row, row_cols in zip(rows, cols):
+            for col in row_cols:
+                file.write(struct.pack('IIf', row, col, 1.0))
+
+
+def write_single(filename, rows, cols):
+    with RecordWriter(filename) as writer:
+        for row, row_cols in zip(rows, cols):
+            for col in row_cols:
+                writer.write(row, col)
+
+
+def write_rows(filename, rows, cols):
+    with RecordWriter(filename) as writer:
+        for row, row_cols in zip(rows, cols):
+            writer.write_records(row, row_cols)
+
+
+def write_sorted(filename, rows, cols):
+    with RecordWriter(filename, dedup=True) as writer:
+        for row, row_cols in zip(rows, cols):
+            writer.write_records(row, row_cols)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RecordWriter benchmark')
+    parser.add_argument('--records', type=int, default=4*1000*1000)
+    parser.add_argument('--row_size', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(20190318)
+    n_rows = args.records // args.row_size
+    rows = [int(row) for row in rng.permutation(n_rows)]
+    cols = [np.sort(rng.randint(0, 2*1000*1000, size=args.row_size)) for _ in range(n_rows)]
+    cols_list = [c.tolist() for c in cols]
+    n_records = n_rows * args.row_size
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, fn, data in [('struct.pack', write_struct, cols_list),
+                               ('write', write_single, cols_list),
+                               ('write_records', write_rows, cols),
+                               ('write_records dedup', write_sorted, cols)]:
+            filename = os.path.join(tmpdir, 'data.bin')
+            start = time.time()
+            fn(filename, rows, data)
+            elapsed = time.time() - start
+            print('{0:>20}: {1:>12.0f} entries/s'.format(name, n_records / elapsed))
+            os.remove(filename)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from __future__ import print_function
+import unittest
+
+import io
+import tempfile
+import os
+import struct
+
+import numpy as np
+
+from compressed import CompressedShard, CompressedShardWriter
+from data_generator import DataGenerator
+from record_writer import RECORD_DTYPE, RecordWriter, read_count
+
+
+class RecordWriterTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+
+    def test_struct_layout(self):
+        output = io.BytesIO()
+        with RecordWriter(output, buffer_size=3) as writer:
+            expected = b''
+            for n in range(10):
+                writer.write(n, 2 * n, n / 4.0)
+                expected += struct.pack('IIf', n, 2 * n, n / 4.0)
+            writer.write_records(np.arange(5), 7)
+            expected += b''.join(struct.pack('IIf', n, 7, 1.0) for n in range(5))
+            self.assertEqual(writer.count, 15)
+        self.assertEqual(output.getvalue(), expected)
+        self.assertFalse(output.closed)
+
+    def test_sidecar(self):
+        filename = os.path.join(self._tmpdir, 'data.bin.00000-of-00001')
+        rng = np.random.RandomState(20190318)
+        rows = rng.randint(0, 100, size=5000)
+        cols = rng.randint(0, 100, size=5000)
+        with RecordWriter(filename, buffer_size=1024) as writer:
+            writer.write_records(rows, cols, rng.rand(5000))
+        self.assertEqual(read_count(filename), 5000)
+        self.assertEqual(os.path.getsize(filename), 5000 * RECORD_DTYPE.itemsize)
+        self.assertIsNone(read_count(os.path.join(self._tmpdir, 'missing')))
+        gen = DataGenerator(self._tmpdir, 1, batch_size=5000)
+        X, _ = gen[0]
+        np.testing.assert_array_equal(X[:, 0], rows)
+        np.testing.assert_array_equal(X[:, 1], cols)
+
+    def test_dedup(self):
+        filename = os.path.join(self._tmpdir, 'dedup')
+        rows = np.array([3, 1, 3, 2, 1, 3])
+        cols = np.array([1, 5, 1, 0, 5, 0])
+        writer = RecordWriter(filename, dedup=True)
+        writer.write_records(rows, cols, np.arange(6))
+        self.assertEqual(writer.close(), 4)
+        records = np.fromfile(filename, dtype=RECORD_DTYPE)
+        self.assertEqual(records.tolist(), [(1, 5, 1.0), (2, 0, 3.0), (3, 0, 5.0), (3, 1, 0.0)])
+        self.assertEqual(read_count(filename), 4)
+
+    def test_compressed(self):
+        filename = os.path.join(self._tmpdir, 'data.z')
+        with CompressedShardWriter(filename, block_size=100) as output:
+            with RecordWriter(output, buffer_size=64, sort=True) as writer:
+                writer.write_records(np.arange(1000)[::-1], 1)
+        shard = CompressedShard(filename)
+        self.assertEqual(len(shard), 1000)
+        self.assertEqual(shard[0:1]['row'][0], 936)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic sparse matrices for tests and benchmarks.
+
+Shards are partitioned by row blocks, as produced by zero_injector.py, and generated one shard
+at a time with vectorized NumPy sampling, so that datasets much larger than memory can be built.
+"""
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from . import columnar
+from . import compressed
+
+FORMATS = ('bin', 'z', 'columnar')
+
+
+def shard_records(shape, density, shard_id, num_shards, seed=20190318, values='ones'):
+    """ Returns the sorted records of the row block of a shard.
+    Each cell is set with probability density (approximately: duplicates are dropped).
+    values: 'ones' sets every value to 1.0, 'binary' to 0.0 or 1.0 and 'uniform' to [0, 1).
+    """
+    rng = np.random.RandomState([seed, shard_id])
+    block_size = (shape[0] - 1) // num_shards + 1
+    row_start = min(shard_id * block_size, shape[0])
+    row_end = min(row_start + block_size, shape[0])
+    cells = (row_end - row_start) * shape[1]
+    n_records = rng.binomial(cells, density) if cells else 0
+    keys = np.unique(rng.randint(0, max(cells, 1), size=n_records, dtype=np.int64))
+
+    records = np.empty((len(keys),), dtype=compressed.RECORD_DTYPE)
+    records['row'] = row_start + keys // shape[1]
+    records['col'] = keys % shape[1]
+    if values == 'ones':
+        records['value'] = 1.0
+    elif values == 'binary':
+        records['value'] = rng.randint(0, 2, size=len(keys))
+    elif values == 'uniform':
+        records['value'] = rng.rand(len(keys))
+    else:
+        raise ValueError('unknown values: {0}'.format(values))
+    return records
+
+
+def generate_shards(data_dir, shape, density, num_shards, seed=20190318, values='ones', fmt='bin'):
+    """ Writes a synthetic matrix to data_dir in one of FORMATS. Returns the record count of each shard.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown format: {0}'.format(fmt))
+    os.makedirs(data_dir, exist_ok=True)
+    counts = []
+    entries = []
+    for shard_id in range(num_shards):
+        records = shard_records(shape, density, shard_id, num_shards, seed=seed, values=values)
+        counts.append(len(records))
+        if fmt == 'bin':
+            records.tofile(os.path.join(data_dir, 'data.bin.{0:05d}-of-{1:05d}'.format(shard_id, num_shards)))
+        elif fmt == 'z':
+            with compressed.CompressedShardWriter(compressed.shard_filename(data_dir, shard_id, num_shards)) as writer:
+                writer.write_records(records)
+        else:
+            writer = columnar.ShardWriter(data_dir, shard_id, num_shards)
+            writer.write(records['row'], records['col'], records['value'])
+            entries.append(writer.close())
+    if fmt == 'columnar':
+        columnar.write_manifest(data_dir, shape, entries)
+    return counts
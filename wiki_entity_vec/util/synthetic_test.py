@@ -0,0 +1,45 @@
+from __future__ import print_function
+import unittest
+
+import tempfile
+import os
+
+import numpy as np
+
+from wiki_entity_vec.util.data_generator import DataGenerator
+from wiki_entity_vec.util.synthetic import generate_shards, shard_records
+
+
+class SyntheticTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        print('TMPDIR={0}'.format(self._tmpdir))
+
+    def test_shard_records(self):
+        shape = (1000, 2000)
+        records = [shard_records(shape, 0.01, shard_id, 8) for shard_id in range(8)]
+        for shard_id, shard in enumerate(records):
+            self.assertTrue(np.all(shard['row'] // 125 == shard_id))
+            keys = shard['row'].astype(np.int64) * shape[1] + shard['col']
+            self.assertTrue(np.all(np.diff(keys) > 0))
+        total = sum(len(shard) for shard in records)
+        self.assertAlmostEqual(total / float(shape[0] * shape[1]), 0.01, delta=0.001)
+        np.testing.assert_array_equal(records[3], shard_records(shape, 0.01, 3, 8))
+
+    def test_formats(self):
+        expected = None
+        for fmt in ['bin', 'z', 'columnar']:
+            data_dir = os.path.join(self._tmpdir, fmt)
+            counts = generate_shards(data_dir, (500, 700), 0.02, 4, values='binary', fmt=fmt)
+            gen = DataGenerator(data_dir, 4, batch_size=1024)
+            self.assertEqual(gen.size(), sum(counts))
+            batches = [gen[batch] for batch in range(len(gen))]
+            data = np.vstack([X for X, _ in batches]), np.hstack([y for _, y in batches])
+            if expected is None:
+                expected = data
+            np.testing.assert_array_equal(data[0], expected[0])
+            np.testing.assert_array_equal(data[1], expected[1])
+
+
+if __name__ == '__main__':
+    unittest.main()